@@ -1,7 +1,6 @@
 import os
 
-from pybullet_tools.utils import reset_simulation, AABB, \
-    get_aabb_extent, get_aabb_center, get_aabb, get_point, get_joint_positions
+from pybullet_tools.utils import reset_simulation, get_aabb_extent, get_aabb, get_point, get_joint_positions
 from pybullet_tools.bullet_utils import get_door_links
 
 from world_builder.world import State
@@ -12,7 +11,12 @@ from os import listdir
 from os.path import join, isdir, isfile
 
 # from utils import load_lisdf_synthesizer
-from data_generator.run_utils import copy_dir_for_process, get_data_processing_parser, process_all_tasks
+from data_generator.run_utils import get_data_processing_parser, process_all_tasks
+from examples.dataset_utils import stage_run_dir, unstage_run_dir
+from examples.feature_utils import FEATURES_FILE, get_group_aabbs, compute_aabb_features, \
+    compute_reachability_features, save_features, features_to_lines, ReachabilityCache, get_robot_key, \
+    get_body_fingerprint, get_obstacles_fingerprint
+from examples.loading_utils import use_lisdf_cache
 
 # DEFAULT_TASK = 'mm'
 DEFAULT_TASK = 'tt'
@@ -29,45 +33,22 @@ args = parser.parse_args()
 
 USE_VIEWER = args.viewer
 CHECK_TIME = 1664399646.826951
+SAVE_FEATURES_TXT = True  ## also write the older features.txt format
+CACHE_REACHABILITY = True  ## reuse reachability answers for the same robot, body pose and obstacles
+CACHE_LISDF = True  ## parse each scene.lisdf once, later loads of the same content come from temp/lisdf_cache
+if CACHE_LISDF:
+    use_lisdf_cache()
 
 
 def add_features(test_dir, viz_dir, verbose=False):
-    ori_file = join(viz_dir, 'features.txt')
+    ori_file = join(viz_dir, FEATURES_FILE)
     print('\n'+ori_file)
 
     if isfile(ori_file) and os.path.getmtime(ori_file) > CHECK_TIME:
         return
 
-    REACHABILITY = 'reachability'
-    AABBY = 'aabby'
-    DISTANCEY = 'distancey'
-
-    data = {k: {} for k in [REACHABILITY, AABBY, DISTANCEY]}
-    lines_ori = []
-    if isfile(ori_file):
-        lines_ori = [l.strip() for l in open(ori_file, 'r').readlines()]
-        for l in lines_ori:
-            tup = l.split(' ')
-            key = tup[0]
-            if 'reachable' in key:
-                data[REACHABILITY][tup[1]] = key
-            elif AABBY in key:
-                data[key][tup[1]] = tup[2]
-            elif DISTANCEY in key:
-                if tup[1] not in data[key]:
-                    data[key][tup[1]] = {}
-                data[key][tup[1]][tup[2]] = tup[3]
-
-    REACHABLE_OBJ = "reachable {object}"
-    UNREACHABLE_OBJ = "unreachable {object}"
-    REACHABLE_SPACE = "reachable {space}"
-    UNREACHABLE_SPACE = "unreachable {space}"
-    LINE_AABBY = AABBY + " {name} {width}"
-    LINE_DISTANCEY = DISTANCEY + " {movable} {obstacle} {distance}"
-
     world = load_lisdf_pybullet(test_dir, use_gui=USE_VIEWER, verbose=False)
     world.check_world_obstacles()
-    old_file = join(test_dir, 'features.txt')
     custom_limits = world.robot.custom_limits
     init_q = get_joint_positions(world.robot, world.robot.get_base_joints())[:-1]
     init_q = list(init_q) + [0] * 3
@@ -82,20 +63,23 @@ def add_features(test_dir, viz_dir, verbose=False):
     doors = world.cat_to_bodies('door', init)
     movable = [o for n, o in world.name_to_body.items() if 'veggie' in n or 'meat' in n]
     obstacles = [o for n, o in world.name_to_body.items() if o not in movable and o != robot]
-    lines = []
+    reachability = []
+
+    cache = ReachabilityCache(robot=type(robot).__name__) if CACHE_REACHABILITY else None
+    robot_key = get_robot_key(robot, custom_limits, init_q)
+    obstacles_key = get_obstacles_fingerprint(obstacles) if cache is not None else None
+
+    def check_reachability(body_key, check_fn):
+        if cache is None:
+            return check_fn()
+        return cache.check([robot_key, body_key, obstacles_key], check_fn)
 
     """ ============== reachability of movable objects ============= """
     for body in movable:
         name = world.body_to_name[body]
-        # if name in data[REACHABILITY]:
-        #     lines.append(' '.join([data[REACHABILITY][name], name]))
-        #     continue
-        result = robot.check_reachability(body, problem, obstacles=obstacles)
-
-        if result:
-            lines.append(REACHABLE_OBJ.format(object=name))
-        else:
-            lines.append(UNREACHABLE_OBJ.format(object=name))
+        result = check_reachability(get_body_fingerprint(body),
+                                    lambda: robot.check_reachability(body, problem, obstacles=obstacles))
+        reachability.append((name, 'object', result))
 
     """ ============== reachability of spaces ============= """
 
@@ -105,71 +89,46 @@ def add_features(test_dir, viz_dir, verbose=False):
     }
     print('reachability of spaces')
     for space in spaces:
-        # if space in data[REACHABILITY]:
-        #     lines.append(' '.join([data[REACHABILITY][space], space]))
-        #     continue
         body_link = indices_inv[space]
         if space not in world.name_to_body:
             body_name = names[space[:space.index('::')]]
             world.add_body(body_link, body_name)
 
-        result = robot.check_reachability_space(body_link, problem, obstacles=obstacles)
-        if result:
-            lines.append(REACHABLE_SPACE.format(space=space))
-        else:
-            lines.append(UNREACHABLE_SPACE.format(space=space))
-
-    """ ============== width of objects and links ============= """
-    aabbs = {}
-    for space in spaces:
-        body_link = indices_inv[space]
-        aabbs[space] = get_aabb(body_link[0], body_link[-1])
-    for door in doors:
-        body_joint = indices_inv[door]
-        links = get_door_links(body_joint[0], body_joint[1])
-        group_lower = [1000] * 3
-        group_upper = [-1000] * 3
-        for l in links:
-            lower, upper = get_aabb(body_joint[0], link=l)
-            for i in range(3):
-                if group_upper[i] < upper[i]:
-                    group_upper[i] = upper[i]
-                if group_lower[i] > lower[i]:
-                    group_lower[i] = lower[i]
-        aabbs[door] = AABB(group_lower, group_upper)
-
-    bodies = movable + [indices_inv[s] for s in spaces] + [indices_inv[d] for d in doors]
-    for body in bodies:
-        name = indices[str(body)]
-        # if name in data[AABBY]:
-        #     lines.append(LINE_AABBY.format(name=name, width=data[AABBY][name]))
-        #     continue
-        if isinstance(body, int):
-            aabb = get_aabb(body)
-        else:
-            aabb = aabbs[name]
-        lines.append(LINE_AABBY.format(name=name, width=round(get_aabb_extent(aabb)[1], 3)))
-
-    """ ============ distance between movable and spaces and joints =========== """
-    for body in movable:
-        name = world.body_to_name[body]
-        y_body = get_aabb_center(get_aabb(body))[1]
-        for o, o_aabb in aabbs.items():
-            if name in data[AABBY]:
-                lines.append(LINE_DISTANCEY.format(movable=name, obstacle=o,
-                                                   distance=data[DISTANCEY][name][o]))
-                continue
-            y = y_body - get_aabb_center(o_aabb)[1]
-            lines.append(LINE_DISTANCEY.format(movable=name, obstacle=o, distance=round(y, 3)))
+        result = check_reachability(get_body_fingerprint(body_link[0], body_link[-1]),
+                                    lambda: robot.check_reachability_space(body_link, problem, obstacles=obstacles))
+        reachability.append((space, 'space', result))
+    if cache is not None:
+        cache.summarize()
+        cache.close()
+
+    """ ============== width of objects and links, distance between movable and spaces and joints ============= """
+    def get_aabb_fn(body, link):
+        return tuple(get_aabb(body, link=link))
+
+    door_links = {d: get_door_links(*indices_inv[d][:2]) for d in doors}
+    skipped = [d for d in doors if len(door_links[d]) == 0]
+    if len(skipped) > 0:
+        print('doors without links, no aabb features', skipped)
+    doors = [d for d in doors if d not in skipped]
+    regions = spaces + doors
+    groups = [[(indices_inv[s][0], indices_inv[s][-1])] for s in spaces]
+    groups += [[(indices_inv[d][0], l) for l in door_links[d]] for d in doors]
+    features = compute_aabb_features(
+        [world.body_to_name[b] for b in movable], get_group_aabbs([[(b, None)] for b in movable], get_aabb_fn),
+        regions, get_group_aabbs(groups, get_aabb_fn),
+        aabb_names=[indices[str(b)] for b in movable] + regions)
+    features.update(compute_reachability_features(*zip(*reachability)) if len(reachability) > 0 else
+                    compute_reachability_features([], [], []))
 
     """ ============== save in file ============= """
-    if isfile(ori_file):
-        os.remove(ori_file)
-    lines = '\n'.join(lines)
-    with open(old_file, 'w') as f:
-        f.writelines(lines)
-    print(lines, '\n')
-    shutil.copy(old_file, ori_file)
+    save_features(join(test_dir, FEATURES_FILE), features)
+    shutil.copy(join(test_dir, FEATURES_FILE), ori_file)
+    if SAVE_FEATURES_TXT:
+        lines = '\n'.join(features_to_lines(features))
+        with open(join(viz_dir, 'features.txt'), 'w') as f:
+            f.writelines(lines)
+        if verbose:
+            print(lines, '\n')
     reset_simulation()
     # sys.exit()
 
@@ -227,12 +186,12 @@ def replace_scale(lines, name, new_scale):
 
 
 def process(viz_dir):
-    test_dir = copy_dir_for_process(viz_dir)
+    test_dir = stage_run_dir(viz_dir)
 
     # load_lisdf_synthesizer(test_dir)
     # adjust_table_scale(test_dir, viz_dir)
     add_features(test_dir, viz_dir)
-    shutil.rmtree(test_dir)
+    unstage_run_dir(test_dir)
 
 
 def duplicate_baseline(viz_dir, old_dir, new_dir):
@@ -6,7 +6,9 @@ from pybullet_tools.utils import connect
 from isaac_tools.gym_utils import images_to_gif, load_obj_shots_bg, take_obj_shot
 
 from config import MAMAO_DATA_PATH, ASSET_PATH
-from examples.test_utils import copy_dir_for_process, get_sample_envs_200
+from examples.test_utils import get_sample_envs_200
+from examples.dataset_utils import stage_run_dir, unstage_run_dir
+from examples.loading_utils import ASSET_REGISTRY
 
 
 ###########################################################################
@@ -15,7 +17,7 @@ from examples.test_utils import copy_dir_for_process, get_sample_envs_200
 def test_load_lisdf():
     from isaac_tools.gym_utils import load_lisdf
     ori_dir = join(MAMAO_DATA_PATH, 'mm_sink_to_storage/22')
-    lisdf_dir = copy_dir_for_process(ori_dir)
+    lisdf_dir = stage_run_dir(ori_dir)
     for name, path, scale, is_fixed, pose, positions in load_lisdf(lisdf_dir, robots=True):
         print(name, positions)
 
@@ -27,11 +29,11 @@ def test_load_one(loading_effect=False, **kwargs):
     ori_dir = '/home/yang/Documents/kitchen-worlds/outputs/test_full_kitchen/1230-134950_original_1'
     ori_dir = join(MAMAO_DATA_PATH, 'mm_sink_to_storage/84')
     ori_dir = join(MAMAO_DATA_PATH, 'mm_sink_to_storage/23')
-    lisdf_dir = copy_dir_for_process(ori_dir)
+    lisdf_dir = stage_run_dir(ori_dir)
     world = load_lisdf_isaacgym(abspath(lisdf_dir), pause=True, loading_effect=loading_effect, **kwargs)
     if loading_effect:
         shutil.move(join(lisdf_dir, world), join(ori_dir, world))
-    shutil.rmtree(lisdf_dir)
+    unstage_run_dir(lisdf_dir)
 
 
 def test_load_multiple(test_camera_pose=False):
@@ -39,7 +41,7 @@ def test_load_multiple(test_camera_pose=False):
     # ori_dirs = get_envs_from_task()
     # ori_dirs = get_sample_envs_for_corl()
     ori_dirs = get_sample_envs_200()
-    lisdf_dirs = [copy_dir_for_process(ori_dir) for ori_dir in ori_dirs]
+    lisdf_dirs = [stage_run_dir(ori_dir) for ori_dir in ori_dirs]
     kwargs = dict()
     if len(ori_dirs) == 25:
         camera_point_begin = (34, 15, 10)
@@ -72,7 +74,7 @@ def test_load_multiple(test_camera_pose=False):
 
     print('test_load_multiple | to remove', len(lisdf_dirs))
     for lisdf_dir in lisdf_dirs:
-        shutil.rmtree(lisdf_dir)
+        unstage_run_dir(lisdf_dir)
 
 
 def test_load_objects(save_obj_shots=False, width=1980, height=1238):
@@ -116,7 +118,9 @@ def test_load_objects(save_obj_shots=False, width=1980, height=1238):
     # categories = ['Food']
     # ids = ['MeatTurkeyLeg', 'VeggieGreenPepper', 'VeggieTomato']  ## 'VeggieSweetPotato', 'MeatTurkeyLeg', 'VeggieTomato',
 
-    assets = {}
+    ASSET_REGISTRY.register_backend('gym', load_fn=lambda cat, idx, scale, path: gym_world.simulator.load_asset(
+        asset_file=path, root=None, fixed_base=True, gravity_comp=False, collapse=False, vhacd=False),
+        size_fn=lambda asset, path: getsize(path))
     count = 0
     for k in range(1):
         for i in range(len(categories)):
@@ -132,13 +136,7 @@ def test_load_objects(save_obj_shots=False, width=1980, height=1238):
                     continue
                 path = join(ASSET_PATH, 'models', cat, idx, 'mobility.urdf')
                 print(f'    {count} | isfile({(cat, idx)})', f"{round(getsize(path)/(1024**2), 4)} mb")
-                if (cat, idx) not in assets:
-                    asset = gym_world.simulator.load_asset(
-                        asset_file=path, root=None, fixed_base=True,
-                        gravity_comp=False, collapse=False, vhacd=False)
-                    assets[(cat, idx)] = asset
-                else:
-                    asset = assets[(cat, idx)]
+                asset = ASSET_REGISTRY.get('gym', cat, idx, path=path)
                 scale = get_scale_by_category(file=path, category=cat)
                 actor = gym_world.create_actor(asset, name=idx, scale=scale)
                 pose = transformations.translation_matrix([i, j+12*k, 0.1]) @ \
@@ -158,6 +156,7 @@ def test_load_objects(save_obj_shots=False, width=1980, height=1238):
             gym_world.simulator.update_viewer()
             gym_world.set_viewer_target((3+i, 3+j+12*k, 3), target=(i, j+12*k, 0))
         # gym_world.wait_if_gui()
+    ASSET_REGISTRY.summarize()
     gym_world.wait_if_gui()
 
 
@@ -1,7 +1,7 @@
-import shutil
-
 from examples.config import ASSET_PATH, EXP_PATH, OUTPUT_PATH, MAMAO_DATA_PATH
-from os.path import join, abspath, isdir
+from examples.dataset_utils import stage_run_dir, unstage_run_dir
+from examples.loading_utils import use_lisdf_cache
+from os.path import join, abspath
 from os import listdir
 from pybullet_planning.lisdf_tools.lisdf_loader import load_lisdf_pybullet
 from pybullet_planning.pybullet_tools.utils import wait_if_gui, disconnect, reset_simulation
@@ -27,10 +27,7 @@ def load_dataset_cases(task_name='one_fridge_pick_pr2'):
     lisdf_paths = ['11']  ## [f for f in listdir(task_dir)]
 
     for f in lisdf_paths:
-        old_path = join(task_dir, f)
-        new_path = join(OUTPUT_PATH, f)
-        if not isdir(new_path):
-            shutil.copytree(old_path, new_path)
+        new_path = stage_run_dir(join(task_dir, f))
 
         world = load_lisdf_pybullet(new_path)
 
@@ -41,9 +38,10 @@ def load_dataset_cases(task_name='one_fridge_pick_pr2'):
         wait_if_gui('load next test scene?')
         reset_simulation()
 
-        shutil.rmtree(new_path)
+        unstage_run_dir(new_path)
 
 
 if __name__ == "__main__":
+    use_lisdf_cache()
     task_name='one_fridge_pick_pr2'
     load_dataset_cases(task_name)
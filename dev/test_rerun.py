@@ -8,7 +8,7 @@ import shutil
 import copy
 import sys
 from os import listdir
-from os.path import join, dirname, isdir, isfile
+from os.path import join, dirname, isdir, isfile, abspath, basename
 import numpy as np
 import random
 import time
@@ -31,7 +31,14 @@ from pigi_tools.data_utils import exist_instance, get_indices, \
     modify_plan_with_body_map, add_to_planning_config, load_planning_config, \
     add_objects_and_facts, delete_wrongly_supported
 
-from examples.test_utils import process_all_tasks, copy_dir_for_process, get_data_processing_parser
+from examples.test_utils import process_all_tasks, get_data_processing_parser
+from examples.config import MAMAO_DATA_PATH
+from examples.dataset_utils import stage_run_dir, unstage_run_dir, append_result, load_latest_results, get_run_dirs
+from examples.planning_utils import solve_in_replicas, merge_fc_logs, StreamProfiler, replace_stream_map, \
+    FeasibilityPrefilter, get_movable_bodies, append_prefilter_result, PREFILTER_LEDGER, BudgetAllocator, \
+    StreamMemoizer
+from examples.trajectory_utils import save_trajectory, replay_trajectory, audit_trajectory, Trajectory
+from examples.loading_utils import use_lisdf_cache, use_asset_registry
 
 ## special modes
 GENERATE_MULTIPLE_SOLUTIONS = False
@@ -79,6 +86,19 @@ if CASES is not None:
     SKIP_IF_SOLVED_RECENTLY = False
 
 PARALLEL = GENERATE_SKELETONS and False
+PARALLEL_SKELETONS = 0  ## > 1 to split the skeletons of one problem across forked world replicas
+PROFILE_STREAMS = False  ## save call counts, success rates and latencies of each stream next to the plan
+MEMOIZE_STREAMS = False  ## share stream samples between skeletons that call a stream with equal inputs
+CACHE_LISDF = True  ## parse each scene.lisdf once, later loads of the same content come from temp/lisdf_cache
+SHARE_ASSETS = True  ## create single-link assets from collision and visual shapes kept across world loads
+SAVE_TRAJECTORY = False  ## also save the commands as memory-mappable arrays next to the pickle
+FAST_REPLAY = False  ## kinematic playback of the saved trajectory instead of stepping through the commands
+AUDIT_COLLISIONS = False  ## save the clearances along the trajectory, needs SAVE_TRAJECTORY
+CFREE_RANGE = 0.1
+PREFILTER = False  ## reject problems whose goal clearly can't be reached before planning
+PREFILTER_TIME = 5
+ADAPTIVE_BUDGETS = False  ## learn the time limit of each task from its past attempts in the results ledger
+CAMPAIGN_BUDGET = None  ## cpu seconds, only plan the runs of the most efficient tasks that fit in it
 FEASIBILITY_CHECKER = 'None'  ## 'pvt-56', 'pvt-task'
 ## None | oracle | pvt | pvt* | pvt-task | pvt-all | binary | shuffle | heuristic
 if GENERATE_SKELETONS:
@@ -113,6 +133,23 @@ FEASIBILITY_CHECKER = args.f
 
 # DATABASE_DIR = abspath(join(MAMAO_DATA_PATH, TASK_NAME))
 
+## append-only record of (run, fc, mode, status, planning_time, timestamp) for the default rerun mode
+USE_RESULTS_LEDGER = not (CLEAN_LARGE_WORLD or GENERATE_NEW_PROBLEM or GENERATE_NEW_LABELS or
+                          GENERATE_SKELETONS or GENERATE_MULTIPLE_SOLUTIONS)
+RESULTS_LEDGER = join(MAMAO_DATA_PATH, f'{RERUN_SUBDIR}_results.jsonl')
+MODE = 'diverse' if DIVERSE else 'default'
+PREFILTER_LEDGER_FILE = join(MAMAO_DATA_PATH, f'{RERUN_SUBDIR}_{PREFILTER_LEDGER}')
+
+DEFAULT_BUDGET = dict(downward_time=downward_time, evaluation_time=evaluation_time, max_plans=100,
+                      max_time=6 * 60 + downward_time)
+budget_allocator = None
+if ADAPTIVE_BUDGETS and USE_RESULTS_LEDGER:
+    budget_allocator = BudgetAllocator(RESULTS_LEDGER, fc=FEASIBILITY_CHECKER, mode=MODE)
+if CACHE_LISDF:
+    use_lisdf_cache()
+if SHARE_ASSETS:
+    use_asset_registry()
+
 
 #####################################
 
@@ -203,6 +240,65 @@ def check_if_skip(run_dir, **kwargs):
     return skip
 
 
+def get_base_limits(robot):
+    """ ((x_min, x_max), (y_min, y_max)) of the base from the robot's custom limits """
+    joints = robot.get_base_joints()[:2]
+    if any(j not in robot.custom_limits for j in joints):
+        return None
+    return [robot.custom_limits[j] for j in joints]
+
+
+def get_campaign_case_filter(case_filter=None):
+    """ the pending runs of each task that `BudgetAllocator.plan_campaign` fits in CAMPAIGN_BUDGET """
+    from examples.test_utils import get_task_names
+    pending = {}
+    for task in get_task_names(args.t):
+        task_dir = join(MAMAO_DATA_PATH, task)
+        if isdir(task_dir):
+            pending[task] = [d for d in get_run_dirs(task_dir) if case_filter is None or case_filter(d)]
+    allocation = budget_allocator.plan_campaign({t: len(d) for t, d in pending.items()},
+                                                CAMPAIGN_BUDGET, DEFAULT_BUDGET)
+    selected = set(abspath(d) for t, dirs in pending.items() for d in dirs[:allocation[t]])
+    return lambda run_dir: abspath(run_dir) in selected
+
+
+def check_if_skip_by_result(record):
+    """ same decision as the default branch of `check_if_skip`, from a ledger record """
+    if record is None or record['status'] == 'timeout':
+        return False
+    failed = record['status'] == 'failed'
+    if RETRY_IF_FAILED and failed:
+        return False
+    if SKIP_IF_SOLVED:
+        return True
+    if SKIP_IF_SOLVED_RECENTLY:
+        return record['timestamp'] > check_time
+    return False
+
+
+def get_ledger_case_filter():
+    """ read the ledger once, so that `process_all_tasks` drops solved runs before spawning processes,
+        runs without a record but with an old plan_rerun json are added to the ledger on the way """
+    results = load_latest_results(RESULTS_LEDGER)
+
+    def case_filter(run_dir):
+        key = (abspath(run_dir), FEASIBILITY_CHECKER, MODE)
+        if key not in results:
+            file = join(run_dir, RERUN_SUBDIR, f'{PREFIX}plan_rerun_fc={FEASIBILITY_CHECKER}.json')
+            if not isfile(file):
+                return True
+            data = json.load(open(file, 'r'))
+            status = 'failed' if data['plan'] is None else 'solved'
+            results[key] = append_result(RESULTS_LEDGER, run_dir, FEASIBILITY_CHECKER, MODE, status,
+                                         data['planning_time'], timestamp=os.path.getmtime(file))
+        skip = check_if_skip_by_result(results[key])
+        if skip:
+            print('skipping solved problem', run_dir)
+        return not skip
+
+    return case_filter
+
+
 def run_one(run_dir, parallel=False, SKIP_IF_SOLVED=SKIP_IF_SOLVED):
     from pybullet_tools.logging import myprint as print
     ori_dir = join(run_dir, RERUN_SUBDIR)
@@ -240,7 +336,7 @@ def run_one(run_dir, parallel=False, SKIP_IF_SOLVED=SKIP_IF_SOLVED):
     #######################################################
     if not isdir(ori_dir):
         os.mkdir(ori_dir)
-    if check_if_skip(run_dir):
+    if not USE_RESULTS_LEDGER and check_if_skip(run_dir):
         return
 
     if CLEAN_LARGE_WORLD:
@@ -250,7 +346,7 @@ def run_one(run_dir, parallel=False, SKIP_IF_SOLVED=SKIP_IF_SOLVED):
     larger_world = USE_LARGE_WORLD or GENERATE_NEW_LABELS
 
     initialize_logs()
-    exp_dir = copy_dir_for_process(run_dir, tag='rerunning')
+    exp_dir = stage_run_dir(run_dir, tag='rerunning')
 
     if False:
         from isaac_tools.urdf_utils import load_lisdf_synthesizer
@@ -274,7 +370,7 @@ def run_one(run_dir, parallel=False, SKIP_IF_SOLVED=SKIP_IF_SOLVED):
                     join(ori_dir, 'diverse_runlog_fc=None.json'))
 
     # reset_simulation()
-    # shutil.rmtree(exp_dir)
+    # unstage_run_dir(exp_dir)
     # return
 
     saver = WorldSaver()
@@ -288,6 +384,15 @@ def run_one(run_dir, parallel=False, SKIP_IF_SOLVED=SKIP_IF_SOLVED):
     pddlstream_problem = pddlstream_from_dir(problem, exp_dir=exp_dir, replace_pddl=True,
                                              collisions=not args.cfree, teleport=False,
                                              larger_world=larger_world)
+    if MEMOIZE_STREAMS or PROFILE_STREAMS:
+        stream_map = pddlstream_problem[3]
+        if MEMOIZE_STREAMS:
+            stream_memoizer = StreamMemoizer()
+            stream_map = stream_memoizer.wrap_stream_map(stream_map)
+        if PROFILE_STREAMS:
+            stream_profiler = StreamProfiler()
+            stream_map = stream_profiler.wrap_stream_map(stream_map)
+        pddlstream_problem = replace_stream_map(pddlstream_problem, stream_map)
     _, _, _, stream_map, init, goal = pddlstream_problem
     world.summarize_facts(init)
     print_goal(goal)
@@ -311,11 +416,25 @@ def run_one(run_dir, parallel=False, SKIP_IF_SOLVED=SKIP_IF_SOLVED):
         add_to_planning_config(run_dir, {'body_to_name_new': added_body_to_name})
 
         reset_simulation()
-        shutil.rmtree(exp_dir)
+        unstage_run_dir(exp_dir)
         return
 
     ######################################################
 
+    if PREFILTER and not (GENERATE_SKELETONS or GENERATE_NEW_LABELS):
+        robot_body = world.robot.body
+        prefilter = FeasibilityPrefilter(base_limits=get_base_limits(world.robot), time_budget=PREFILTER_TIME,
+                                         obstacles=[o for o in world.name_to_body.values() if o != robot_body],
+                                         movable=get_movable_bodies(init), stream_map=stream_map)
+        prefilter_result = prefilter.check(goal)
+        append_prefilter_result(PREFILTER_LEDGER_FILE, run_dir, prefilter_result, task=basename(dirname(run_dir)))
+        if not prefilter_result['accepted']:
+            ## only kept in the prefilter ledger, the run is checked again next time instead of being skipped
+            print(f"rejected {run_dir} | {prefilter_result['reason']} | {prefilter_result['detail']}")
+            reset_simulation()
+            unstage_run_dir(exp_dir)
+            return
+
     stream_info = world.robot.get_stream_info(partial=False, defer=False)
     print(SEPARATOR)
 
@@ -327,15 +446,20 @@ def run_one(run_dir, parallel=False, SKIP_IF_SOLVED=SKIP_IF_SOLVED):
         fc = get_feasibility_checker(run_dir, mode=FEASIBILITY_CHECKER, diverse=DIVERSE, world=world)
     # fc = Shuffler()
 
+    budget = DEFAULT_BUDGET
+    if budget_allocator is not None:
+        budget = budget_allocator.get_budget(basename(dirname(run_dir)), DEFAULT_BUDGET)
+        print(f"planning budget | {budget['max_time']} sec, expected success {budget['expected_success']}")
+
     start = time.time()
     collect_dataset = False
     kwargs = dict(fc=fc, lock=args.lock)
     if DIVERSE:
         kwargs.update(dict(
             diverse=DIVERSE,
-            downward_time=downward_time,  ## max time to get 100, 10 sec, 30 sec for 300
-            evaluation_time=evaluation_time,  ## on each skeleton
-            max_plans=100,  ## number of skeletons
+            downward_time=budget['downward_time'],  ## max time to get 100, 10 sec, 30 sec for 300
+            evaluation_time=budget['evaluation_time'],  ## on each skeleton
+            max_plans=budget['max_plans'],  ## number of skeletons
             visualize=True,
         ))
         # if FEASIBILITY_CHECKER == 'larger' and '_braiser' in run_dir:
@@ -352,18 +476,27 @@ def run_one(run_dir, parallel=False, SKIP_IF_SOLVED=SKIP_IF_SOLVED):
             kwargs['collect_dataset'] = True
 
     cwd = os.getcwd()
-    max_time = 6 * 60 + downward_time
+    max_time = budget['max_time']
     solution = 'failed'
+    replica_logs = None
+    use_replicas = PARALLEL_SKELETONS > 1 and not has_gui() and not (GENERATE_SKELETONS or GENERATE_NEW_LABELS)
     with timeout(duration=max_time):
         if parallel:
             solution = solve_multiple(pddlstream_problem, stream_info, **kwargs)
             solution, cwd_saver = solution
             cwd = cwd_saver.tmp_cwd
+        elif use_replicas:
+            solve_fn = lambda **kw: solve_one(pddlstream_problem, stream_info, **kw)
+            solution, replica_logs = solve_in_replicas(
+                solve_fn, fc, PARALLEL_SKELETONS, ori_dir, **{k: v for k, v in kwargs.items() if k != 'fc'})
         else:
             solution = solve_one(pddlstream_problem, stream_info, **kwargs)
     if solution == 'failed':
+        if USE_RESULTS_LEDGER:
+            append_result(RESULTS_LEDGER, run_dir, FEASIBILITY_CHECKER, MODE, 'timeout', time.time() - start,
+                          max_time=max_time)
         reset_simulation()
-        shutil.rmtree(exp_dir)
+        unstage_run_dir(exp_dir)
         return
 
     if GENERATE_MULTIPLE_SOLUTIONS:
@@ -381,7 +514,7 @@ def run_one(run_dir, parallel=False, SKIP_IF_SOLVED=SKIP_IF_SOLVED):
         file_name = f'diverse_plans_larger.json' if GENERATE_NEW_LABELS else 'diverse_plans.json'
         fc.dump_log(join(run_dir, file_name), plans_only=True)
         reset_simulation()
-        shutil.rmtree(exp_dir)
+        unstage_run_dir(exp_dir)
         return
 
     planning_time = time.time() - start
@@ -402,7 +535,20 @@ def run_one(run_dir, parallel=False, SKIP_IF_SOLVED=SKIP_IF_SOLVED):
         }
         json.dump(data, f, indent=3)
 
-    fc.dump_log(join(ori_dir, f'{PREFIX}fc_log={FEASIBILITY_CHECKER}.json'))
+    if USE_RESULTS_LEDGER:
+        append_result(RESULTS_LEDGER, run_dir, FEASIBILITY_CHECKER, MODE,
+                      'failed' if plan is None else 'solved', planning_time, max_time=max_time)
+
+    if PROFILE_STREAMS:
+        stream_profiler.dump(join(ori_dir, f'{PREFIX}stream_profile_fc={FEASIBILITY_CHECKER}.json'))
+    if MEMOIZE_STREAMS:
+        stream_memoizer.dump(join(ori_dir, f'{PREFIX}stream_memo_fc={FEASIBILITY_CHECKER}.json'))
+
+    fc_log_file = join(ori_dir, f'{PREFIX}fc_log={FEASIBILITY_CHECKER}.json')
+    if replica_logs is not None:
+        merge_fc_logs(replica_logs, fc_log_file)
+    else:
+        fc.dump_log(fc_log_file)
     commands_file = join(ori_dir, f'{PREFIX}commands_rerun_fc={FEASIBILITY_CHECKER}.pkl')
 
     if plan is not None:
@@ -414,10 +560,23 @@ def run_one(run_dir, parallel=False, SKIP_IF_SOLVED=SKIP_IF_SOLVED):
             saver.restore()
         with open(commands_file, 'wb') as f:
             pickle.dump(commands, f)
+        trajectory_dir = join(dirname(commands_file),
+                              basename(commands_file).replace('commands', 'trajectory').replace('.pkl', ''))
+        if SAVE_TRAJECTORY:
+            save_trajectory(commands, trajectory_dir,
+                            body_map=load_planning_config(run_dir).get('body_to_name', None),
+                            source=basename(commands_file))
+            if AUDIT_COLLISIONS:
+                audit_trajectory(Trajectory(trajectory_dir), robot=world.robot.body, cfree_range=CFREE_RANGE,
+                                 out_file=join(ori_dir, f'{PREFIX}collisions_fc={FEASIBILITY_CHECKER}.json'))
+                saver.restore()
         if has_gui():
             saver.restore()
             input('Begin?')
-            apply_actions(problem, commands, time_step=5e-3, verbose=False)
+            if FAST_REPLAY and SAVE_TRAJECTORY:
+                replay_trajectory(Trajectory(trajectory_dir))
+            else:
+                apply_actions(problem, commands, time_step=5e-3, verbose=False)
             input('End?')
 
         ## maybe generate a multiple_solutions.json file
@@ -467,7 +626,7 @@ def run_one(run_dir, parallel=False, SKIP_IF_SOLVED=SKIP_IF_SOLVED):
 
     # disconnect()
     reset_simulation()
-    shutil.rmtree(exp_dir)
+    unstage_run_dir(exp_dir)
 
 
 def process(index):
@@ -479,6 +638,14 @@ def process(index):
 
 
 if __name__ == '__main__':
-    process_all_tasks(process, args.t, parallel=PARALLEL, cases=CASES)
+    case_filter = None
+    if USE_RESULTS_LEDGER and (SKIP_IF_SOLVED or SKIP_IF_SOLVED_RECENTLY):
+        case_filter = get_ledger_case_filter()
+    if budget_allocator is not None and CAMPAIGN_BUDGET is not None:
+        case_filter = get_campaign_case_filter(case_filter)
+    campaign_start = time.time()
+    process_all_tasks(process, args.t, parallel=PARALLEL, cases=CASES, case_filter=case_filter)
+    if budget_allocator is not None:
+        budget_allocator.report(campaign_start, DEFAULT_BUDGET)
     # process_all_tasks(clear_all_rerun_results, args.t, parallel=False)
 
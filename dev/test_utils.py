@@ -2,40 +2,10 @@ from os import listdir
 from os.path import join, isdir, isfile
 import math
 from config import MAMAO_DATA_PATH
+from examples.video_utils import mp4_to_gif
 import random
 
 
-def mp4_to_gif(mp4_file, frame_folder='output'):
-    import cv2
-    def convert_mp4_to_jpgs(path):
-        video_capture = cv2.VideoCapture(path)
-        still_reading, image = video_capture.read()
-        frame_count = 0
-        while still_reading:
-            cv2.imwrite(f"{frame_folder}/frame_{frame_count:03d}.jpg", image)
-
-            # read next image
-            still_reading, image = video_capture.read()
-            frame_count += 1
-
-    import glob
-    from PIL import Image
-
-    def make_gif():
-        images = glob.glob(f"{frame_folder}/*.jpg")
-        images.sort()
-        frames = [Image.open(image) for image in images]
-        frame_one = frames[0]
-        output_file = mp4_file.replace('.mp4', '.gif')
-        frame_one.save(output_file, format="GIF", append_images=frames,
-                       save_all=True, duration=50, loop=0)
-        return output_file
-
-    convert_mp4_to_jpgs(mp4_file)
-    output_file = make_gif()
-    print('converted mp4 to', output_file)
-
-
 ##################################################################################
 
 
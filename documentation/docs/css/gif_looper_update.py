@@ -1,13 +1,15 @@
-## create a script that converts all gif images in the gifs folder to loop automatically
-from os.path import join, abspath
+## make all gif images in the gifs folder loop forever, by setting the loop count in their headers
+import sys
+from os.path import join, abspath, dirname
 from os import listdir
 
-GIF_PATH = join('..', 'gifs')
-GIFSICLE_PATH = '/Users/z/Documents/simulators/_tools/gifsicle/src'
+GIF_PATH = abspath(join(dirname(__file__), '..', 'gifs'))
+sys.path.append(abspath(join(dirname(__file__), '..', '..', '..', 'examples')))
 
-if __name__ == 'main':
-  gif_files = [abspath(join(GIF_PATH, f)) for f in listdir(GIF_PATH)]
-  with open('gif_looper.sh', 'w') as f:
-      f.write(f'cd {GIFSICLE_PATH}\n')
-      for gif in gif_files:
-          f.write(f'./gifsicle -bl {gif}\n')
+from video_utils import set_gif_loop
+
+if __name__ == '__main__':
+    gif_files = [join(GIF_PATH, f) for f in listdir(GIF_PATH) if f.endswith('.gif')]
+    for gif in gif_files:
+        set_gif_loop(gif, loop=0)
+    print(f'set {len(gif_files)} gifs in {GIF_PATH} to loop')
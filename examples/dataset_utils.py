@@ -0,0 +1,589 @@
+import os
+import re
+import math
+import json
+import random
+import hashlib
+from os import listdir
+from os.path import join, isdir, isfile, relpath
+from collections import defaultdict
+import xml.etree.ElementTree as ET
+
+
+FINGERPRINT_INDEX = 'fingerprints.json'
+FINGERPRINT_FILES = ['scene.lisdf', 'problem.pddl']
+FINGERPRINT_VERSION = 2  ## bumped whenever the canonicalization changes, older entries are rehashed
+
+
+def get_run_dirs(task_dir):
+    return sorted([join(task_dir, f) for f in listdir(task_dir) if isdir(join(task_dir, f))])
+
+
+def _round_number(x, digits=3):
+    v = round(float(x), digits)
+    return str(0.0 if v == 0 else v)  ## -0.0 and 0.0 are the same number, other signs are kept
+
+
+def _round_numbers(text, digits=3):
+    return re.sub(r'-?\d+\.\d+', lambda m: _round_number(m.group(), digits), text)
+
+
+def canonicalize_lisdf(path):
+    """ drop comments, the timestamped world name and formatting, round numbers,
+        and sort models by name so that equivalent scenes serialize the same way """
+    root = ET.parse(path).getroot()
+
+    def canonical(elem):
+        attrib = {k: v for k, v in elem.attrib.items() if not (elem.tag == 'world' and k == 'name')}
+        text = _round_numbers(' '.join((elem.text or '').split()))
+        children = sorted([canonical(c) for c in elem if isinstance(c.tag, str)])
+        return f"<{elem.tag} {sorted(attrib.items())}>{text}{''.join(children)}</{elem.tag}>"
+
+    return canonical(root)
+
+
+def canonicalize_pddl(path):
+    """ drop comments, the problem name and formatting """
+    lines = [l.split(';')[0] for l in open(path, 'r').read().lower().splitlines()]
+    text = ' '.join(' '.join(lines).split())
+    text = re.sub(r'\(problem [^)]*\)', '(problem)', text)
+    return _round_numbers(text.replace('( ', '(').replace(' )', ')'))
+
+
+def get_world_hash(run_dir):
+    h = hashlib.sha1()
+    h.update(canonicalize_lisdf(join(run_dir, 'scene.lisdf')).encode('utf-8'))
+    h.update(canonicalize_pddl(join(run_dir, 'problem.pddl')).encode('utf-8'))
+    return h.hexdigest()
+
+
+def update_fingerprint_index(dataset_root, task_names, verbose=True):
+    """ hash each run's scene.lisdf and problem.pddl, only rehashing runs whose files changed,
+        the index is stored as {run_dir: [mtimes, hash, version]} with run_dir relative to `dataset_root` """
+    index_file = join(dataset_root, FINGERPRINT_INDEX)
+    index = json.load(open(index_file, 'r')) if isfile(index_file) else {}
+    updated = 0
+    for task_name in task_names:
+        task_dir = join(dataset_root, task_name)
+        if not isdir(task_dir):
+            continue
+        for run_dir in get_run_dirs(task_dir):
+            files = [join(run_dir, f) for f in FINGERPRINT_FILES]
+            if not all(isfile(f) for f in files):
+                continue
+            key = relpath(run_dir, dataset_root)
+            mtimes = [os.path.getmtime(f) for f in files]
+            if key in index and index[key][0] == mtimes and index[key][2:] == [FINGERPRINT_VERSION]:
+                continue
+            index[key] = [mtimes, get_world_hash(run_dir), FINGERPRINT_VERSION]
+            updated += 1
+    if updated > 0:
+        tmp_file = index_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_file, index_file)
+    if verbose:
+        print(f'update_fingerprint_index | hashed {updated} runs, {len(index)} in index')
+    return {k: v[1] for k, v in index.items()}
+
+
+def group_by_hash(hashes, task_names):
+    groups = defaultdict(list)
+    for run_dir, h in hashes.items():
+        if run_dir.split(os.sep)[0] in task_names:
+            groups[h].append(run_dir)
+    return groups
+
+
+def find_duplicates(hashes, task_names):
+    """ return the groups of runs in `task_names` that have identical contents """
+    return [sorted(runs) for runs in group_by_hash(hashes, task_names).values() if len(runs) > 1]
+
+
+##################################################################################
+
+
+CATALOG_DB = 'catalog.db'
+CATALOG_ARTIFACTS = ['scene.lisdf', 'problem.pddl', 'plan.json', 'commands.pkl', 'trajectory', 'log.json',
+                     'collision_report.json', 'replay.gif', 'replay.mp4', 'features.txt', 'features.npz']
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_dir TEXT PRIMARY KEY,
+    task TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    cfree REAL,
+    plan_len INTEGER,
+    planning_time REAL,
+    planning_config TEXT,
+    artifacts TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_task ON runs (task);
+"""
+
+
+def connect_catalog(dataset_root):
+    import sqlite3
+    db = sqlite3.connect(join(dataset_root, CATALOG_DB), timeout=60)
+    db.executescript(CATALOG_SCHEMA)
+    return db
+
+
+def _get_run_mtime(run_dir):
+    files = [run_dir] + [join(run_dir, f) for f in ['planning_config.json', 'plan.json']]
+    return max(os.path.getmtime(f) for f in files if os.path.exists(f))
+
+
+def _read_run_entry(run_dir, task_name):
+    conf_file = join(run_dir, 'planning_config.json')
+    conf = json.load(open(conf_file, 'r')) if isfile(conf_file) else {}
+    cfree = conf.get('cfree', None)
+    plan_len = planning_time = None
+    plan_file = join(run_dir, 'plan.json')
+    if isfile(plan_file):
+        try:
+            plan = json.load(open(plan_file, 'r'))
+            plan = plan[0] if isinstance(plan, list) else plan
+            plan_len = plan.get('plan_len', None)
+            planning_time = plan.get('planning', plan.get('planning_time', None))
+        except (ValueError, AttributeError, IndexError):
+            pass
+    names = set(listdir(run_dir))
+    artifacts = [f for f in CATALOG_ARTIFACTS if f in names]
+    artifacts += sorted(f for f in names if f.startswith('seg_images') or f == 'rerun')
+    return (run_dir, task_name, _get_run_mtime(run_dir), cfree if isinstance(cfree, float) else None,
+            plan_len, planning_time, json.dumps(conf), ','.join(artifacts))
+
+
+def update_catalog(dataset_root, task_names, verbose=True):
+    """ index the runs of each task, rereading only the runs modified since the last update """
+    db = connect_catalog(dataset_root)
+    updated = removed = 0
+    with db:
+        for task_name in task_names:
+            task_dir = join(dataset_root, task_name)
+            if not isdir(task_dir):
+                continue
+            known = dict(db.execute('SELECT run_dir, mtime FROM runs WHERE task = ?', (task_name,)))
+            run_dirs = get_run_dirs(task_dir)
+            for run_dir in run_dirs:
+                if run_dir in known and known[run_dir] >= _get_run_mtime(run_dir):
+                    continue
+                db.execute('INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                           _read_run_entry(run_dir, task_name))
+                updated += 1
+            gone = set(known) - set(run_dirs)
+            db.executemany('DELETE FROM runs WHERE run_dir = ?', [(r,) for r in gone])
+            removed += len(gone)
+    if verbose:
+        print(f'update_catalog | updated {updated} runs, removed {removed} runs')
+    return db
+
+
+def query_catalog(dataset_root, task_names, where=None, params=(), update=True):
+    """ return the run dirs of the given tasks that satisfy the sql `where` clause, e.g.
+            query_catalog(root, ['mm_sink'], where='cfree IS NOT NULL AND plan_len <= ?', params=(10,)) """
+    db = update_catalog(dataset_root, task_names, verbose=False) if update else connect_catalog(dataset_root)
+    query = f"SELECT run_dir FROM runs WHERE task IN ({', '.join('?' * len(task_names))})"
+    if where is not None:
+        query += f' AND ({where})'
+    run_dirs = [r[0] for r in db.execute(query + ' ORDER BY run_dir', list(task_names) + list(params))]
+    db.close()
+    return run_dirs
+
+
+def sample_catalog_stratified(dataset_root, task_names, count, where=None, params=(), update=True):
+    """ sample about `count` runs split evenly across tasks, drawing with replacement
+        only when a task has fewer matching runs than its share """
+    per_task = math.ceil(count / len(task_names))
+    dirs = []
+    for task_name in task_names:
+        run_dirs = query_catalog(dataset_root, [task_name], where=where, params=params, update=update)
+        if len(run_dirs) == 0:
+            continue
+        if len(run_dirs) >= per_task:
+            dirs.extend(random.sample(run_dirs, per_task))
+        else:
+            dirs.extend(random.choices(run_dirs, k=per_task))
+    random.shuffle(dirs)
+    return dirs[:count]
+
+
+##################################################################################
+
+
+## small text files that loaders may rewrite in place, everything else is symlinked
+STAGED_COPY_EXTENSIONS = ['.lisdf', '.pddl', '.json', '.txt', '.yaml']
+
+
+def fix_asset_uris(lisdf_text, run_dir, asset_path):
+    """ make the relative `<uri>../../assets/...</uri>` paths absolute, so the scene can be
+        loaded from any directory instead of one exactly two levels below the project """
+    def fix(match):
+        uri = match.group(1)
+        if uri.startswith('/') or '://' in uri:
+            return match.group(0)
+        if 'assets/' in uri:
+            uri = join(asset_path, uri[uri.index('assets/') + len('assets/'):])
+        else:
+            uri = os.path.abspath(join(run_dir, uri))
+        return f'<uri>{uri}</uri>'
+    return re.sub(r'<uri>\s*(.*?)\s*</uri>', fix, lisdf_text)
+
+
+def stage_run_dir(run_dir, tag='staged', temp_path=None, asset_path=None, copy_dirs=()):
+    """ a view of `run_dir` for the loaders in place of `copy_dir_for_process`,
+        small text files are copied and scene.lisdf is rewritten with absolute asset paths,
+        so those can be changed freely,
+        seg images, gifs, pickles and subdirectories are symlinked to the originals, so writing into a
+        symlinked subdirectory, or opening a symlinked file for writing, changes the original run,
+        pass the names of subdirectories that will be written to in `copy_dirs` to get private copies """
+    import shutil
+    from config import TEMP_PATH, ASSET_PATH
+    temp_path = TEMP_PATH if temp_path is None else temp_path
+    asset_path = ASSET_PATH if asset_path is None else asset_path
+    run_dir = os.path.abspath(run_dir)
+    name = '_'.join(run_dir.split(os.sep)[-2:])
+    staged_dir = join(temp_path, f'{tag}_{name}_{os.getpid()}')
+    if isdir(staged_dir):
+        unstage_run_dir(staged_dir)
+    os.makedirs(staged_dir)
+    for f in listdir(run_dir):
+        source = join(run_dir, f)
+        target = join(staged_dir, f)
+        if f.endswith('.lisdf'):
+            with open(target, 'w') as out:
+                out.write(fix_asset_uris(open(source, 'r').read(), run_dir, asset_path))
+        elif isfile(source) and os.path.splitext(f)[1] in STAGED_COPY_EXTENSIONS:
+            shutil.copy(source, target)
+        elif isdir(source) and f in copy_dirs:
+            shutil.copytree(source, target)
+        else:
+            os.symlink(source, target)
+    return staged_dir
+
+
+def unstage_run_dir(staged_dir):
+    """ remove the staged view, symlinks are unlinked without touching the original artifacts """
+    import shutil
+    for f in listdir(staged_dir):
+        path = join(staged_dir, f)
+        if os.path.islink(path):
+            os.unlink(path)
+    shutil.rmtree(staged_dir)
+
+
+##################################################################################
+
+
+def append_result(ledger_file, run_dir, fc, mode, status, planning_time=None, timestamp=None, max_time=None):
+    """ append one (run, feasibility checker, mode, status, planning_time, timestamp, max_time) record,
+        `max_time` is the time limit the attempt ran with, the lock keeps lines from interleaving
+        when parallel processes share a campaign ledger """
+    import time
+    import fcntl
+    record = dict(run=os.path.abspath(run_dir), fc=str(fc), mode=mode, status=status,
+                  planning_time=planning_time, timestamp=time.time() if timestamp is None else timestamp,
+                  max_time=max_time)
+    with open(ledger_file, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(json.dumps(record) + '\n')
+        f.flush()
+        fcntl.flock(f, fcntl.LOCK_UN)
+    return record
+
+
+def iter_ledger_records(ledger_file):
+    """ all records in the order they were written, skipping a partially written last line """
+    if not isfile(ledger_file):
+        return
+    with open(ledger_file, 'r') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def load_latest_results(ledger_file):
+    """ the most recent record of each (run, fc, mode) """
+    results = {}
+    for record in iter_ledger_records(ledger_file):
+        key = (record['run'], record['fc'], record['mode'])
+        if key not in results or results[key]['timestamp'] <= record['timestamp']:
+            results[key] = record
+    return results
+
+
+##################################################################################
+
+
+def _rotation_from_rpy(rpy):
+    import numpy as np
+    r, p, y = rpy
+    rx = np.array([[1, 0, 0], [0, np.cos(r), -np.sin(r)], [0, np.sin(r), np.cos(r)]])
+    ry = np.array([[np.cos(p), 0, np.sin(p)], [0, 1, 0], [-np.sin(p), 0, np.cos(p)]])
+    rz = np.array([[np.cos(y), -np.sin(y), 0], [np.sin(y), np.cos(y), 0], [0, 0, 1]])
+    return rz @ ry @ rx
+
+
+def _transform_aabb(lower, upper, rotation, position, scale=1):
+    """ aabb of the 8 corners of a local aabb after scaling, rotating and translating it """
+    import numpy as np
+    from itertools import product
+    corners = np.array(list(product(*zip(lower, upper)))) * scale
+    corners = corners @ np.asarray(rotation).T + np.asarray(position)
+    return corners.min(axis=0).tolist(), corners.max(axis=0).tolist()
+
+
+def merge_aabbs(aabbs):
+    aabbs = [a for a in aabbs if a is not None]
+    if len(aabbs) == 0:
+        return None
+    return [min(a[0][i] for a in aabbs) for i in range(3)], [max(a[1][i] for a in aabbs) for i in range(3)]
+
+
+def get_mesh_aabb(mesh_file):
+    """ vertex bounds of an obj or stl mesh, None if the file is missing or in a format that would
+        need a mesh library, e.g. dae """
+    import numpy as np
+    if not isfile(mesh_file):
+        return None
+    if mesh_file.lower().endswith('.obj'):
+        vertices = [l.split()[1:4] for l in open(mesh_file, 'r', errors='ignore') if l.startswith('v ')]
+        vertices = np.array(vertices, dtype=float)
+    elif mesh_file.lower().endswith('.stl'):
+        data = open(mesh_file, 'rb').read()
+        if data[:5] == b'solid' and b'facet' in data[:300]:
+            vertices = np.array([l.split()[1:4] for l in data.decode('utf-8', 'ignore').splitlines()
+                                 if l.strip().startswith('vertex')], dtype=float)
+        else:
+            n = int(np.frombuffer(data[80:84], dtype=np.uint32)[0])
+            facets = np.frombuffer(data[84:84 + 50 * n], dtype=np.dtype([('normal', '<f4', 3), (
+                'vertices', '<f4', (3, 3)), ('attr', '<u2')]))
+            vertices = facets['vertices'].reshape(-1, 3).astype(float)
+    else:
+        return None
+    if len(vertices) == 0:
+        return None
+    return vertices.min(axis=0).tolist(), vertices.max(axis=0).tolist()
+
+
+def get_urdf_local_aabb(urdf_file, skipped=None):
+    """ aabb of all link geometries at the zero joint configuration, in the urdf's base frame,
+        meshes that can't be read are appended to `skipped` as (mesh file, 'missing' or 'unsupported') """
+    import numpy as np
+    root = ET.parse(urdf_file).getroot()
+    urdf_dir = os.path.dirname(os.path.abspath(urdf_file))
+    parents = {}
+    for joint in root.findall('joint'):
+        origin = joint.find('origin')
+        xyz = [0, 0, 0] if origin is None else [float(v) for v in origin.get('xyz', '0 0 0').split()]
+        rpy = [0, 0, 0] if origin is None else [float(v) for v in origin.get('rpy', '0 0 0').split()]
+        parents[joint.find('child').get('link')] = (joint.find('parent').get('link'), xyz, rpy)
+
+    def get_link_frame(link):
+        if link not in parents:
+            return np.eye(3), np.zeros(3)
+        parent, xyz, rpy = parents[link]
+        rotation, position = get_link_frame(parent)
+        return rotation @ _rotation_from_rpy(rpy), position + rotation @ np.array(xyz)
+
+    aabbs = []
+    for link in root.findall('link'):
+        elems = link.findall('collision') or link.findall('visual')
+        if len(elems) == 0:
+            continue
+        rotation, position = get_link_frame(link.get('name'))
+        for elem in elems:
+            origin = elem.find('origin')
+            xyz = [0, 0, 0] if origin is None else [float(v) for v in origin.get('xyz', '0 0 0').split()]
+            rpy = [0, 0, 0] if origin is None else [float(v) for v in origin.get('rpy', '0 0 0').split()]
+            geometry = elem.find('geometry')
+            mesh, box = geometry.find('mesh'), geometry.find('box')
+            if mesh is not None:
+                mesh_file = join(urdf_dir, mesh.get('filename'))
+                aabb = get_mesh_aabb(mesh_file)
+                if aabb is None:
+                    if skipped is not None:
+                        skipped.append((mesh_file, 'unsupported' if isfile(mesh_file) else 'missing'))
+                    continue
+                scale = np.array([float(v) for v in mesh.get('scale', '1 1 1').split()])
+                aabb = (np.array(aabb[0]) * scale).tolist(), (np.array(aabb[1]) * scale).tolist()
+            elif box is not None:
+                size = np.array([float(v) for v in box.get('size').split()])
+                aabb = (-size / 2).tolist(), (size / 2).tolist()
+            else:
+                continue
+            aabbs.append(_transform_aabb(*aabb, rotation @ _rotation_from_rpy(rpy),
+                                         position + rotation @ np.array(xyz)))
+    return merge_aabbs(aabbs)
+
+
+def _get_lisdf_pose(elem):
+    pose = elem.find('pose')
+    values = [0.] * 6 if pose is None else [float(v) for v in pose.text.split()]
+    return values[:3], values[3:]
+
+
+def _get_scene_world(run_dir, asset_path=None):
+    text = open(join(run_dir, 'scene.lisdf'), 'r').read()
+    if asset_path is not None:
+        text = fix_asset_uris(text, run_dir, asset_path)
+    return ET.fromstring(text).find('world')
+
+
+def _get_include_urdf(run_dir, include):
+    uri = include.find('uri').text.strip()
+    return uri if uri.startswith('/') else os.path.abspath(join(run_dir, uri))
+
+
+def get_scene_urdfs(run_dir, asset_path=None):
+    """ the urdf files included in scene.lisdf """
+    world = _get_scene_world(run_dir, asset_path)
+    return [_get_include_urdf(run_dir, include) for include in world.findall('include')]
+
+
+def get_asset_aabb(urdf_file):
+    """ (local aabb, skipped meshes), the aabb is None unless every geometry of the asset could be read """
+    if not isfile(urdf_file):
+        return None, [(urdf_file, 'missing')]
+    skipped = []
+    aabb = get_urdf_local_aabb(urdf_file, skipped)
+    return (aabb if len(skipped) == 0 else None), skipped
+
+
+def get_scene_aabb(run_dir, asset_aabbs, asset_path=None):
+    """ world aabb of a run computed from the poses and scales in scene.lisdf and the local aabbs
+        of the included urdfs, those missing from `asset_aabbs` are computed and added to it,
+        None if an asset has no aabb, since leaving it out would give bounds that are too small """
+    import numpy as np
+    world = _get_scene_world(run_dir, asset_path)
+    aabbs = []
+    for include in world.findall('include'):
+        urdf_file = _get_include_urdf(run_dir, include)
+        if urdf_file not in asset_aabbs:
+            asset_aabbs[urdf_file] = get_asset_aabb(urdf_file)[0]
+        if asset_aabbs[urdf_file] is None:
+            return None
+        scale = include.find('scale')
+        scale = 1. if scale is None else float(scale.text)
+        xyz, rpy = _get_lisdf_pose(include)
+        aabbs.append(_transform_aabb(*asset_aabbs[urdf_file], _rotation_from_rpy(rpy), xyz, scale=scale))
+    for model in world.findall('model'):
+        xyz, rpy = _get_lisdf_pose(model)
+        for size in model.iter('size'):
+            size = np.array([float(v) for v in size.text.split()])
+            aabbs.append(_transform_aabb((-size / 2).tolist(), (size / 2).tolist(), _rotation_from_rpy(rpy), xyz))
+    return merge_aabbs(aabbs)
+
+
+ASSET_AABBS_FILE = 'asset_aabbs.json'
+AABB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS aabbs (
+    run_dir TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    lower_x REAL, lower_y REAL, lower_z REAL,
+    upper_x REAL, upper_y REAL, upper_z REAL
+);
+"""
+
+
+def _get_scene_urdfs_process(inputs):
+    return get_scene_urdfs(*inputs)
+
+
+def _get_asset_aabb_process(urdf_file):
+    return (urdf_file,) + get_asset_aabb(urdf_file)
+
+
+## the local aabbs of all assets in each worker, sent once per worker instead of once per task
+_ASSET_AABBS = {}
+
+
+def _init_asset_aabbs(asset_aabbs):
+    _ASSET_AABBS.clear()
+    _ASSET_AABBS.update(asset_aabbs)
+
+
+def _get_scene_aabb_process(inputs):
+    run_dir, asset_path = inputs
+    return run_dir, get_scene_aabb(run_dir, _ASSET_AABBS, asset_path)
+
+
+def _map(pool, fn, inputs):
+    return map(fn, inputs) if pool is None else pool.imap_unordered(fn, inputs, chunksize=16)
+
+
+def get_worlds_aabb_streaming(run_dirs, dataset_root, parallel=True, asset_path=None):
+    """ per-run and global bounds without a pybullet session, the per-run aabbs are stored in the
+        `aabbs` table of the run catalog and reused while scene.lisdf is unchanged, the local
+        aabbs of the assets are kept in `asset_aabbs.json` next to it,
+        the urdfs of all changed runs are collected first so that each asset is parsed only once,
+        runs with a missing or unsupported (e.g. dae) mesh are left out of the bounds and returned as
+        {run_dir: [(mesh file, reason)]}, so that the caller can compute them with pybullet """
+    import multiprocessing
+    db = connect_catalog(dataset_root)
+    db.executescript(AABB_SCHEMA)
+    asset_file = join(dataset_root, ASSET_AABBS_FILE)
+    asset_aabbs = json.load(open(asset_file, 'r')) if isfile(asset_file) else {}
+
+    run_aabbs = {}
+    known = {r[0]: (r[1], r[2:]) for r in db.execute('SELECT * FROM aabbs')}
+    todo = []
+    for run_dir in run_dirs:
+        mtime = os.path.getmtime(join(run_dir, 'scene.lisdf'))
+        if run_dir in known and known[run_dir][0] >= mtime:
+            v = known[run_dir][1]
+            run_aabbs[run_dir] = (list(v[:3]), list(v[3:]))
+        else:
+            todo.append((run_dir, asset_path))
+    parallel = parallel and len(todo) > 1
+    num_workers = min(multiprocessing.cpu_count(), len(todo))
+
+    ## one pass over the includes, then one task per asset that isn't known yet
+    pool = multiprocessing.Pool(processes=num_workers) if parallel else None
+    urdfs = set()
+    for run_urdfs in _map(pool, _get_scene_urdfs_process, todo):
+        urdfs.update(run_urdfs)
+    new_urdfs = sorted(urdfs - set(asset_aabbs))
+    skipped = {}
+    for urdf_file, aabb, urdf_skipped in _map(pool, _get_asset_aabb_process, new_urdfs):
+        asset_aabbs[urdf_file] = aabb
+        if len(urdf_skipped) > 0:
+            skipped[urdf_file] = urdf_skipped
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    ## then the per-run bounds, with all asset aabbs known
+    _init_asset_aabbs(asset_aabbs)
+    pool = multiprocessing.Pool(processes=num_workers, initializer=_init_asset_aabbs,
+                                initargs=(asset_aabbs,)) if parallel else None
+    incomplete = {}
+    with db:
+        for run_dir, aabb in _map(pool, _get_scene_aabb_process, todo):
+            if aabb is None:
+                urdfs = get_scene_urdfs(run_dir, asset_path)
+                incomplete[run_dir] = [m for u in urdfs for m in skipped.get(u, [(u, 'no aabb')])
+                                       if asset_aabbs.get(u) is None]
+                continue
+            run_aabbs[run_dir] = aabb
+            db.execute('INSERT OR REPLACE INTO aabbs VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                       [run_dir, os.path.getmtime(join(run_dir, 'scene.lisdf'))] + aabb[0] + aabb[1])
+    if pool is not None:
+        pool.close()
+        pool.join()
+    db.close()
+    ## assets without an aabb are tried again next time, e.g. once the missing mesh is there
+    if any(asset_aabbs[u] is not None for u in new_urdfs):
+        with open(asset_file, 'w') as f:
+            json.dump({u: a for u, a in asset_aabbs.items() if a is not None}, f)
+
+    aabb = merge_aabbs(list(run_aabbs.values()))
+    print(f'get_worlds_aabb_streaming | {len(run_dirs)} runs ({len(todo)} computed, '
+          f'{len(new_urdfs)} new assets) | bounds {aabb}')
+    if len(incomplete) > 0:
+        meshes = sorted(set(m for ms in incomplete.values() for m in ms))
+        print(f'get_worlds_aabb_streaming | {len(incomplete)} runs left out, {len(meshes)} meshes could not be read, '
+              f'e.g. {meshes[:3]}')
+    return aabb, run_aabbs, incomplete
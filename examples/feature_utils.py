@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import hashlib
+import numpy as np
+from os.path import join, isfile
+
+
+FEATURES_FILE = 'features.npz'
+FEATURES_VERSION = 1
+
+
+def get_group_aabbs(groups, get_aabb_fn):
+    """ one aabb per group of (body, link), merged over the links of the group,
+        e.g. all links of a door, `get_aabb_fn(body, link)` returns (lower, upper),
+        groups can't be empty since `reduceat` would give them the aabb of the next group """
+    empty = [i for i, group in enumerate(groups) if len(group) == 0]
+    if len(empty) > 0:
+        raise ValueError(f'get_group_aabbs | groups {empty} have no links')
+    body_links = [bl for group in groups for bl in group]
+    starts = np.cumsum([0] + [len(group) for group in groups[:-1]])
+    aabbs = [get_aabb_fn(body, link) for body, link in body_links]
+    lower = np.array([a[0] for a in aabbs], dtype=np.float64).reshape(-1, 3)
+    upper = np.array([a[1] for a in aabbs], dtype=np.float64).reshape(-1, 3)
+    if len(groups) == 0:
+        return lower, upper
+    return np.minimum.reduceat(lower, starts, axis=0), np.maximum.reduceat(upper, starts, axis=0)
+
+
+def compute_aabb_features(movable_names, movable_aabbs, region_names, region_aabbs, axis=1, aabb_names=None):
+    """ widths along `axis` of the movables and regions (spaces and doors),
+        and the signed distances between the centers of each movable and each region along `axis` """
+    aabb_names = list(movable_names) + list(region_names) if aabb_names is None else aabb_names
+    lower = np.concatenate([movable_aabbs[0], region_aabbs[0]])
+    upper = np.concatenate([movable_aabbs[1], region_aabbs[1]])
+    movable_centers = (movable_aabbs[0][:, axis] + movable_aabbs[1][:, axis]) / 2
+    region_centers = (region_aabbs[0][:, axis] + region_aabbs[1][:, axis]) / 2
+    return dict(
+        aabb_names=np.array(aabb_names, dtype=str),
+        aabb_lower=lower.astype(np.float32), aabb_upper=upper.astype(np.float32),
+        aabb_width=(upper[:, axis] - lower[:, axis]).astype(np.float32),
+        movable_names=np.array(movable_names, dtype=str), region_names=np.array(region_names, dtype=str),
+        distance=(movable_centers[:, None] - region_centers[None, :]).astype(np.float32).reshape(
+            len(movable_names), len(region_names)),
+    )
+
+
+def compute_reachability_features(names, kinds, results):
+    return dict(reachability_names=np.array(names, dtype=str), reachability_kinds=np.array(kinds, dtype=str),
+                reachable=np.array(results, dtype=bool))
+
+
+def save_features(file_path, features):
+    """ typed columns in an npz, readable without pickle """
+    features = dict(features, version=np.array(FEATURES_VERSION))
+    tmp_file = f'{file_path}.{os.getpid()}.tmp.npz'
+    np.savez(tmp_file, **features)
+    os.replace(tmp_file, file_path)
+
+
+def load_features(file_path):
+    with np.load(file_path, allow_pickle=False) as data:
+        return {k: data[k] for k in data.files}
+
+
+def features_to_lines(features, digits=3):
+    """ the lines of the older features.txt format """
+    lines = []
+    for name, reachable in zip(features['reachability_names'], features['reachable']):
+        lines.append(f"{'reachable' if reachable else 'unreachable'} {name}")
+    for name, width in zip(features['aabb_names'], features['aabb_width']):
+        lines.append(f'aabby {name} {round(float(width), digits)}')
+    for i, movable in enumerate(features['movable_names']):
+        for j, region in enumerate(features['region_names']):
+            lines.append(f"distancey {movable} {region} {round(float(features['distance'][i, j]), digits)}")
+    return lines
+
+
+def load_dataset_features(run_dirs, keys=('aabb_names', 'aabb_width')):
+    """ {run_dir: {key: array}} of the runs that have features, only the given columns are read """
+    results = {}
+    for run_dir in run_dirs:
+        file_path = join(run_dir, FEATURES_FILE)
+        if isfile(file_path):
+            with np.load(file_path, allow_pickle=False) as data:
+                results[run_dir] = {k: data[k] for k in keys if k in data.files}
+    return results
+
+
+##################################################################################
+
+
+REACHABILITY_DB = 'reachability_cache.db'
+REACHABILITY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reachability (
+    key TEXT PRIMARY KEY,
+    reachable INTEGER NOT NULL,
+    robot TEXT,
+    created REAL NOT NULL
+);
+"""
+
+
+def _round(values, digits=3):
+    return [round(float(v), digits) for v in values]
+
+
+def get_robot_key(robot, custom_limits=None, initial_q=None, digits=3):
+    """ the robot's class, its base limits and the configuration it starts from """
+    limits = sorted((str(k), _round(v, digits)) for k, v in (custom_limits or {}).items())
+    return json.dumps([type(robot).__name__, limits, _round(initial_q or [], digits)])
+
+
+def get_body_fingerprint(body, link=None, digits=3):
+    """ asset files, scales, pose and joint positions of a body, or of one of its links, ids are left out
+        and only the last directories of mesh paths are kept so it is the same across runs and machines """
+    import pybullet as p
+    shapes = []
+    for shape in p.getCollisionShapeData(body, -1 if link is None else link):
+        filename = shape[4].decode('utf-8') if isinstance(shape[4], bytes) else str(shape[4])
+        shapes.append([shape[2], _round(shape[3], digits), '/'.join(filename.split('/')[-3:]),
+                       _round(shape[5], digits), _round(shape[6], digits)])
+    point, quat = p.getBasePositionAndOrientation(body)
+    key = [shapes, _round(point, digits), _round(quat, digits),
+           _round([p.getJointState(body, j)[0] for j in range(p.getNumJoints(body))], digits)]
+    if link is not None:
+        key.append(link)
+    return hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()
+
+
+def get_obstacles_fingerprint(obstacles, digits=3):
+    """ independent of the order and ids of the obstacles, `obstacles` are bodies or (body, None, link) """
+    fingerprints = [get_body_fingerprint(o[0], o[-1], digits=digits) if isinstance(o, tuple) else
+                    get_body_fingerprint(o, digits=digits) for o in obstacles]
+    return hashlib.sha1(json.dumps(sorted(fingerprints)).encode('utf-8')).hexdigest()
+
+
+class ReachabilityCache(object):
+    """ answers of reachability checks in a sqlite file shared by all runs and processes,
+        keyed by robot, body and obstacles so a changed world or robot gets a new entry
+
+            cache = ReachabilityCache()
+            reachable = cache.check([robot_key, get_body_fingerprint(body), obstacles_key],
+                                    lambda: robot.check_reachability(body, problem, obstacles=obstacles))
+    """
+
+    def __init__(self, db_path=None, robot=None):
+        import sqlite3
+        if db_path is None:
+            from config import TEMP_PATH
+            db_path = join(TEMP_PATH, REACHABILITY_DB)
+        if not os.path.isdir(os.path.dirname(db_path)):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db = sqlite3.connect(db_path, timeout=60)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(REACHABILITY_SCHEMA)
+        self.robot = robot
+        self.stats = dict(hits=0, misses=0)
+
+    @staticmethod
+    def get_key(parts):
+        return hashlib.sha1(json.dumps(list(parts)).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        row = self.db.execute('SELECT reachable FROM reachability WHERE key = ?', (key,)).fetchone()
+        return None if row is None else bool(row[0])
+
+    def put(self, key, reachable):
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO reachability VALUES (?, ?, ?, ?)',
+                            (key, int(bool(reachable)), self.robot, time.time()))
+
+    def check(self, parts, check_fn):
+        key = self.get_key(parts)
+        result = self.get(key)
+        if result is not None:
+            self.stats['hits'] += 1
+            return result
+        self.stats['misses'] += 1
+        result = bool(check_fn())
+        self.put(key, result)
+        return result
+
+    def summarize(self):
+        total = max(self.stats['hits'] + self.stats['misses'], 1)
+        print(f"ReachabilityCache | hits {self.stats['hits']}, misses {self.stats['misses']} "
+              f"| hit rate {round(self.stats['hits'] / total, 3)}")
+        return dict(self.stats)
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,484 @@
+import os
+import re
+import json
+import shutil
+from os import listdir
+from contextlib import contextmanager
+from os.path import join, isdir, isfile
+
+import numpy as np
+
+
+## color of the pixels outside the object in the per-object seg images
+SEG_BACKGROUND = (178, 178, 204)
+SEG_IMAGE_NAME = re.compile(r'seg_images_(\d+)_\[(.*)\]_(.*)\.png')
+
+
+def parse_seg_image_name(file_name):
+    """ 'seg_images_0_[(28, None, 1)]_braiserbody#1::braiser_bottom.png' -> (0, '(28, None, 1)', name) """
+    match = SEG_IMAGE_NAME.match(file_name)
+    if match is None:
+        return None
+    index, key, name = match.groups()
+    return int(index), key, name
+
+
+def pack_labels(masks):
+    """ masks may overlap (a link inside its body), so each label stands for the set of keys covering
+        the pixel, returns the label image and the keys of each label, label 0 is the background """
+    shape = masks[0][1].shape
+    stacked = np.stack([mask.reshape(-1) for _, mask in masks], axis=-1)
+    unique, labels = np.unique(stacked, axis=0, return_inverse=True)
+    table = [[masks[i][0] for i in np.flatnonzero(row)] for row in unique]
+    if len(table[0]) > 0:  ## keep label 0 for the background
+        table = [[]] + table
+        labels = labels + 1
+    return labels.reshape(shape).astype(np.uint16), table
+
+
+def masks_from_segmentation(seg, keys):
+    """ pybullet segmentation buffer (body + (link + 1) << 24) to one mask per body `19` or
+        body link `(28, None, 1)` key """
+    seg = np.asarray(seg)
+    bodies = seg & ((1 << 24) - 1)
+    links = (seg >> 24) - 1
+    masks = []
+    for key in keys:
+        if isinstance(key, tuple):
+            mask = (bodies == key[0]) & (links == key[-1])
+        else:
+            mask = bodies == key
+        masks.append((str(key), mask))
+    return masks
+
+
+def save_packed_seg(out_file, masks, names, rgb=None):
+    """ one compressed file per camera with the label image, the keys of each label,
+        the key -> name table, and optionally the rgb image used for the per-object seg images """
+    labels, table = pack_labels(masks)
+    arrays = dict(labels=labels, table=json.dumps(table), names=json.dumps(names))
+    if rgb is not None:
+        arrays['rgb'] = np.asarray(rgb)[:, :, :3].astype(np.uint8)
+    np.savez_compressed(out_file, **arrays)
+    return out_file
+
+
+class PackedSegImages(object):
+    """ reads a packed seg file and yields per-object masks on demand """
+
+    def __init__(self, file_path):
+        data = np.load(file_path)
+        self.labels = data['labels']
+        self.table = json.loads(str(data['table']))
+        self.names = json.loads(str(data['names']))
+        self.rgb = data['rgb'] if 'rgb' in data.files else None
+
+    def _get_key(self, key_or_name):
+        key_or_name = str(key_or_name)
+        if key_or_name in self.names:
+            return key_or_name
+        keys = [k for k, n in self.names.items() if n == key_or_name]
+        if len(keys) == 0:
+            raise KeyError(key_or_name)
+        return keys[0]
+
+    def get_mask(self, key_or_name):
+        key = self._get_key(key_or_name)
+        return np.isin(self.labels, [i for i, keys in enumerate(self.table) if key in keys])
+
+    def get_seg_image(self, key_or_name):
+        """ same as the per-object png, the rgb image with everything else set to the background """
+        image = np.empty(self.labels.shape + (3,), dtype=np.uint8)
+        image[:] = SEG_BACKGROUND
+        mask = self.get_mask(key_or_name)
+        image[mask] = self.rgb[mask]
+        return image
+
+    def iter_masks(self):
+        for key, name in self.names.items():
+            yield key, name, self.get_mask(key)
+
+
+def pack_seg_image_dir(seg_dir, out_file=None, remove=False):
+    """ convert a `seg_images_{i}` folder of per-object pngs into one packed file """
+    from PIL import Image
+    masks, names = [], {}
+    rgb = None
+    for f in sorted(listdir(seg_dir)):
+        if f.endswith('_scene.png'):
+            rgb = np.array(Image.open(join(seg_dir, f)).convert('RGB'))
+            continue
+        parsed = parse_seg_image_name(f)
+        if parsed is None:
+            continue
+        _, key, name = parsed
+        image = np.array(Image.open(join(seg_dir, f)).convert('RGB'))
+        masks.append((key, np.any(image != SEG_BACKGROUND, axis=-1)))
+        names[key] = name
+    if len(masks) == 0:
+        return None
+    if out_file is None:
+        out_file = seg_dir.rstrip('/') + '.npz'
+    save_packed_seg(out_file, masks, names, rgb=rgb)
+    if remove:
+        shutil.rmtree(seg_dir)
+    return out_file
+
+
+def pack_run_seg_images(run_dir, remove=False):
+    """ pack every `seg_images_{i}` folder of a run into `seg_images_{i}.npz` """
+    seg_dirs = [join(run_dir, f) for f in sorted(listdir(run_dir))
+                if f.startswith('seg_images') and isdir(join(run_dir, f))]
+    return [pack_seg_image_dir(d, remove=remove) for d in seg_dirs]
+
+
+##################################################################################
+
+
+def get_view_matrix(spec, name_to_body=None):
+    """ a camera spec in any of the three supported formats:
+            {'camera_point': [x, y, z], 'target_point': [x, y, z]}  -- look-at
+            {'pose': ((x, y, z), (qx, qy, qz, qw))}  -- camera looking along its z axis
+            {'name': body name, 'd': [dx, dy, dz]}  -- zoom-in from `camera_zoomins` in planning_config.json
+    """
+    import pybullet as p
+    if 'camera_point' in spec:
+        direction = np.array(spec['target_point']) - np.array(spec['camera_point'])
+        up = [0, 0, 1]
+        if np.linalg.norm(np.cross(direction, up)) < 1e-6:  ## looking straight down or up
+            up = [1, 0, 0]
+        return p.computeViewMatrix(spec['camera_point'], spec['target_point'], spec.get('up', up))
+    if 'pose' in spec:
+        point, quat = spec['pose']
+        rotation = np.array(p.getMatrixFromQuaternion(quat)).reshape(3, 3)
+        target = np.array(point) + rotation @ np.array([0, 0, 1])
+        up = rotation @ np.array([0, -1, 0])
+        return p.computeViewMatrix(point, target.tolist(), up.tolist())
+    body = name_to_body[spec['name']]
+    if isinstance(body, tuple):
+        lower, upper = p.getAABB(body[0], body[-1])
+    else:
+        lower, upper = p.getAABB(body)
+    target = (np.array(lower) + np.array(upper)) / 2
+    return p.computeViewMatrix((target + np.array(spec['d'])).tolist(), target.tolist(), [0, 0, 1])
+
+
+def get_camera_specs(run_dir, camera_specs=None):
+    """ the given specs, or the `camera_kwargs` saved in planning_config.json if None,
+        plus the zoom-ins saved there, each with a unique name """
+    config_file = join(run_dir, 'planning_config.json')
+    config = json.load(open(config_file, 'r')) if isfile(config_file) else {}
+    if camera_specs is None:
+        camera_specs = config.get('camera_kwargs', None) or []
+    specs = [dict(s) for s in camera_specs]
+    for zoomin in config.get('camera_zoomins', []):
+        specs.append(dict(zoomin, label=f"zoomin_{zoomin['name']}"))
+    for i, spec in enumerate(specs):
+        spec.setdefault('label', f'camera_{i}')
+    return specs
+
+
+def get_seg_keys(run_dir, name_to_body):
+    """ the body and link keys to segment, following body_to_name in planning_config.json """
+    config_file = join(run_dir, 'planning_config.json')
+    body_to_name = json.load(open(config_file, 'r')).get('body_to_name', {}) if isfile(config_file) else {}
+    keys, names = [], {}
+    for key, name in body_to_name.items():
+        body = name_to_body.get(name, eval(key))
+        keys.append(body)
+        names[str(body)] = name
+    return keys, names
+
+
+def render_cameras(camera_specs, name_to_body, width=1440, height=1120, fov=60, near=0.01, far=20,
+                   seg_keys=None, seg_names=None, out_dir=None, writer=None):
+    """ resolve every view and projection matrix first, then render rgb, depth and segmentation
+        in a single `getCameraImage` call per camera, returns the images and per-camera timings """
+    import time
+    import pybullet as p
+    start = time.time()
+    projection = p.computeProjectionMatrixFOV(fov, width / height, near, far)
+    views = [get_view_matrix(spec, name_to_body) for spec in camera_specs]
+    timings = dict(resolve_matrices=time.time() - start, cameras={})
+    renderer = p.ER_BULLET_HARDWARE_OPENGL if p.getConnectionInfo()['connectionMethod'] == p.GUI \
+        else p.ER_TINY_RENDERER
+    results = {}
+    for spec, view in zip(camera_specs, views):
+        label = spec['label']
+        start = time.time()
+        _, _, rgb, depth, seg = p.getCameraImage(width, height, viewMatrix=view, projectionMatrix=projection,
+                                                 renderer=renderer,
+                                                 flags=p.ER_SEGMENTATION_MASK_OBJECT_AND_LINKINDEX)
+        rgb = np.reshape(rgb, (height, width, 4))[:, :, :3].astype(np.uint8)
+        depth = np.reshape(depth, (height, width))
+        depth = far * near / (far - (far - near) * depth)
+        seg = np.reshape(seg, (height, width))
+        render_time = time.time() - start
+        results[label] = dict(rgb=rgb, depth=depth, seg=seg)
+        if out_dir is not None:
+            start = time.time()
+            save_rendered_camera(out_dir, label, rgb, depth, seg, seg_keys, seg_names, writer=writer)
+            timings['cameras'][label] = dict(render=render_time, write=time.time() - start)
+        else:
+            timings['cameras'][label] = dict(render=render_time)
+    return results, timings
+
+
+def save_rendered_camera(out_dir, label, rgb, depth, seg, seg_keys=None, seg_names=None, writer=None):
+    """ with an `ImageWriter`, the encoding and writing happen in its background workers """
+    if not isdir(out_dir):
+        os.makedirs(out_dir, exist_ok=True)
+    if writer is None:
+        _write_image(join(out_dir, f'rgb_{label}.png'), rgb, {})
+        _write_image(join(out_dir, f'depth_{label}.npy'), depth.astype(np.float32), {})
+    else:
+        writer.write(join(out_dir, f'rgb_{label}.png'), rgb)
+        writer.write(join(out_dir, f'depth_{label}.npy'), depth.astype(np.float32))
+    if seg_keys is not None and len(seg_keys) > 0:
+        masks = masks_from_segmentation(seg, seg_keys)
+        if writer is None:
+            save_packed_seg(join(out_dir, f'seg_images_{label}.npz'), masks, seg_names, rgb=rgb)
+        else:
+            writer.submit(save_packed_seg, join(out_dir, f'seg_images_{label}.npz'), masks, seg_names, rgb=rgb)
+
+
+RENDER_MANIFEST = 'render_manifest.json'
+
+
+def get_render_fingerprint(scene_hash, spec, **render_kwargs):
+    """ everything an output image depends on: the scene, the camera and the renderer settings """
+    import hashlib
+    data = dict(scene=scene_hash, camera={k: v for k, v in spec.items() if k != 'label'}, render=render_kwargs)
+    return hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def load_render_manifest(out_dir):
+    manifest_file = join(out_dir, RENDER_MANIFEST)
+    return json.load(open(manifest_file, 'r')) if isfile(manifest_file) else {}
+
+
+def save_render_manifest(out_dir, manifest):
+    tmp_file = join(out_dir, RENDER_MANIFEST + '.tmp')
+    with open(tmp_file, 'w') as f:
+        json.dump(manifest, f, indent=3)
+    os.replace(tmp_file, join(out_dir, RENDER_MANIFEST))
+
+
+def render_run_dir(run_dir, camera_specs=None, out_dir=None, width=1440, height=1120, fov=60, use_gui=False,
+                   redo=False, writer=None):
+    """ load the world of a run once and render all cameras from it, see `get_camera_specs`,
+        writes rgb pngs, depth arrays, packed seg files and render_timings.json into `out_dir`,
+        unless `redo`, cameras whose fingerprint in the manifest is unchanged are not rendered again,
+        and the world is not loaded at all if no camera changed,
+        pass an `ImageWriter` to share one writer pool across runs """
+    import time
+    from loading_utils import get_file_hash
+    out_dir = join(run_dir, 'images') if out_dir is None else out_dir
+    start = time.time()
+    render_kwargs = dict(width=width, height=height, fov=fov, renderer='opengl' if use_gui else 'tiny')
+    scene_hash = get_file_hash(join(run_dir, 'scene.lisdf'))
+    specs = get_camera_specs(run_dir, camera_specs)
+    manifest = {} if redo else load_render_manifest(out_dir)
+    fingerprints = {spec['label']: get_render_fingerprint(scene_hash, spec, **render_kwargs) for spec in specs}
+    specs = [spec for spec in specs if manifest.get(spec['label']) != fingerprints[spec['label']]
+             or not isfile(join(out_dir, f"rgb_{spec['label']}.png"))]
+    if len(specs) == 0:
+        print(f'render_run_dir | {run_dir} | all cameras up to date')
+        return None
+
+    from lisdf_tools.lisdf_loader import load_lisdf_pybullet
+    from pybullet_tools.utils import reset_simulation
+    from dataset_utils import stage_run_dir, unstage_run_dir
+    from loading_utils import use_lisdf_cache
+    use_lisdf_cache()
+    staged_dir = stage_run_dir(run_dir, tag='rendering')
+    world = load_lisdf_pybullet(staged_dir, use_gui=use_gui, width=width, height=height, verbose=False)
+    load_time = time.time() - start
+
+    seg_keys, seg_names = get_seg_keys(run_dir, world.name_to_body)
+    own_writer = writer is None
+    writer = ImageWriter() if own_writer else writer
+    _, timings = render_cameras(specs, world.name_to_body, width=width, height=height, fov=fov,
+                                seg_keys=seg_keys, seg_names=seg_names, out_dir=out_dir, writer=writer)
+    start_flush = time.time()
+    if own_writer:
+        writer.close()
+    else:
+        writer.flush()  ## the manifest should only list cameras whose files are written
+    timings['flush_writer'] = time.time() - start_flush
+    timings['load_world'] = load_time
+    timings['total'] = time.time() - start
+    with open(join(out_dir, 'render_timings.json'), 'w') as f:
+        json.dump(timings, f, indent=3)
+    manifest.update({spec['label']: fingerprints[spec['label']] for spec in specs})
+    save_render_manifest(out_dir, manifest)
+    print(f"render_run_dir | {run_dir} | {len(specs)} cameras | load {round(load_time, 3)} sec "
+          f"| total {round(timings['total'], 3)} sec")
+    reset_simulation()
+    unstage_run_dir(staged_dir)
+    return timings
+
+
+##################################################################################
+
+
+def _write_image(path, array, kwargs):
+    from PIL import Image
+    if path.endswith('.npy'):
+        np.save(path, array)
+    elif path.endswith('.npz'):
+        np.savez_compressed(path, **array)
+    else:
+        Image.fromarray(np.asarray(array)).save(path, **kwargs)
+    return path
+
+
+class ImageWriter(object):
+    """ encodes and writes frames off the simulation thread, `write` blocks once `max_pending`
+        frames are queued so memory stays bounded, and everything is flushed on `close` or exit
+
+            with ImageWriter() as writer:
+                writer.write(join(out_dir, 'rgb.png'), rgb)
+    """
+
+    def __init__(self, num_workers=4, max_pending=32, use_processes=False):
+        import atexit
+        import threading
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+        executor = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        self.executor = executor(max_workers=num_workers)
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.futures = []
+        self.written = 0
+        self.closed = False
+        atexit.register(self.close)
+
+    def _done(self, future):
+        self.slots.release()
+
+    def submit(self, fn, *args, **kwargs):
+        """ run any writing function in the background, waits while the queue is full """
+        if self.closed:
+            return fn(*args, **kwargs)
+        self.slots.acquire()
+        future = self.executor.submit(fn, *args, **kwargs)
+        future.add_done_callback(self._done)
+        self.futures.append(future)
+        if len(self.futures) > 1000:
+            self._collect()
+
+    def write(self, path, array, **kwargs):
+        """ kwargs go to `PIL.Image.save`, e.g. quality=90 for jpg """
+        self.submit(_write_image, path, array, kwargs)
+
+    def _collect(self, wait=False):
+        pending = []
+        for future in self.futures:
+            if wait or future.done():
+                future.result()  ## raise errors from the workers
+                self.written += 1
+            else:
+                pending.append(future)
+        self.futures = pending
+
+    def flush(self):
+        self._collect(wait=True)
+
+    def close(self):
+        import atexit
+        if self.closed:
+            return
+        self.closed = True
+        atexit.unregister(self.close)
+        try:
+            self.flush()
+        finally:
+            self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _get_image_savers():
+    """ (owner, name, path argument, array argument or None for PIL's `Image.save`) of the image writing
+        functions that are installed, which drivers in other packages may call """
+    import importlib
+    from PIL import Image
+    savers = [(Image.Image, 'save', 0, None)]
+    for module_name, names in [('imageio', ['imwrite', 'imsave']), ('imageio.v2', ['imwrite', 'imsave']),
+                               ('cv2', ['imwrite'])]:
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError:
+            continue
+        savers += [(module, name, 0, 1) for name in names if hasattr(module, name)]
+    return savers
+
+
+def _get_image_readers():
+    import importlib
+    from PIL import Image
+    readers = [(Image, 'open')]
+    for module_name, names in [('imageio', ['imread', 'get_reader']), ('imageio.v2', ['imread', 'get_reader']),
+                               ('cv2', ['imread'])]:
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError:
+            continue
+        readers += [(module, name) for name in names if hasattr(module, name)]
+    return readers
+
+
+@contextmanager
+def background_image_saving(writer=None):
+    """ within the block, images saved to a path with PIL, imageio or cv2 are encoded and written by
+        an `ImageWriter`, e.g. by `generate_segmented_images` or the replay, which live in other packages,
+        reading an image first waits for the pending writes, and all are flushed when the block ends,
+        only calls from the thread that entered the block are redirected """
+    import threading
+    own_writer = writer is None
+    writer = ImageWriter() if own_writer else writer
+    thread = threading.current_thread()
+    patched = []
+
+    def patch(owner, name, fn):
+        patched.append((owner, name, getattr(owner, name)))
+        setattr(owner, name, fn)
+
+    for owner, name, path_index, array_index in _get_image_savers():
+        def save(*args, _original=getattr(owner, name), _path_index=path_index, _array_index=array_index,
+                 **kwargs):
+            ## PIL's `Image.save(self, fp)` is called with the image first
+            image_index = 0 if _array_index is None else _array_index
+            path_index = _path_index + 1 if _array_index is None else _path_index
+            if threading.current_thread() is not thread or len(args) <= max(image_index, path_index) \
+                    or not isinstance(args[path_index], (str, os.PathLike)):
+                return _original(*args, **kwargs)
+            args = list(args)
+            ## a copy, since the caller may reuse the buffer, which `Image.fromarray` can share
+            args[image_index] = args[image_index].copy() if _array_index is None else np.array(args[image_index])
+            writer.submit(_original, *args, **kwargs)
+            return None if _array_index is None else True
+
+        patch(owner, name, save)
+
+    for owner, name in _get_image_readers():
+        def read(*args, _original=getattr(owner, name), **kwargs):
+            if threading.current_thread() is thread:
+                writer.flush()
+            return _original(*args, **kwargs)
+
+        patch(owner, name, read)
+
+    try:
+        yield writer
+    finally:
+        for owner, name, original in reversed(patched):
+            setattr(owner, name, original)
+        if own_writer:
+            writer.close()
+        else:
+            writer.flush()
@@ -0,0 +1,467 @@
+import os
+import time
+import pickle
+import hashlib
+from os import listdir
+from os.path import join, isfile, isdir, dirname, abspath
+
+
+## parsed lisdf scenes, keyed by file content and parser version
+LISDF_CACHE_DIR = abspath(join(dirname(__file__), '..', 'temp', 'lisdf_cache'))
+LISDF_CACHE_FORMAT = 2
+_PARSER_VERSION = {}
+_LOAD_SDF = {}
+
+
+def get_file_hash(path):
+    return hashlib.sha1(open(path, 'rb').read()).hexdigest()
+
+
+def _get_load_sdf():
+    """ the parser's own `load_sdf`, also after `use_lisdf_cache` replaced it """
+    if 'load_sdf' not in _LOAD_SDF:
+        from lisdf.parsing import sdf_j
+        _LOAD_SDF['load_sdf'] = sdf_j.load_sdf
+    return _LOAD_SDF['load_sdf']
+
+
+def get_parser_version():
+    """ hash of the lisdf parser sources and grammars, so the cache is invalidated when they change """
+    if 'version' not in _PARSER_VERSION:
+        from lisdf.parsing import sdf_j
+        parser_dir = dirname(sdf_j.__file__)
+        h = hashlib.sha1()
+        for f in sorted(listdir(parser_dir)):
+            if f.endswith('.py') or f.endswith('.lark'):
+                h.update(f.encode('utf-8'))
+                h.update(open(join(parser_dir, f), 'rb').read())
+        _PARSER_VERSION['version'] = h.hexdigest()[:12]
+    return _PARSER_VERSION['version']
+
+
+def get_lisdf_cache_file(lisdf_path, cache_dir=LISDF_CACHE_DIR):
+    """ the same scene staged or copied to another folder shares the entry,
+        paths that the parser resolved against the scene's folder are moved on load """
+    h = hashlib.sha1()
+    h.update(get_file_hash(lisdf_path).encode('utf-8'))
+    h.update(get_parser_version().encode('utf-8'))
+    h.update(str(LISDF_CACHE_FORMAT).encode('utf-8'))
+    return join(cache_dir, f'{h.hexdigest()}.pkl')
+
+
+def _relocate_paths(obj, old_dir, new_dir, memo=None):
+    """ replace the `old_dir` prefix of the path strings in a parsed scene, lists, dicts and objects
+        are changed in place """
+    if isinstance(obj, str):
+        if obj == old_dir or obj.startswith(old_dir + os.sep):
+            return new_dir + obj[len(old_dir):]
+        return obj
+    if obj is None or isinstance(obj, (bool, int, float, bytes)):
+        return obj
+    memo = set() if memo is None else memo
+    if id(obj) in memo:
+        return obj
+    memo.add(id(obj))
+    relocate = lambda v: _relocate_paths(v, old_dir, new_dir, memo)
+    if isinstance(obj, list):
+        obj[:] = [relocate(v) for v in obj]
+    elif isinstance(obj, tuple):
+        return type(obj)(*[relocate(v) for v in obj]) if hasattr(obj, '_fields') else tuple(relocate(v) for v in obj)
+    elif isinstance(obj, dict):
+        for k, v in list(obj.items()):
+            obj[k] = relocate(v)
+    elif hasattr(obj, '__dict__') and not isinstance(obj, type):
+        for k, v in list(vars(obj).items()):
+            setattr(obj, k, relocate(v))
+    return obj
+
+
+def load_sdf_cached(lisdf_path, cache_dir=LISDF_CACHE_DIR, verbose=False):
+    """ same as `lisdf.parsing.sdf_j.load_sdf`, but returns the pickled result of an earlier parse
+        of the same content with the same parser instead of invoking the grammar again """
+    scene_dir = dirname(abspath(lisdf_path))
+    cache_file = get_lisdf_cache_file(lisdf_path, cache_dir)
+    if isfile(cache_file):
+        try:
+            with open(cache_file, 'rb') as f:
+                cached = pickle.load(f)
+            result = cached['result']
+            if cached['scene_dir'] != scene_dir:
+                result = _relocate_paths(result, cached['scene_dir'], scene_dir)
+            if verbose:
+                print('load_sdf_cached | hit', lisdf_path)
+            return result
+        except Exception:
+            os.remove(cache_file)
+    result = _get_load_sdf()(lisdf_path)
+    if not isdir(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+    tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+    with open(tmp_file, 'wb') as f:
+        pickle.dump(dict(scene_dir=scene_dir, result=result), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, cache_file)
+    if verbose:
+        print('load_sdf_cached | miss', lisdf_path)
+    return result
+
+
+def use_lisdf_cache(cache_dir=LISDF_CACHE_DIR):
+    """ make `load_lisdf_pybullet` and other callers of `load_sdf` parse through `load_sdf_cached`,
+        calls with other arguments than the path still go to the parser """
+    import importlib
+    original = _get_load_sdf()
+
+    def load_sdf(lisdf_path, *args, **kwargs):
+        if len(args) > 0 or len(kwargs) > 0:
+            return original(lisdf_path, *args, **kwargs)
+        return load_sdf_cached(lisdf_path, cache_dir)
+
+    for name in ['lisdf.parsing.sdf_j', 'lisdf_tools.lisdf_loader', 'pybullet_planning.lisdf_tools.lisdf_loader']:
+        try:
+            module = importlib.import_module(name)
+        except ImportError:
+            continue
+        if hasattr(module, 'load_sdf'):
+            module.load_sdf = load_sdf
+
+
+def benchmark_lisdf_cache(lisdf_paths, cache_dir=LISDF_CACHE_DIR):
+    """ compare parsing with the grammar against loading from the cache """
+    load_sdf = _get_load_sdf()
+    cold = warm = 0
+    for lisdf_path in lisdf_paths:
+        start = time.time()
+        load_sdf(lisdf_path)
+        cold += time.time() - start
+        load_sdf_cached(lisdf_path, cache_dir)  ## make sure the entry exists
+        start = time.time()
+        load_sdf_cached(lisdf_path, cache_dir)
+        warm += time.time() - start
+    n = max(len(lisdf_paths), 1)
+    print(f'benchmark_lisdf_cache | {len(lisdf_paths)} scenes | cold {round(cold / n, 4)} sec '
+          f'| warm {round(warm / n, 4)} sec | speedup {round(cold / max(warm, 1e-9), 1)}x')
+    return cold, warm
+
+
+##################################################################################
+
+
+class AssetRegistry(object):
+    """ process-wide cache of loaded assets keyed by (category, instance id, scale), with LRU
+        eviction under a memory cap, each simulator backend registers how to load and size an asset,
+        assets still used by an owner (e.g. a body created from them) are never evicted """
+
+    def __init__(self, max_bytes=2 * 1024 ** 3):
+        from collections import OrderedDict, Counter
+        self.max_bytes = max_bytes
+        self.assets = OrderedDict()
+        self.backends = {}
+        self.refs = Counter()
+        self.owners = {}
+        self.total_bytes = 0
+        self.stats = dict(hits=0, misses=0, evictions=0)
+
+    def register_backend(self, name, load_fn, size_fn=None, release_fn=None):
+        """ `load_fn(category, idx, scale, path)` returns the asset, `size_fn(asset, path)` its size in bytes,
+            `release_fn(asset)` frees it in the simulator when it is evicted """
+        self.backends[name] = dict(load_fn=load_fn, size_fn=size_fn, release_fn=release_fn)
+
+    @staticmethod
+    def get_key(backend, category, idx, scale=1):
+        return backend, category, str(idx), round(scale, 6)
+
+    def get(self, backend, category, idx, scale=1, path=None):
+        key = self.get_key(backend, category, idx, scale)
+        if key in self.assets:
+            self.stats['hits'] += 1
+            self.assets.move_to_end(key)
+            return self.assets[key][0]
+        self.stats['misses'] += 1
+        b = self.backends[backend]
+        asset = b['load_fn'](category, idx, scale, path)
+        size = b['size_fn'](asset, path) if b['size_fn'] is not None else 0
+        self.assets[key] = (asset, size)
+        self.total_bytes += size
+        self._trim(keep=key)
+        return asset
+
+    def acquire(self, backend, category, idx, scale=1, owner=None):
+        """ mark the asset as used by `owner` until `release(backend, owner)` """
+        key = self.get_key(backend, category, idx, scale)
+        self.owners[(backend, owner)] = key
+        self.refs[key] += 1
+
+    def release(self, backend, owner):
+        key = self.owners.pop((backend, owner), None)
+        if key is None:
+            return
+        self.refs[key] -= 1
+        if self.refs[key] <= 0:
+            del self.refs[key]
+        self._trim()
+
+    def _trim(self, keep=None):
+        """ evict the least recently used assets that have no owners, the cap can be exceeded
+            while every other asset is in use """
+        while self.total_bytes > self.max_bytes:
+            key = next((k for k in self.assets if k != keep and self.refs[k] <= 0), None)
+            if key is None:
+                break
+            self._evict(key)
+
+    def _evict(self, key):
+        asset, size = self.assets.pop(key)
+        release_fn = self.backends[key[0]]['release_fn']
+        if release_fn is not None:
+            release_fn(asset)
+        self.total_bytes -= size
+        self.stats['evictions'] += 1
+
+    def clear(self, backend=None):
+        """ call with the backend name after resetting its simulation, since its handles become invalid """
+        for key in [k for k in self.assets if backend is None or k[0] == backend]:
+            self.total_bytes -= self.assets.pop(key)[1]
+            self.refs.pop(key, None)
+        self.owners = {o: k for o, k in self.owners.items() if not (backend is None or k[0] == backend)}
+
+    def summarize(self):
+        total = max(self.stats['hits'] + self.stats['misses'], 1)
+        print(f"AssetRegistry | {len(self.assets)} assets ({len(self.refs)} in use), "
+              f"{round(self.total_bytes / 1024 ** 2, 2)} mb "
+              f"| hits {self.stats['hits']}, misses {self.stats['misses']}, evictions {self.stats['evictions']} "
+              f"| hit rate {round(self.stats['hits'] / total, 3)}")
+        return dict(self.stats)
+
+
+def _get_process_registry():
+    """ this module is imported as `loading_utils` from examples/ and as `examples.loading_utils`
+        from dev/, both share the registry created first """
+    import sys
+    for name in ['loading_utils', 'examples.loading_utils']:
+        module = sys.modules.get(name)
+        if module is not None and hasattr(module, 'ASSET_REGISTRY'):
+            return module.ASSET_REGISTRY
+    return AssetRegistry()
+
+
+ASSET_REGISTRY = _get_process_registry()
+_LOAD_PYBULLET = {}
+
+
+def parse_urdf_asset(path):
+    """ links, joints, collision / visual meshes with the mesh paths made absolute, and the inertial,
+        contact and material properties of the first link, which `p.loadURDF` would apply """
+    import xml.etree.ElementTree as ET
+    root = ET.parse(path).getroot()
+    urdf_dir = dirname(abspath(path))
+    colors = {m.get('name'): m.find('color') for m in root.findall('material')}
+
+    def get_origin(elem):
+        origin = elem.find('origin')
+        xyz = [0, 0, 0] if origin is None else [float(v) for v in origin.get('xyz', '0 0 0').split()]
+        rpy = [0, 0, 0] if origin is None else [float(v) for v in origin.get('rpy', '0 0 0').split()]
+        return xyz, rpy
+
+    def get_meshes(link, tag):
+        meshes = []
+        for elem in link.findall(tag):
+            mesh = elem.find('geometry/mesh')
+            if mesh is None:
+                continue
+            xyz, rpy = get_origin(elem)
+            scale = [float(v) for v in mesh.get('scale', '1 1 1').split()]
+            meshes.append((join(urdf_dir, mesh.get('filename')), xyz, rpy, scale))
+        return meshes
+
+    def get_rgba(visual):
+        material = visual.find('material')
+        if material is None:
+            return None
+        if material.find('texture') is not None:
+            return 'texture'
+        color = material.find('color')
+        if color is None:
+            color = colors.get(material.get('name'))
+        return None if color is None else tuple(float(v) for v in color.get('rgba').split())
+
+    links = root.findall('link')
+    asset = dict(path=abspath(path), links=[l.get('name') for l in links],
+                 num_joints=len([j for j in root.findall('joint') if j.get('type') != 'fixed']),
+                 collisions=[m for l in links for m in get_meshes(l, 'collision')],
+                 visuals=[m for l in links for m in get_meshes(l, 'visual')],
+                 only_meshes=all(e.find('geometry/mesh') is not None
+                                 for l in links for e in l.findall('collision') + l.findall('visual')),
+                 rgbas=set(get_rgba(v) for l in links for v in l.findall('visual')),
+                 mass=1., inertial_origin=([0, 0, 0], [0, 0, 0]), dynamics={})
+    if len(links) > 0:
+        inertial = links[0].find('inertial')
+        if inertial is not None:
+            mass = inertial.find('mass')
+            asset['mass'] = 1. if mass is None else float(mass.get('value'))
+            asset['inertial_origin'] = get_origin(inertial)
+        contact = links[0].find('contact')
+        if contact is not None:
+            for tag, name in [('lateral_friction', 'lateralFriction'), ('rolling_friction', 'rollingFriction'),
+                              ('spinning_friction', 'spinningFriction'), ('restitution', 'restitution')]:
+                if contact.find(tag) is not None:
+                    asset['dynamics'][name] = float(contact.find(tag).get('value'))
+    files = set(m[0] for m in asset['collisions'] + asset['visuals'])
+    asset['size'] = os.path.getsize(path) + sum(os.path.getsize(f) for f in files if isfile(f))
+    return asset
+
+
+def can_share_shapes(asset):
+    """ a single rigid link made of meshes with at most one plain color, anything else is loaded
+        with `p.loadURDF` each time so that the body is the same as without the registry """
+    return len(asset['links']) == 1 and len(asset['collisions']) > 0 and asset['only_meshes'] \
+        and 'texture' not in asset['rgbas'] and len(asset['rgbas'] - {None}) <= 1
+
+
+def _create_pybullet_shapes(asset, scale):
+    import pybullet as p
+    if not can_share_shapes(asset):
+        return asset
+    shapes = dict(asset)
+    kwargs = lambda meshes: dict(
+        shapeTypes=[p.GEOM_MESH] * len(meshes), fileNames=[m[0] for m in meshes],
+        meshScales=[[s * scale for s in m[3]] for m in meshes],
+        collisionFramePositions=[[v * scale for v in m[1]] for m in meshes],
+        collisionFrameOrientations=[p.getQuaternionFromEuler(m[2]) for m in meshes])
+    shapes['collision_shape'] = p.createCollisionShapeArray(**kwargs(asset['collisions']))
+    if len(asset['visuals']) > 0:
+        visual_kwargs = kwargs(asset['visuals'])
+        visual_kwargs['visualFramePositions'] = visual_kwargs.pop('collisionFramePositions')
+        visual_kwargs['visualFrameOrientations'] = visual_kwargs.pop('collisionFrameOrientations')
+        shapes['visual_shape'] = p.createVisualShapeArray(**visual_kwargs)
+    return shapes
+
+
+def _release_pybullet_shapes(asset):
+    """ called on eviction, when no body created by `load_asset_pybullet` from the shapes is left,
+        pybullet can only free collision shapes, visual shapes stay until the simulation is reset """
+    import pybullet as p
+    if 'collision_shape' in asset:
+        p.removeCollisionShape(asset['collision_shape'])
+
+
+ASSET_REGISTRY.register_backend(
+    'pybullet', load_fn=lambda category, idx, scale, path: _create_pybullet_shapes(parse_urdf_asset(path), scale),
+    size_fn=lambda asset, path: asset['size'], release_fn=_release_pybullet_shapes)
+
+
+def _create_asset_body(asset, scale, pose, fixed_base):
+    """ the body built from cached shapes, or None if the shapes are not the asset's meshes in the
+        current simulation, e.g. after `reset_simulation` or a new connection """
+    import pybullet as p
+    point, quat = pose
+    xyz, rpy = asset['inertial_origin']
+    try:
+        body = p.createMultiBody(baseMass=0 if fixed_base else asset['mass'],
+                                 baseCollisionShapeIndex=asset['collision_shape'],
+                                 baseVisualShapeIndex=asset.get('visual_shape', -1),
+                                 baseInertialFramePosition=[v * scale for v in xyz],
+                                 baseInertialFrameOrientation=p.getQuaternionFromEuler(rpy),
+                                 basePosition=point, baseOrientation=quat)
+    except p.error:
+        return None
+    if body < 0:
+        return None
+    expected = set(os.path.basename(m[0]) for m in asset['collisions'])
+    found = set(os.path.basename(d[4].decode('utf-8') if isinstance(d[4], bytes) else d[4])
+                for d in p.getCollisionShapeData(body, -1))
+    if len(found) == 0 or not found <= expected:
+        p.removeBody(body)
+        return None
+    if len(asset['dynamics']) > 0:
+        p.changeDynamics(body, -1, **asset['dynamics'])
+    rgba = next((c for c in asset['rgbas'] if c is not None), None)
+    if rgba is not None:
+        p.changeVisualShape(body, -1, rgbaColor=rgba)
+    return body
+
+
+def load_asset_pybullet(category, idx, path, scale=1, pose=((0, 0, 0), (0, 0, 0, 1)), fixed_base=True,
+                        registry=ASSET_REGISTRY):
+    """ create a body from the registry's shapes when the asset has one link, otherwise load the urdf,
+        remove it with `remove_asset_body` so the shapes can be evicted once no body uses them,
+        the cached shapes are dropped automatically once the simulation was reset """
+    import pybullet as p
+    asset = registry.get('pybullet', category, idx, scale=scale, path=path)
+    if 'collision_shape' in asset:
+        body = _create_asset_body(asset, scale, pose, fixed_base)
+        if body is None:
+            registry.clear('pybullet')
+            asset = registry.get('pybullet', category, idx, scale=scale, path=path)
+            body = _create_asset_body(asset, scale, pose, fixed_base)
+        if body is not None:
+            registry.acquire('pybullet', category, idx, scale=scale, owner=body)
+            return body
+    point, quat = pose
+    return p.loadURDF(asset['path'], basePosition=point, baseOrientation=quat,
+                      useFixedBase=fixed_base, globalScaling=scale)
+
+
+def get_asset_category(path):
+    """ (category, instance id) of assets/models/{category}/{idx}/mobility.urdf or .../{category}/{idx}.urdf """
+    parts = abspath(path).split(os.sep)
+    if parts[-1] == 'mobility.urdf':
+        return tuple(parts[-3:-1])
+    return parts[-2], parts[-1].replace('.urdf', '')
+
+
+def use_asset_registry(registry=ASSET_REGISTRY):
+    """ make `load_lisdf_pybullet` load the urdfs of a scene through the registry, the same way
+        `use_lisdf_cache` routes its parsing, bodies created from shared shapes have no urdf body name """
+    import importlib
+    if 'load_pybullet' not in _LOAD_PYBULLET:
+        from pybullet_tools.utils import load_pybullet as original
+        _LOAD_PYBULLET['load_pybullet'] = original
+    original = _LOAD_PYBULLET['load_pybullet']
+
+    def load_pybullet(filename, fixed_base=False, scale=1., **kwargs):
+        if len(kwargs) > 0 or not filename.endswith('.urdf'):
+            return original(filename, fixed_base=fixed_base, scale=scale, **kwargs)
+        category, idx = get_asset_category(filename)
+        return load_asset_pybullet(category, idx, filename, scale=scale, fixed_base=fixed_base, registry=registry)
+
+    for name in ['pybullet_tools.utils', 'lisdf_tools.lisdf_loader']:
+        try:
+            module = importlib.import_module(name)
+        except ImportError:
+            continue
+        if hasattr(module, 'load_pybullet'):
+            module.load_pybullet = load_pybullet
+
+
+def remove_asset_body(body, registry=ASSET_REGISTRY):
+    import pybullet as p
+    p.removeBody(body)
+    registry.release('pybullet', body)
+
+
+def load_scene_assets_pybullet(lisdf_path, asset_path=None, registry=ASSET_REGISTRY):
+    """ {name: body} of the urdfs included in a scene, loaded through the registry so that scenes
+        loaded one after the other share the shapes of their common assets """
+    import pybullet as p
+    import xml.etree.ElementTree as ET
+    from dataset_utils import fix_asset_uris
+    run_dir = dirname(abspath(lisdf_path))
+    text = open(lisdf_path, 'r').read()
+    if asset_path is not None:
+        text = fix_asset_uris(text, run_dir, asset_path)
+    bodies = {}
+    for include in ET.fromstring(text).find('world').findall('include'):
+        uri = include.find('uri').text.strip()
+        path = uri if uri.startswith('/') else abspath(join(run_dir, uri))
+        if not isfile(path):
+            continue
+        scale = include.find('scale')
+        static = include.find('static')
+        pose = include.find('pose')
+        values = [0.] * 6 if pose is None else [float(v) for v in pose.text.split()]
+        category, idx = get_asset_category(path)
+        bodies[include.get('name')] = load_asset_pybullet(
+            category, idx, path, scale=1. if scale is None else float(scale.text),
+            pose=(values[:3], p.getQuaternionFromEuler(values[3:])),
+            fixed_base=static is not None and static.text.strip() == 'true', registry=registry)
+    return bodies
@@ -0,0 +1,791 @@
+import os
+import json
+import time
+import pickle
+import multiprocessing
+from contextlib import contextmanager
+from os.path import join, isfile
+
+
+class ReplicaChecker(object):
+    """ wraps a feasibility checker so that replica `index` out of `num` only evaluates every
+        `num`-th skeleton, the replicas are forked from the same state so they see the same sequence,
+        skeletons owned by other replicas are rejected without calling the checker, so each
+        replica's fc log only has its own skeletons """
+
+    def __init__(self, fc, index, num):
+        self.fc = fc
+        self.index = index
+        self.num = num
+        self.count = 0
+
+    def _owns(self):
+        owned = self.count % self.num == self.index
+        self.count += 1
+        return owned
+
+    def __call__(self, plans, *args, **kwargs):
+        if not isinstance(plans, list):
+            return self._owns() and self.fc(plans, *args, **kwargs)
+        owned = [self._owns() for _ in plans]
+        results = iter(self.fc([p for p, o in zip(plans, owned) if o], *args, **kwargs) if any(owned) else [])
+        return [o and next(results) for o in owned]
+
+    def __getattr__(self, name):
+        return getattr(self.fc, name)
+
+
+def _serialize_solution(solution):
+    """ (pickled solution or None, error message or None), the evaluations are dropped if only they
+        can't be pickled, since the queue would otherwise drop the whole solution without a word """
+    try:
+        return pickle.dumps(solution), None
+    except Exception as e:
+        error = repr(e)
+    try:
+        plan, cost, evaluations = solution
+        return pickle.dumps((plan, cost, [])), f'evaluations not sent, {error}'
+    except Exception as e:
+        return None, f'solution not sent, {e!r}'
+
+
+def solve_in_replicas(solve_fn, fc, num_replicas, log_dir, poll_interval=1, **kwargs):
+    """ fork `num_replicas` copies of the loaded world (pybullet has to be in DIRECT mode) and let each
+        call `solve_fn(fc=ReplicaChecker(fc, i, num_replicas), **kwargs)` on its share of the skeletons,
+        returns the first solution with a plan, and the fc log files written by the replicas,
+        a replica that raises, dies, or finds a solution that can't be pickled counts as 'failed' """
+    import traceback
+    from queue import Empty
+    ctx = multiprocessing.get_context('fork')
+    queue = ctx.Queue()
+    log_files = [join(log_dir, f'fc_log_replica={i}.json') for i in range(num_replicas)]
+
+    def replica(index):
+        payload, error = None, None
+        try:
+            solution = solve_fn(fc=ReplicaChecker(fc, index, num_replicas), **kwargs)
+            fc.dump_log(log_files[index])
+            if solution != 'failed':
+                payload, error = _serialize_solution(solution)
+        except Exception:
+            error = traceback.format_exc()
+        finally:
+            ## only bytes and strings go through the queue
+            queue.put((index, payload, error))
+
+    start = time.time()
+    processes = [ctx.Process(target=replica, args=(i,)) for i in range(num_replicas)]
+    for process in processes:
+        process.start()
+    solution = 'failed'
+    reported = set()
+    dead = set()
+    exited = set()
+    try:
+        while len(reported | dead) < num_replicas:
+            try:
+                index, payload, error = queue.get(timeout=poll_interval)
+            except Empty:
+                ## died without reporting, e.g. killed or crashed in pybullet, only counted after two polls
+                ## so that the result of a replica that just exited, still in the pipe, is not missed
+                for i in exited - reported - dead:
+                    print(f'solve_in_replicas | replica {i} exited with code {processes[i].exitcode}')
+                    dead.add(i)
+                exited = {i for i, p in enumerate(processes) if p.exitcode is not None}
+                continue
+            reported.add(index)
+            if error is not None:
+                print(f'solve_in_replicas | replica {index} | {error}')
+            if payload is None:
+                continue
+            try:
+                result = pickle.loads(payload)
+            except Exception as e:
+                print(f'solve_in_replicas | replica {index} | solution not received, {e!r}')
+                continue
+            solution = result
+            if result[0] is not None:
+                print(f'solve_in_replicas | replica {index} found a plan in {round(time.time() - start, 3)} sec')
+                break
+    finally:
+        ## also reached when the caller's timeout interrupts the wait
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+    return solution, [f for f in log_files if isfile(f)]
+
+
+def merge_fc_logs(log_files, out_file, remove=True):
+    """ concatenate the list entries and sum the numeric entries of the replicas' fc logs """
+    merged = {}
+    for log_file in log_files:
+        log = json.load(open(log_file, 'r'))
+        for k, v in log.items():
+            if k not in merged:
+                merged[k] = v
+            elif isinstance(v, list):
+                merged[k] = merged[k] + v
+            elif isinstance(v, (int, float)) and not isinstance(v, bool):
+                merged[k] = merged[k] + v
+        if remove:
+            os.remove(log_file)
+    with open(out_file, 'w') as f:
+        json.dump(merged, f, indent=3)
+    return merged
+
+
+##################################################################################
+
+
+## upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = [0.001, 0.01, 0.1, 1, 10, float('inf')]
+
+
+def _is_success(outputs):
+    if outputs is None or outputs is False:
+        return False
+    return not (isinstance(outputs, (list, tuple)) and len(outputs) == 0)
+
+
+def _is_bounded_generator(result):
+    """ pddlstream's `BoundedGenerator`, which `from_fn`, `from_test` and `from_gen_fn` return,
+        its `enumerated` and `max_calls` tell the planner when a stream instance is exhausted """
+    return hasattr(result, 'generator') and hasattr(result, 'max_calls') and hasattr(result, 'enumerated')
+
+
+def replace_stream_map(pddlstream_problem, stream_map):
+    if hasattr(pddlstream_problem, '_replace'):
+        return pddlstream_problem._replace(stream_map=stream_map)
+    return tuple(pddlstream_problem[:3]) + (stream_map,) + tuple(pddlstream_problem[4:])
+
+
+class StreamProfiler(object):
+    """ wraps the stream map from `pddlstream_from_dir` and records, per stream, the number of calls,
+        the number of successful and empty `next()` results, and a histogram of their latencies """
+
+    def __init__(self):
+        self.profiles = {}
+
+    def _get_profile(self, name):
+        if name not in self.profiles:
+            self.profiles[name] = dict(calls=0, nexts=0, successes=0, failures=0, total_time=0.,
+                                       max_time=0., histogram=[0] * len(LATENCY_BUCKETS))
+        return self.profiles[name]
+
+    def _record(self, name, duration, success):
+        profile = self._get_profile(name)
+        profile['nexts'] += 1
+        profile['successes' if success else 'failures'] += 1
+        profile['total_time'] += duration
+        profile['max_time'] = max(profile['max_time'], duration)
+        profile['histogram'][next(i for i, b in enumerate(LATENCY_BUCKETS) if duration < b)] += 1
+
+    def _wrap_generator(self, name, generator):
+        while True:
+            start = time.time()
+            try:
+                outputs = next(generator)
+            except StopIteration:
+                self._record(name, time.time() - start, False)
+                return
+            self._record(name, time.time() - start, _is_success(outputs))
+            yield outputs
+
+    def wrap(self, name, gen_fn):
+        def profiled_fn(*args, **kwargs):
+            self._get_profile(name)['calls'] += 1
+            start = time.time()
+            result = gen_fn(*args, **kwargs)
+            if _is_bounded_generator(result):
+                ## time the inner generator and return the same object, so the planner still sees it as enumerated
+                result.generator = self._wrap_generator(name, iter(result.generator))
+                return result
+            if hasattr(result, '__next__'):
+                return self._wrap_generator(name, iter(result))
+            self._record(name, time.time() - start, _is_success(result))
+            return result
+        return profiled_fn
+
+    def wrap_stream_map(self, stream_map):
+        return {name: self.wrap(name, fn) if callable(fn) else fn for name, fn in stream_map.items()}
+
+    def get_summary(self):
+        summary = {}
+        for name, profile in sorted(self.profiles.items(), key=lambda kv: -kv[1]['total_time']):
+            profile = dict(profile)
+            profile['success_rate'] = round(profile['successes'] / max(profile['nexts'], 1), 3)
+            profile['mean_time'] = round(profile['total_time'] / max(profile['nexts'], 1), 5)
+            profile['histogram'] = {f'<{b}': n for b, n in zip(LATENCY_BUCKETS, profile['histogram'])}
+            summary[name] = profile
+        return summary
+
+    def dump(self, file_path):
+        with open(file_path, 'w') as f:
+            json.dump(dict(latency_buckets=[str(b) for b in LATENCY_BUCKETS],
+                           streams=self.get_summary()), f, indent=3)
+
+
+##################################################################################
+
+
+PREFILTER_LEDGER = 'prefilter.jsonl'
+
+
+def get_goal_literals(goal):
+    """ ('and', ('on', o, s), ...) -> [('on', o, s), ...] """
+    if len(goal) > 0 and goal[0] in ['and', 'AND']:
+        return [lit for g in goal[1:] for lit in get_goal_literals(g)]
+    return [tuple(goal)]
+
+
+def _get_aabb(body):
+    """ body or (body, None, link) -> (lower, upper) """
+    import numpy as np
+    from pybullet_tools.utils import get_aabb
+    aabb = get_aabb(body[0], link=body[-1]) if isinstance(body, tuple) else get_aabb(body)
+    return np.array(aabb[0]), np.array(aabb[1])
+
+
+def _get_rect_distance(aabb, base_limits):
+    """ distance in xy from an aabb to the rectangle the robot base can be in """
+    import numpy as np
+    (x_min, x_max), (y_min, y_max) = base_limits
+    dx = max(x_min - aabb[1][0], 0, aabb[0][0] - x_max)
+    dy = max(y_min - aabb[1][1], 0, aabb[0][1] - y_max)
+    return float(np.hypot(dx, dy))
+
+
+def _get_union_area(rects):
+    """ area covered by the union of xy rectangles ((x_min, y_min), (x_max, y_max)),
+        overlapping parts are counted once """
+    xs = sorted(set(x for rect in rects for x in [rect[0][0], rect[1][0]]))
+    area = 0
+    for x_min, x_max in zip(xs[:-1], xs[1:]):
+        ## merge the y intervals of the rectangles that span this x slab
+        intervals = sorted((r[0][1], r[1][1]) for r in rects if r[0][0] <= x_min and r[1][0] >= x_max)
+        covered = 0
+        end = None
+        for y_min, y_max in intervals:
+            if end is None or y_min > end:
+                covered += y_max - y_min
+                end = y_max
+            elif y_max > end:
+                covered += y_max - end
+                end = y_max
+        area += (x_max - x_min) * covered
+    return area
+
+
+def _get_xy_intersection(a, b):
+    """ the xy rectangle shared by two aabbs, or None """
+    lower = (max(a[0][0], b[0][0]), max(a[0][1], b[0][1]))
+    upper = (min(a[1][0], b[1][0]), min(a[1][1], b[1][1]))
+    if lower[0] >= upper[0] or lower[1] >= upper[1]:
+        return None
+    return lower, upper
+
+
+def _get_base_body(body):
+    return body[0] if isinstance(body, tuple) else body
+
+
+def get_movable_bodies(init):
+    """ bodies with a ('graspable', body) fact, which the plan may move out of the way """
+    return [fact[1] for fact in init if len(fact) == 2 and str(fact[0]).lower() == 'graspable']
+
+
+class _CheckTimeout(BaseException):
+    """ not an `Exception`, so that streams which catch everything don't swallow it """
+    pass
+
+
+@contextmanager
+def _time_limit(seconds):
+    """ interrupt the block after `seconds` with `_CheckTimeout`, only in the main thread and when no
+        other interval timer is running, otherwise the block runs without a limit """
+    import signal
+    import threading
+    if threading.current_thread() is not threading.main_thread() or signal.getitimer(signal.ITIMER_REAL)[0] > 0:
+        yield
+        return
+
+    def handler(signum, frame):
+        raise _CheckTimeout()
+
+    previous = signal.signal(signal.SIGALRM, handler)
+    signal.setitimer(signal.ITIMER_REAL, max(seconds, 1e-3))
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+class FeasibilityPrefilter(object):
+    """ cheap checks of the goal before running pddlstream, each interrupted when `time_budget` runs out,
+        a problem is rejected only when a check clearly fails, checks that don't fit in the budget are skipped
+
+            - unreachable_object / unreachable_region: farther than `arm_reach` from the base limits
+            - region_too_small: the goal object doesn't fit in the surface or space in any yaw of 90 degrees
+            - region_blocked: the fixed obstacles leave less free area in the region than the object needs,
+                the aabbs of obstacles and object are counted at `fill_ratio` of their area, since a convex
+                footprint covers at least half of its aabb, `movable` bodies are never counted
+            - no_grasp: the grasp stream yields nothing for the goal object
+
+        a rejection only holds for this scene and these checks, it is not a reason to skip the run later
+    """
+
+    def __init__(self, base_limits=None, arm_reach=1.0, time_budget=5, obstacles=(), movable=(), stream_map=None,
+                 grasp_stream='sample-grasp', max_grasp_attempts=3, fill_ratio=0.5):
+        self.base_limits = base_limits
+        self.arm_reach = arm_reach
+        self.time_budget = time_budget
+        self.movable = set(movable)
+        self.obstacles = [o for o in obstacles if o not in self.movable and _get_base_body(o) not in self.movable]
+        self.stream_map = {} if stream_map is None else stream_map
+        self.grasp_stream = grasp_stream
+        self.max_grasp_attempts = max_grasp_attempts
+        self.fill_ratio = fill_ratio
+
+    def _check_reach(self, body, reason):
+        if self.base_limits is None:
+            return None
+        distance = _get_rect_distance(_get_aabb(body), self.base_limits)
+        if distance > self.arm_reach:
+            return reason, f'{body} is {round(distance, 3)} m from the base limits'
+        return None
+
+    def _check_region(self, body, region, inside):
+        lower, upper = _get_aabb(body)
+        region_lower, region_upper = _get_aabb(region)
+        size = sorted(upper[:2] - lower[:2])
+        region_size = sorted(region_upper[:2] - region_lower[:2])
+        if size[0] > region_size[0] or size[1] > region_size[1] or \
+                (inside and upper[2] - lower[2] > region_upper[2] - region_lower[2]):
+            return 'region_too_small', f'{body} of size {[round(s, 3) for s in upper - lower]} in {region}'
+
+        ## fixed objects resting on or inside the region, within the height of the goal object above its floor,
+        ## the body the region belongs to and its other links or doors are not obstacles of the region
+        floor = region_lower[2] if inside else region_upper[2]
+        band = (floor, floor + upper[2] - lower[2])
+        ignored = {_get_base_body(body), _get_base_body(region)}
+        rects = []
+        for other in self.obstacles:
+            if _get_base_body(other) in ignored:
+                continue
+            other_lower, other_upper = _get_aabb(other)
+            if other_upper[2] > band[0] + 0.01 and other_lower[2] < band[1]:
+                rect = _get_xy_intersection((other_lower, other_upper), (region_lower, region_upper))
+                if rect is not None:
+                    rects.append(rect)
+        occupied = self.fill_ratio * _get_union_area(rects)
+        free = region_size[0] * region_size[1] - occupied
+        if free < self.fill_ratio * size[0] * size[1]:
+            return 'region_blocked', f'{round(free, 4)} m^2 free in {region} for {body}'
+        return None
+
+    def _check_grasp(self, body):
+        if self.grasp_stream not in self.stream_map:
+            return None
+        results = self.stream_map[self.grasp_stream](body)
+        if not hasattr(results, '__next__'):
+            return None if results else ('no_grasp', f'no grasps for {body}')
+        for _ in range(self.max_grasp_attempts):
+            try:
+                if next(results):
+                    return None
+            except StopIteration:
+                return 'no_grasp', f'no grasps for {body}'
+        return None
+
+    def check(self, goal):
+        """ returns dict(accepted, reason, detail, checks, skipped, time) """
+        start = time.time()
+        checks = []
+        for literal in get_goal_literals(goal):
+            predicate = str(literal[0]).lower()
+            if predicate in ['on', 'in'] and len(literal) == 3:
+                body, region = literal[1:]
+                checks += [('reach_object', lambda b=body: self._check_reach(b, 'unreachable_object')),
+                           ('reach_region', lambda r=region: self._check_reach(r, 'unreachable_region')),
+                           ('region', lambda b=body, r=region, i=(predicate == 'in'): self._check_region(b, r, i)),
+                           ('grasp', lambda b=body: self._check_grasp(b))]
+            elif predicate == 'holding' and len(literal) == 3:
+                body = literal[2]
+                checks += [('reach_object', lambda b=body: self._check_reach(b, 'unreachable_object')),
+                           ('grasp', lambda b=body: self._check_grasp(b))]
+
+        result = dict(accepted=True, reason=None, detail=None, checks={}, skipped=[])
+        for name, check_fn in checks:
+            remaining = self.time_budget - (time.time() - start)
+            if remaining <= 0:
+                result['skipped'].append(name)
+                continue
+            check_start = time.time()
+            try:
+                with _time_limit(remaining):
+                    failure = check_fn()
+            except _CheckTimeout:
+                failure = None
+                result['skipped'].append(f'{name}: out of time')
+            except Exception as e:
+                ## a check that cannot be evaluated doesn't reject the problem
+                failure = None
+                result['skipped'].append(f'{name}: {e}')
+            result['checks'][name] = result['checks'].get(name, 0) + time.time() - check_start
+            if failure is not None:
+                result.update(accepted=False, reason=failure[0], detail=failure[1])
+                break
+        result['time'] = time.time() - start
+        return result
+
+
+def append_prefilter_result(ledger_file, run_dir, result, task=None):
+    """ one json line per filtered problem, shared by parallel processes like the results ledger """
+    import fcntl
+    record = dict(run=os.path.abspath(run_dir), task=task, timestamp=time.time(), **result)
+    with open(ledger_file, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(json.dumps(record) + '\n')
+        f.flush()
+        fcntl.flock(f, fcntl.LOCK_UN)
+    return record
+
+
+def summarize_prefilter(ledger_file, verbose=True):
+    """ rejection counts by task and reason, to see which scene samplers produce infeasible problems """
+    from collections import defaultdict
+    summary = defaultdict(lambda: defaultdict(int))
+    check_time = defaultdict(float)
+    if isfile(ledger_file):
+        with open(ledger_file, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                summary[record['task']]['total'] += 1
+                summary[record['task']][record['reason'] or 'accepted'] += 1
+                check_time[record['task']] += record['time']
+    summary = {task: dict(counts) for task, counts in summary.items()}
+    if verbose:
+        for task, counts in summary.items():
+            rejected = counts['total'] - counts.get('accepted', 0)
+            print(f"summarize_prefilter | {task} | rejected {rejected} of {counts['total']} "
+                  f"| {round(check_time[task] / counts['total'], 3)} sec per problem "
+                  f"| {', '.join(f'{k} {v}' for k, v in counts.items() if k not in ['total', 'accepted'])}")
+    return summary
+
+
+##################################################################################
+
+
+TASK_PREFIXES = ['tt_', 'mm_', 'hh_', 'val_']
+
+
+def get_task_family(task):
+    """ mm_, hh_ and val_ variants share the budgets of the tt_ task """
+    for prefix in TASK_PREFIXES:
+        if task.startswith(prefix):
+            return 'tt_' + task[len(prefix):]
+    return task
+
+
+def load_planning_history(ledger_file, fc=None, mode=None):
+    """ {task: [(solved, planning_time, time_limit)]} from the results ledger, the task is the parent folder
+        of the run, `time_limit` is only kept for timeouts, whose outcome past it is unknown,
+        older timeout records without `max_time` were stopped at their planning time """
+    from collections import defaultdict
+    from dataset_utils import iter_ledger_records
+    history = defaultdict(list)
+    for record in iter_ledger_records(ledger_file):
+        if record['status'] not in ['solved', 'failed', 'timeout'] or record['planning_time'] is None:
+            continue
+        if (fc is not None and record['fc'] != str(fc)) or (mode is not None and record['mode'] != mode):
+            continue
+        task = os.path.basename(os.path.dirname(record['run']))
+        time_limit = None
+        if record['status'] == 'timeout':
+            time_limit = record.get('max_time') or record['planning_time']
+        history[task].append((record['status'] == 'solved', record['planning_time'], time_limit))
+    return dict(history)
+
+
+def evaluate_time_limit(attempts, time_limit, overhead=0):
+    """ (probability of success, expected cpu seconds per problem) if planning stops at `time_limit`,
+        assuming attempts that ran longer than the limit would have failed at the limit,
+        timeouts are censored: a timeout at a shorter limit than `time_limit` says nothing about whether
+        the attempt would have been solved in time, so it is left out, `overhead` is the time spent per
+        problem outside of planning, e.g. loading the world """
+    import numpy as np
+    attempts = [a for a in attempts if len(a) < 3 or a[2] is None or a[2] >= time_limit]
+    if len(attempts) == 0:
+        return 0., float(time_limit + overhead)
+    solved = np.array([a[0] for a in attempts], dtype=bool)
+    times = np.array([a[1] for a in attempts], dtype=float)
+    success = np.mean(solved & (times <= time_limit))
+    cost = np.mean(np.minimum(times, time_limit)) + overhead
+    return float(success), float(max(cost, 1e-3))
+
+
+def choose_time_limit(attempts, max_time, target_rate=None, overhead=10, min_success_ratio=0.9):
+    """ among the observed solving times, the limit with the highest successes per cpu second,
+        or with `target_rate`, the longest limit that still reaches it, limits that solve less than
+        `min_success_ratio` of what `max_time` solves are not considered """
+    candidates = sorted(set([a[1] for a in attempts if a[0] and a[1] <= max_time] + [max_time]))
+    scored = [(t,) + evaluate_time_limit(attempts, t, overhead) for t in candidates]
+    scored = [x for x in scored if x[1] >= min_success_ratio * scored[-1][1]]
+    if target_rate is not None:
+        reaching = [x for x in scored if x[1] / x[2] >= target_rate]
+        if len(reaching) > 0:
+            return reaching[-1]
+    return max(scored, key=lambda x: x[1] / x[2])
+
+
+class BudgetAllocator(object):
+    """ planning budgets per task from the solved and failed attempts in the results ledger,
+        the time limit is learned, `downward_time`, `evaluation_time` and `max_plans` are the defaults
+        shrunk to fit in it, tasks with fewer than `min_samples` attempts use their family's or the defaults
+
+            allocator = BudgetAllocator(RESULTS_LEDGER, fc='None', mode='diverse')
+            budget = allocator.get_budget('hh_braiser', default_budget)
+    """
+
+    def __init__(self, ledger_file, fc=None, mode=None, min_samples=20, target_rate=None, overhead=10,
+                 min_success_ratio=0.9):
+        self.ledger_file = ledger_file
+        self.history = load_planning_history(ledger_file, fc=fc, mode=mode)
+        self.min_samples = min_samples
+        self.target_rate = target_rate
+        self.overhead = overhead
+        self.min_success_ratio = min_success_ratio
+        self.budgets = {}
+
+    def get_attempts(self, task):
+        attempts = self.history.get(task, [])
+        if len(attempts) < self.min_samples:
+            family = get_task_family(task)
+            attempts = [a for t, a_list in self.history.items() if get_task_family(t) == family for a in a_list]
+        return attempts if len(attempts) >= self.min_samples else None
+
+    def get_budget(self, task, default):
+        """ `default` is dict(downward_time, evaluation_time, max_plans, max_time) """
+        attempts = self.get_attempts(task)
+        budget = dict(default, learned=attempts is not None, num_samples=0 if attempts is None else len(attempts))
+        if attempts is None:
+            budget['expected_success'], budget['expected_cost'] = None, None
+        else:
+            time_limit, success, cost = choose_time_limit(attempts, default['max_time'], self.target_rate,
+                                                          self.overhead, self.min_success_ratio)
+            scale = time_limit / default['max_time']
+            budget.update(max_time=time_limit, expected_success=success, expected_cost=cost,
+                          downward_time=min(default['downward_time'], max(3, time_limit / 4)),
+                          evaluation_time=min(default['evaluation_time'], time_limit),
+                          max_plans=max(10, int(round(default['max_plans'] * min(1, 2 * scale)))))
+        self.budgets[task] = budget
+        return budget
+
+    def plan_campaign(self, pending, total_budget, default):
+        """ `pending` is {task: number of problems}, spends `total_budget` cpu seconds on the tasks
+            with the most expected solutions per second first, returns {task: number of problems} """
+        budgets = {task: self.get_budget(task, default) for task in pending}
+        rate = lambda task: (budgets[task]['expected_success'] or 0) / (budgets[task]['expected_cost'] or 1)
+        allocation = {}
+        remaining = total_budget
+        expected = 0
+        for task in sorted(pending, key=rate, reverse=True):
+            cost = budgets[task]['expected_cost'] or budgets[task]['max_time']
+            n = int(min(pending[task], remaining // cost))
+            allocation[task] = n
+            remaining -= n * cost
+            expected += n * (budgets[task]['expected_success'] or 0)
+        print(f'BudgetAllocator | {sum(allocation.values())} of {sum(pending.values())} problems in '
+              f'{round(total_budget - remaining)} sec | expected {round(expected, 1)} solved, '
+              f'{round(3600 * expected / max(total_budget - remaining, 1), 1)} per cpu hour')
+        return allocation
+
+    def report(self, since, default=None):
+        """ expected against realized solutions per cpu hour of the attempts made after `since`,
+            with `default`, budgets chosen in other processes are computed again from the same history """
+        from dataset_utils import iter_ledger_records
+        recent = {}
+        for record in iter_ledger_records(self.ledger_file):
+            if record['timestamp'] < since or record['planning_time'] is None:
+                continue
+            task = os.path.basename(os.path.dirname(record['run']))
+            solved, spent = recent.get(task, (0, 0))
+            recent[task] = (solved + (record['status'] == 'solved'), spent + record['planning_time'])
+        report = {}
+        for task, (solved, spent) in sorted(recent.items()):
+            if task not in self.budgets and default is not None:
+                self.get_budget(task, default)
+            budget = self.budgets.get(task, {})
+            expected = None
+            if budget.get('expected_success') is not None:
+                expected = round(3600 * budget['expected_success'] / budget['expected_cost'], 1)
+            report[task] = dict(expected_per_hour=expected, realized_per_hour=round(3600 * solved / max(spent, 1), 1),
+                                solved=solved, cpu_time=round(spent, 1), max_time=budget.get('max_time'))
+            print(f"BudgetAllocator | {task} | expected {expected} vs realized "
+                  f"{report[task]['realized_per_hour']} solved per cpu hour | {solved} solved in {round(spent)} sec")
+        return report
+
+
+##################################################################################
+
+
+## attributes of poses, confs and grasps that determine what a stream computes from them
+CANONICAL_ATTRIBUTES = ['body', 'joint', 'joints', 'value', 'values', 'grasp_type', 'support']
+
+
+def canonicalize_stream_input(value, digits=4):
+    """ hashable key of a stream input that is the same for equal poses, confs and grasps,
+        objects without known attributes, like the robot, are keyed by identity, so whoever keeps
+        the key has to keep the object alive for its id not to be reused """
+    import numpy as np
+    if value is None or isinstance(value, (bool, str)):
+        return value
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        return round(float(value), digits)
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return tuple(canonicalize_stream_input(v, digits) for v in value)
+    attributes = [a for a in CANONICAL_ATTRIBUTES if hasattr(value, a)]
+    if len(attributes) == 0 or attributes == ['body']:
+        return type(value).__name__, id(value)
+    return (type(value).__name__,) + tuple(canonicalize_stream_input(getattr(value, a), digits) for a in attributes)
+
+
+class _SharedGenerator(object):
+    """ one underlying generator whose first `max_outputs` outputs are kept for later callers """
+
+    def __init__(self, generator, max_outputs):
+        self.generator = generator
+        self.outputs = []
+        self.max_outputs = max_outputs
+        self.done = False
+
+    def pull(self):
+        if self.done:
+            raise StopIteration
+        try:
+            outputs = next(self.generator)
+        except StopIteration:
+            self.done = True
+            raise
+        if len(self.outputs) < self.max_outputs:
+            self.outputs.append(outputs)
+        return outputs
+
+
+class StreamMemoizer(object):
+    """ wraps the stream map from `pddlstream_from_dir` so that calls with equal inputs, e.g. from
+        different skeletons, share their samples, a repeated generator first replays the outputs
+        drawn so far and then continues drawing new ones, least recently used entries are dropped
+        beyond `max_entries`, each entry keeps the inputs it was called with alive, fluents included,
+        pddlstream's `BoundedGenerator` results are returned as new ones around the replay, so
+        `enumerated` and `max_calls` still tell the planner when the stream is exhausted
+
+            stream_map = StreamMemoizer().wrap_stream_map(stream_map)
+    """
+
+    def __init__(self, max_entries=10000, max_outputs=100, exclude=(), digits=4):
+        from collections import OrderedDict
+        self.cache = OrderedDict()
+        self.max_entries = max_entries
+        self.max_outputs = max_outputs
+        self.exclude = set(exclude)
+        self.digits = digits
+        self.stats = {}
+        self.evictions = 0
+
+    def _get_stats(self, name):
+        if name not in self.stats:
+            self.stats[name] = dict(calls=0, hits=0, replayed=0, uncached=0)
+        return self.stats[name]
+
+    def _lookup(self, key):
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        return None
+
+    def _store(self, key, entry):
+        self.cache[key] = entry
+        while len(self.cache) > self.max_entries:
+            self.cache.popitem(last=False)
+            self.evictions += 1
+
+    def _replay(self, name, shared):
+        stats = self._get_stats(name)
+        i = 0
+        while True:
+            if i < len(shared.outputs):
+                outputs = shared.outputs[i]
+                stats['replayed'] += 1
+            else:
+                try:
+                    outputs = shared.pull()
+                except StopIteration:
+                    return
+            i += 1
+            yield outputs
+
+    def wrap(self, name, gen_fn):
+        def memoized_fn(*args, **kwargs):
+            stats = self._get_stats(name)
+            stats['calls'] += 1
+            try:
+                ## fluents, e.g. the poses of obstacles given to inverse kinematics or motion planning, are part
+                ## of the key since the samples depend on them
+                key = (name, canonicalize_stream_input(args, self.digits),
+                       tuple((k, canonicalize_stream_input(v, self.digits)) for k, v in sorted(kwargs.items())))
+                hash(key)
+            except TypeError:
+                stats['uncached'] += 1
+                return gen_fn(*args, **kwargs)
+            entry = self._lookup(key)
+            if entry is not None:
+                stats['hits'] += 1
+                kind, result = entry['kind'], entry['result']
+                if kind == 'bounded':
+                    bounded_type, max_calls = entry['bounded']
+                    return bounded_type(self._replay(name, result), max_calls)
+                return self._replay(name, result) if kind == 'generator' else result
+            result = gen_fn(*args, **kwargs)
+            ## the inputs are kept in the entry, so the ids in its key are not reused while the entry exists
+            inputs = (args, kwargs)
+            if _is_bounded_generator(result):
+                shared = _SharedGenerator(iter(result.generator), self.max_outputs)
+                self._store(key, dict(kind='bounded', result=shared, bounded=(type(result), result.max_calls),
+                                      inputs=inputs))
+                result.generator = self._replay(name, shared)
+                return result
+            if hasattr(result, '__next__'):
+                shared = _SharedGenerator(iter(result), self.max_outputs)
+                self._store(key, dict(kind='generator', result=shared, inputs=inputs))
+                return self._replay(name, shared)
+            self._store(key, dict(kind='function', result=result, inputs=inputs))
+            return result
+        return memoized_fn
+
+    def wrap_stream_map(self, stream_map):
+        return {name: self.wrap(name, fn) if callable(fn) and name not in self.exclude else fn
+                for name, fn in stream_map.items()}
+
+    def get_summary(self):
+        summary = {name: dict(s, hit_rate=round(s['hits'] / max(s['calls'], 1), 3))
+                   for name, s in sorted(self.stats.items(), key=lambda kv: -kv[1]['hits'])}
+        calls = sum(s['calls'] for s in self.stats.values())
+        hits = sum(s['hits'] for s in self.stats.values())
+        return dict(calls=calls, hits=hits, hit_rate=round(hits / max(calls, 1), 3), entries=len(self.cache),
+                    evictions=self.evictions, streams=summary)
+
+    def dump(self, file_path):
+        summary = self.get_summary()
+        with open(file_path, 'w') as f:
+            json.dump(summary, f, indent=3)
+        print(f"StreamMemoizer | {summary['hits']} of {summary['calls']} stream calls reused "
+              f"| {summary['entries']} entries, {summary['evictions']} evictions")
+        return summary
@@ -1,17 +1,30 @@
-from config import OUTPUT_PATH
+from config import OUTPUT_PATH, ASSET_PATH
 
 from pigi_tools.data_utils import  get_worlds_aabb
 
 from data_generator.run_utils import parse_image_rendering_args, process_all_tasks
 from data_generator.image_generation import generate_segmented_images
 
+from image_utils import pack_run_seg_images, render_run_dir, background_image_saving
+from dataset_utils import get_worlds_aabb_streaming, merge_aabbs
+
 
 task_name = 'test_feg_kitchen_full'
 given_path = None
 parallel = False
 use_viewer = True
 generate_seg = False  ## generate RGB only
-redo = True
+redo = True  ## with batch_render, False only renders cameras whose scene, spec or settings changed
+pack_seg = False  ## one label file per camera instead of one png per object per camera
+batch_render = False  ## load each world once and render all cameras below plus the zoom-ins in planning_config
+async_writes = True  ## encode and write the images in background threads while the next camera renders
+
+load_worlds_for_aabb = False  ## compute the dataset bounds from scene.lisdf without pybullet
+
+## None renders the `camera_kwargs` saved in each run's planning_config.json, or give the cameras, e.g.
+## [dict(label='front', camera_point=[4.5, 2.5, 3], target_point=[0, 2.5, 0]),
+##  dict(label='top', camera_point=[1.5, 2.5, 8], target_point=[1.5, 2.5, 0])]
+camera_specs = None
 
 
 args = parse_image_rendering_args(
@@ -20,15 +33,43 @@ args = parse_image_rendering_args(
 )
 
 
+def generate_images(run_dir, *args, **kwargs):
+    if not async_writes:
+        return generate_segmented_images(run_dir, *args, **kwargs)
+    with background_image_saving():
+        return generate_segmented_images(run_dir, *args, **kwargs)
+
+
+def generate_packed_segmented_images(run_dir, *args, **kwargs):
+    """ writes seg_images_{i}.npz per camera, read them with `image_utils.PackedSegImages` """
+    result = generate_images(run_dir, *args, **kwargs)
+    pack_run_seg_images(run_dir, remove=True)
+    return result
+
+
+def render_all_cameras(run_dir, *_args, **kwargs):
+    return render_run_dir(run_dir, camera_specs, use_gui=args.viewer, redo=redo)
+
+
 def process_worlds_aabb():
     """ bounds ((-0.879, -2.56, -0.002), (1.15, 9.477, 2.841)) """
     run_dirs = process_all_tasks(None, args.task, OUTPUT_PATH, parallel=False, return_dirs=True, input_args=args)
-    aabb = get_worlds_aabb(run_dirs)
+    if load_worlds_for_aabb:
+        aabb = get_worlds_aabb(run_dirs)
+    else:
+        aabb, run_aabbs, incomplete = get_worlds_aabb_streaming(run_dirs, OUTPUT_PATH, parallel=args.parallel,
+                                                                asset_path=ASSET_PATH)
+        if len(incomplete) > 0:
+            ## runs with meshes that can't be read without pybullet, e.g. dae
+            aabb = merge_aabbs([aabb, get_worlds_aabb(sorted(incomplete))])
 
 
 if __name__ == "__main__":
     print('\n\n', args)
     kwargs = dict(task_name=args.task, dataset_root=OUTPUT_PATH, parallel=args.parallel, path=args.path, input_args=args)
-    process_all_tasks(generate_segmented_images, **kwargs)
+    if batch_render:
+        process_all_tasks(render_all_cameras, **kwargs)
+    else:
+        process_all_tasks(generate_packed_segmented_images if pack_seg else generate_images, **kwargs)
 
     # process_worlds_aabb()
@@ -1,14 +1,45 @@
-from config import ASSET_PATH
+import argparse
+from glob import glob
+from config import ASSET_PATH, EXP_PATH
 from os.path import join, dirname
-from lisdf.parsing.sdf_j import load_sdf
+from loading_utils import load_sdf_cached, benchmark_lisdf_cache, load_scene_assets_pybullet, remove_asset_body, \
+    ASSET_REGISTRY
 
-test_cases = ['kitchen_counter', 'm0m_0_test', 'm0m_joint_test'] 
+test_cases = ['kitchen_counter', 'm0m_0_test', 'm0m_joint_test']
 scene_paths = [join(ASSET_PATH, 'scenes', f'{l}.lisdf') for l in test_cases]
 # scene_paths = ['/home/yang/Documents/kitchen-worlds/outputs/test_full_kitchen/1230-140406_original_3/scene.lisdf']
 
+parser = argparse.ArgumentParser()
+parser.add_argument('--benchmark', action='store_true',
+                    help='Compare cold and warm parse times of all scenes and test cases.')
+parser.add_argument('--load_assets', action='store_true',
+                    help='Load the assets of the scenes one after the other in pybullet, sharing their shapes.')
+args = parser.parse_args()
+
+
+def load_scene_assets(lisdf_paths):
+    """ bodies of one scene are removed before the next is loaded, shapes stay in the registry """
+    import pybullet as p
+    p.connect(p.DIRECT)
+    for lisdf_path in lisdf_paths:
+        bodies = load_scene_assets_pybullet(lisdf_path, asset_path=ASSET_PATH)
+        print(f'{lisdf_path} loaded {len(bodies)} assets')
+        for body in bodies.values():
+            remove_asset_body(body)
+    ASSET_REGISTRY.summarize()
+    p.disconnect()
+
+
 if __name__ == "__main__":
-    for lisdf_path in scene_paths:
-        lissdf_results = load_sdf(lisdf_path)
-        models = lissdf_results.worlds[0].models
-        print(f"{lisdf_path} has {len(models)} models\n", end='\r')
-    print(f'finished parsing {len(test_cases)} scene files')
+    if args.benchmark:
+        benchmark_paths = sorted(glob(join(ASSET_PATH, 'scenes', '*.lisdf')) +
+                                 glob(join(EXP_PATH, '*', 'scene.lisdf')))
+        benchmark_lisdf_cache(benchmark_paths)
+    elif args.load_assets:
+        load_scene_assets(scene_paths)
+    else:
+        for lisdf_path in scene_paths:
+            lissdf_results = load_sdf_cached(lisdf_path)
+            models = lissdf_results.worlds[0].models
+            print(f"{lisdf_path} has {len(models)} models\n", end='\r')
+        print(f'finished parsing {len(test_cases)} scene files')
@@ -7,6 +7,8 @@ from config import PBP_PATH
 from data_generator.run_utils import get_config_file_from_argparse, process_all_tasks
 from pigi_tools.replay_utils import load_replay_conf, run_one, case_filter
 from world_builder.paths import OUTPUT_PATH
+from trajectory_utils import audit_run_dir, record_run_dir
+from image_utils import background_image_saving
 
 REPLAY_CONFIG_PATH = join(PBP_PATH, 'pigi_tools', 'configs')
 DEFAULT_CONFIG_NAME = 'replay_rss.yaml'
@@ -16,6 +18,14 @@ DEFAULT_CONFIG_PATH = None
 DEFAULT_CONFIG_PATH = None
 DEFAULT_CONFIG_PATH = join(REPLAY_CONFIG_PATH, DEFAULT_CONFIG_NAME)
 
+## with `check_collisions`, write collision_report.json from a kinematic replay of the trajectory
+fast_collision_audit = False
+## with `save_mp4`, pipe the frames of a kinematic replay of the trajectory into replay.mp4 instead of saving images
+stream_mp4 = False
+## with `save_jpg` or `save_gif`, encode and write the frames in background threads, not with `save_mp4`
+## since the video may be assembled from the files by another process
+async_writes = True
+
 config_file, args = get_config_file_from_argparse(default_config_name=DEFAULT_CONFIG_NAME,
                                                   default_config_path=DEFAULT_CONFIG_PATH,
                                                   default_config_dir=REPLAY_CONFIG_PATH)
@@ -32,6 +42,17 @@ def run_replay(config_yaml_file, load_data_fn):
     print(f'given_path =', c['given_path'], '\n\n')
 
     def process(run_dir_ori):
+        if fast_collision_audit and c['check_collisions']:
+            return audit_run_dir(run_dir_ori, cfree_range=c['cfree_range'])
+        if stream_mp4 and c.get('save_mp4', False):
+            camera_spec = None  ## the run's own cameras
+            if c.get('camera_point', None) is not None:
+                camera_spec = dict(camera_point=c['camera_point'], target_point=c['target_point'])
+            return record_run_dir(run_dir_ori, camera_spec=camera_spec, width=c.get('width', 1440),
+                                  height=c.get('height', 1120), fps=round(1 / c.get('time_step', 0.05)))
+        if async_writes and (c['save_jpg'] or c['save_gif']) and not c.get('save_mp4', False):
+            with background_image_saving():
+                return run_one(run_dir_ori, load_data_fn=load_data_fn, **c)
         return run_one(run_dir_ori, load_data_fn=load_data_fn, **c)
 
     def _case_filter(run_dir_ori):
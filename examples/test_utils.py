@@ -4,6 +4,7 @@ import os
 import math
 import json
 from config import EXP_PATH, MAMAO_DATA_PATH, DATA_CONFIG_PATH, PBP_PATH
+from video_utils import mp4_to_gif
 import numpy as np
 import random
 
@@ -41,87 +42,41 @@ def get_task_names(task_name):
 
 
 def find_duplicate_worlds(d1, d2):
+    """ compare the contents of scene.lisdf and problem.pddl (not world names) of all runs,
+        using the incrementally updated fingerprint index in MAMAO_DATA_PATH """
     from config import MAMAO_DATA_PATH
-
-    def find_duplicate(found):
-        dup1 = len(set(found)) != len(found)
-        if dup1:
-            seen = []
-            dup = []
-            for f in found:
-                if f not in seen:
-                    seen.append(f)
-                else:
-                    dup.append(f)
-            print(f'{t} has duplicate {(len(dup))}, {dup}')
+    from dataset_utils import update_fingerprint_index, find_duplicates, group_by_hash
 
     t1 = get_task_names(d1)
     t2 = get_task_names(d2)
-    n1 = []
-    for t in t1:
-        found = open(join(MAMAO_DATA_PATH, f'{t}.txt')).read().splitlines()
-        find_duplicate(found)
-        n1.extend(found)
-    n2 = []
-    for t in t2:
-        found = open(join(MAMAO_DATA_PATH, f'{t}.txt')).read().splitlines()
-        find_duplicate(found)
-        n2.extend(found)
-    dup1 = len(set(n1)) != len(n1)
-    dup2 = len(set(n2)) != len(n2)
-    inter = len(list(set(n1) & set(n2))) > 0
+    hashes = update_fingerprint_index(MAMAO_DATA_PATH, t1 + t2)
+    for t in t1 + t2:
+        dup = find_duplicates(hashes, [t])
+        if len(dup) > 0:
+            print(f'{t} has duplicate {(len(dup))}, {dup}')
+    dup1 = len(find_duplicates(hashes, t1)) > 0
+    dup2 = len(find_duplicates(hashes, t2)) > 0
+    inter = len(set(group_by_hash(hashes, t1)) & set(group_by_hash(hashes, t2))) > 0
     print(f'\nt1: {d1}, t2: {d2}, dup1: {dup1}, dup2: {dup2}, inter: {inter}'
           f'\n----------------------------------------------------------\n')
 
 
-def mp4_to_gif(mp4_file, frame_folder='output'):
-    import cv2
-    def convert_mp4_to_jpgs(path):
-        video_capture = cv2.VideoCapture(path)
-        still_reading, image = video_capture.read()
-        frame_count = 0
-        while still_reading:
-            cv2.imwrite(f"{frame_folder}/frame_{frame_count:03d}.jpg", image)
-
-            # read next image
-            still_reading, image = video_capture.read()
-            frame_count += 1
-
-    import glob
-    from PIL import Image
-
-    def make_gif():
-        images = glob.glob(f"{frame_folder}/*.jpg")
-        images.sort()
-        frames = [Image.open(image) for image in images]
-        frame_one = frames[0]
-        output_file = mp4_file.replace('.mp4', '.gif')
-        frame_one.save(output_file, format="GIF", append_images=frames,
-                       save_all=True, duration=50, loop=0)
-        return output_file
-
-    convert_mp4_to_jpgs(mp4_file)
-    output_file = make_gif()
-    print('converted mp4 to', output_file)
-
-
 ##################################################################################
 
 
 def get_envs_from_task(task_dir = join(MAMAO_DATA_PATH, 'tt_two_fridge_pick')):
-    ori_dirs = [join(task_dir, f) for f in listdir(task_dir) if isdir(join(task_dir, f))]
-    ori_dirs.sort()
-    return ori_dirs
+    from dataset_utils import query_catalog
+    return query_catalog(dirname(task_dir), [basename(task_dir)])
 
 
 def get_sample_envs_200():
+    from dataset_utils import query_catalog
     dirs = get_sample_envs_for_corl()
     new_dirs = []
     for subdir in get_task_names('mm'):
         if subdir == 'mm_one_fridge_pick':
             continue
-        path = join(MAMAO_DATA_PATH, subdir)
-        names = [join(path, f) for f in listdir(path) if isdir(join(path, f))]
+        names = query_catalog(MAMAO_DATA_PATH, [subdir])
         new_dirs.extend(random.choices(names, k=40))
     new_dirs = [n for n in new_dirs if n not in dirs]
     random.shuffle(new_dirs)
@@ -162,23 +117,11 @@ def get_sample_envs_for_rss(task_name=None, count=None):
 
 
 def get_sample_envs_full_kitchen(count=4, data_dir='test_full_kitchen_100'):
-    from pigi_tools.data_utils import load_planning_config
-    # data_dir = join('/home/yang/Documents/kitchen-worlds/outputs', data_dir)
-    # dirs = [join(data_dir, f) for f in listdir(data_dir) if isdir(join(data_dir, f))]
+    """ runs with a float `cfree` in planning_config.json, looked up in the catalog of MAMAO_DATA_PATH """
+    from dataset_utils import query_catalog
     task_names = ['mm_storage', 'mm_sink', 'mm_braiser',
                   'mm_sink_to_storage', 'mm_braiser_to_storage']
-    num_per_problem = math.ceil(count / len(task_names))
-    dirs = []
-    for t in task_names:
-        task_dir = join(MAMAO_DATA_PATH, t)
-        run_dirs = [join(task_dir, f) for f in listdir(task_dir) if isdir(join(task_dir, f))]
-        cleaned_dirs = []
-        for rr in run_dirs:
-            conf = load_planning_config(rr)
-            if 'cfree' in conf and isinstance(conf['cfree'], float):
-                cleaned_dirs.append(rr)
-        dirs.extend(cleaned_dirs)
-        # dirs.extend(random.sample(run_dirs, num_per_problem))
+    dirs = query_catalog(MAMAO_DATA_PATH, task_names, where='cfree IS NOT NULL')
     random.shuffle(dirs)
     return make_count(dirs, count)
 
@@ -0,0 +1,568 @@
+import os
+import json
+import shutil
+import pickle
+import numpy as np
+from os.path import join, isdir, isfile, dirname, basename
+
+
+## version 1: steps table, one positions array per joint group, gripper and attachment arrays
+TRAJECTORY_VERSION = 1
+TRAJECTORY_DIR = 'trajectory'
+
+STEP_KINDS = ['base', 'arm', 'gripper', 'attach', 'detach', 'other']
+ACTION_KINDS = {'MoveBaseAction': 'base', 'MoveArmAction': 'arm', 'GripperAction': 'gripper',
+                'AttachObjectAction': 'attach', 'DetachObjectAction': 'detach'}
+ARMS = ['left', 'right']
+
+## kind, joint group or -1, row in the positions / gripper / attachments array, arm or -1, body or -1
+STEP_DTYPE = np.dtype([('kind', np.int8), ('group', np.int16), ('row', np.int32),
+                       ('arm', np.int8), ('body', np.int32)])
+
+
+class _Record(object):
+    """ stands in for the action and conf classes when reading a pickle, attributes only """
+
+    def __init__(self, *args, **kwargs):
+        self._args = args
+
+
+class _CommandsUnpickler(pickle.Unpickler):
+    """ reads commands.pkl without importing world_builder or pybullet_tools, and without calling
+        anything other than the numpy reconstructors, so pickles of unknown origin can be converted """
+
+    NUMPY_GLOBALS = {'scalar', 'dtype', '_reconstruct', 'ndarray'}
+
+    def find_class(self, module, name):
+        if module.split('.')[0] == 'numpy' and name in self.NUMPY_GLOBALS:
+            return super().find_class(module, name)
+        return type(name, (_Record,), {'_module': module})
+
+
+def load_commands_pickle(pkl_file):
+    with open(pkl_file, 'rb') as f:
+        return _CommandsUnpickler(f).load()
+
+
+def _to_pose(pose):
+    point, quat = pose
+    return [float(v) for v in tuple(point) + tuple(quat)]
+
+
+def _get_body_id(body):
+    """ bodies are ints, or robot objects when the pickle has been read without their classes """
+    if isinstance(body, (int, np.integer)):
+        return int(body)
+    return int(getattr(body, 'body', -1))
+
+
+def commands_to_arrays(commands):
+    """ flatten the commands from `post_process` into the arrays stored by `save_trajectory` """
+    groups = []
+    positions = []
+    steps = []
+    gripper = []
+    attachments = []
+    grasp_types = []
+    robot = None
+    for command in commands:
+        kind = ACTION_KINDS.get(type(command).__name__, 'other')
+        arm = ARMS.index(command.arm) if getattr(command, 'arm', None) in ARMS else -1
+        group = row = body = -1
+        if kind in ['base', 'arm']:
+            conf = command.conf
+            robot = conf.body if robot is None else robot
+            joints = tuple(int(j) for j in conf.joints)
+            if joints not in groups:
+                groups.append(joints)
+                positions.append([])
+            group = groups.index(joints)
+            row = len(positions[group])
+            positions[group].append([float(v) for v in conf.values])
+        elif kind == 'gripper':
+            row = len(gripper)
+            ## commands given only as an extent have no joint position, replays keep the previous one
+            position, extent = getattr(command, 'position', None), getattr(command, 'extent', None)
+            gripper.append([np.nan if position is None else float(position),
+                            np.nan if extent is None else float(extent)])
+        elif kind == 'attach':
+            grasp = command.grasp
+            row = len(attachments)
+            body = _get_body_id(command.object)
+            approach = getattr(grasp, 'approach', None)
+            attachments.append(_to_pose(grasp.value) + (_to_pose(approach) if approach is not None else [np.nan] * 7))
+            grasp_types.append(getattr(grasp, 'grasp_type', None))
+        elif kind == 'detach':
+            body = _get_body_id(command.object)
+        steps.append((STEP_KINDS.index(kind), group, row, arm, body))
+    arrays = {'steps': np.array(steps, dtype=STEP_DTYPE),
+              'gripper': np.array(gripper, dtype=np.float64).reshape(-1, 2),
+              'attachments': np.array(attachments, dtype=np.float64).reshape(-1, 14)}
+    for i, rows in enumerate(positions):
+        arrays[f'positions_{i}'] = np.array(rows, dtype=np.float64).reshape(-1, len(groups[i]))
+    meta = dict(groups=[list(g) for g in groups], grasp_types=grasp_types,
+                robot=None if robot is None else _get_body_id(robot),
+                robot_name=getattr(robot, 'name', None))
+    return arrays, meta
+
+
+def save_trajectory(commands, out_dir, body_map=None, joint_names=None, source=None):
+    """ write the commands into a directory of .npy arrays and a meta.json,
+        `body_map` is {body: name} and `joint_names` is {joint: name}, both optional """
+    arrays, meta = commands_to_arrays(commands)
+    meta.update(version=TRAJECTORY_VERSION, num_steps=len(arrays['steps']), source=source,
+                body_map={str(k): v for k, v in (body_map or {}).items()},
+                joint_names=[[(joint_names or {}).get(j) for j in group] for group in meta['groups']])
+    tmp_dir = f'{out_dir}.{os.getpid()}.tmp'
+    if isdir(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    for name, array in arrays.items():
+        np.save(join(tmp_dir, f'{name}.npy'), array)
+    with open(join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=3)
+    if isdir(out_dir):
+        shutil.rmtree(out_dir)
+    os.replace(tmp_dir, out_dir)
+    return out_dir
+
+
+def convert_commands_pickle(pkl_file, out_dir=None, redo=False):
+    """ e.g. run_dir/commands.pkl -> run_dir/trajectory, the body map is read from the
+        planning_config.json next to the pickle if there is one """
+    run_dir = dirname(pkl_file)
+    if out_dir is None:
+        name = basename(pkl_file).replace('.pkl', '')
+        out_dir = join(run_dir, TRAJECTORY_DIR if name == 'commands' else name.replace('commands', 'trajectory'))
+    if isfile(join(out_dir, 'meta.json')) and not redo:
+        return out_dir
+    body_map = None
+    config_file = join(run_dir, 'planning_config.json')
+    if isfile(config_file):
+        body_map = json.load(open(config_file, 'r')).get('body_to_name', None)
+    return save_trajectory(load_commands_pickle(pkl_file), out_dir, body_map=body_map, source=basename(pkl_file))
+
+
+class Trajectory(object):
+    """ reads a saved trajectory, arrays are memory-mapped and only loaded when first used
+
+            traj = Trajectory(join(run_dir, 'trajectory'))
+            base = traj.get_positions(0)[10:20]
+    """
+
+    def __init__(self, path, mmap=True):
+        self.path = path
+        self.meta = json.load(open(join(path, 'meta.json'), 'r'))
+        if self.meta['version'] > TRAJECTORY_VERSION:
+            raise ValueError(f"Trajectory | {path} has version {self.meta['version']}, "
+                             f"newer than {TRAJECTORY_VERSION}")
+        self.mmap_mode = 'r' if mmap else None
+        self._arrays = {}
+
+    def _get(self, name):
+        if name not in self._arrays:
+            self._arrays[name] = np.load(join(self.path, f'{name}.npy'), mmap_mode=self.mmap_mode)
+        return self._arrays[name]
+
+    def __len__(self):
+        return self.meta['num_steps']
+
+    @property
+    def steps(self):
+        return self._get('steps')
+
+    @property
+    def groups(self):
+        return [tuple(g) for g in self.meta['groups']]
+
+    @property
+    def body_map(self):
+        """ keys are strings, like in planning_config.json, e.g. '2' for a body or '(28, None, 1)' for a link """
+        return self.meta['body_map']
+
+    def get_positions(self, group):
+        """ (num confs of the group, num joints of the group) """
+        return self._get(f'positions_{group}')
+
+    def get_gripper(self):
+        """ (num gripper commands, 2) position and extent, nan if not given """
+        return self._get('gripper')
+
+    def get_attachments(self):
+        """ (num attachments, 14) grasp pose and approach pose as x y z qx qy qz qw """
+        return self._get('attachments')
+
+    def get_kinds(self):
+        return [STEP_KINDS[k] for k in self.steps['kind']]
+
+    def get_step(self, i):
+        step = self.steps[i]
+        kind = STEP_KINDS[step['kind']]
+        result = dict(kind=kind, arm=ARMS[step['arm']] if step['arm'] >= 0 else None)
+        if kind in ['base', 'arm']:
+            result.update(joints=self.groups[step['group']], values=self.get_positions(step['group'])[step['row']])
+        elif kind == 'gripper':
+            result.update(position=self.get_gripper()[step['row']])
+        elif kind in ['attach', 'detach']:
+            result.update(body=int(step['body']))
+            if kind == 'attach':
+                grasp = self.get_attachments()[step['row']]
+                result.update(grasp=(tuple(grasp[:3]), tuple(grasp[3:7])),
+                              grasp_type=self.meta['grasp_types'][step['row']])
+        return result
+
+    def iter_steps(self, start=0, stop=None):
+        for i in range(start, len(self) if stop is None else min(stop, len(self))):
+            yield self.get_step(i)
+
+
+def load_trajectory(run_dir, name=TRAJECTORY_DIR, convert=True):
+    """ the trajectory of a run, converted from its commands.pkl the first time if needed """
+    path = join(run_dir, name)
+    if not isfile(join(path, 'meta.json')):
+        pkl_file = join(run_dir, 'commands.pkl')
+        if not convert or not isfile(pkl_file):
+            return None
+        convert_commands_pickle(pkl_file, path)
+    return Trajectory(path)
+
+
+def convert_dataset_commands(run_dirs, redo=False, remove_pickles=False):
+    """ convert all commands*.pkl of the given runs """
+    converted = []
+    for run_dir in run_dirs:
+        for f in sorted(os.listdir(run_dir)):
+            if f.startswith('commands') and f.endswith('.pkl'):
+                converted.append(convert_commands_pickle(join(run_dir, f), redo=redo))
+                if remove_pickles:
+                    os.remove(join(run_dir, f))
+    print(f'convert_dataset_commands | {len(converted)} trajectories from {len(run_dirs)} runs')
+    return converted
+
+
+##################################################################################
+
+
+PR2_TOOL_LINKS = {'left': 'l_gripper_tool_frame', 'right': 'r_gripper_tool_frame'}
+PR2_GRIPPER_JOINTS = {arm: [f'{arm[0]}_gripper_{finger}_joint' for finger in
+                            ['l_finger', 'r_finger', 'l_finger_tip', 'r_finger_tip']] for arm in ARMS}
+
+
+def get_joint_trajectory(traj, gripper_joints=None):
+    """ one row per step with the values of all joints moved in the trajectory, values are carried
+        forward from the previous step and are nan before a joint is first set,
+        `gripper_joints` is {arm: [joint]} to also replay gripper commands, those without a position
+        keep the previous one """
+    steps = traj.steps
+    joints = [j for group in traj.groups for j in group]
+    gripper_joints = {} if gripper_joints is None else gripper_joints
+    for arm in ARMS:
+        joints += [j for j in gripper_joints.get(arm, []) if j not in joints]
+    joints = list(dict.fromkeys(joints))
+    column = {j: i for i, j in enumerate(joints)}
+    conf = np.full((len(steps), len(joints)), np.nan)
+
+    for g, group in enumerate(traj.groups):
+        indices = np.nonzero(steps['group'] == g)[0]
+        conf[np.ix_(indices, [column[j] for j in group])] = traj.get_positions(g)[steps['row'][indices]]
+    is_gripper = steps['kind'] == STEP_KINDS.index('gripper')
+    for a, arm in enumerate(ARMS):
+        indices = np.nonzero(is_gripper & (steps['arm'] == a))[0]
+        if len(indices) > 0 and arm in gripper_joints:
+            positions = traj.get_gripper()[steps['row'][indices], 0]
+            conf[np.ix_(indices, [column[j] for j in gripper_joints[arm]])] = positions[:, None]
+
+    ## forward fill each column with the last value that was set
+    last = np.where(np.isnan(conf), 0, np.arange(len(conf))[:, None])
+    last = np.maximum.accumulate(last, axis=0)
+    filled = conf[last, np.arange(conf.shape[1])]
+    filled[np.isnan(conf).cumprod(axis=0).astype(bool)] = np.nan
+    return joints, filled
+
+
+def get_attachment_trajectory(traj):
+    """ (num steps, num arms) body held by each arm after each step, -1 if none """
+    steps = traj.steps
+    attached = np.full((len(steps), len(ARMS)), -1, dtype=np.int32)
+    holding = [-1] * len(ARMS)
+    events = np.nonzero(np.isin(steps['kind'], [STEP_KINDS.index('attach'), STEP_KINDS.index('detach')]))[0]
+    previous = 0
+    for i in events:
+        attached[previous:i] = holding
+        arm = steps['arm'][i]
+        holding[arm] = steps['body'][i] if STEP_KINDS[steps['kind'][i]] == 'attach' else -1
+        previous = i
+    attached[previous:] = holding
+    return attached
+
+
+def _get_index_from_name(body, names, link=False):
+    import pybullet as p
+    indices = {}
+    for i in range(p.getNumJoints(body)):
+        info = p.getJointInfo(body, i)
+        name = (info[12] if link else info[1]).decode('utf-8')
+        if name in names:
+            indices[name] = i
+    return [indices[n] for n in names if n in indices]
+
+
+def replay_trajectory(traj, robot=None, frame_fn=None, frame_every=1, start=0, stop=None,
+                      tool_links=PR2_TOOL_LINKS, gripper_joint_names=PR2_GRIPPER_JOINTS):
+    """ kinematic playback without physics or sleeps, only the joints that change are reset at each step,
+        held objects follow the tool link by the transform measured at the attach step,
+        `frame_fn(t)` is called every `frame_every` steps, e.g. to capture images or check collisions """
+    import time
+    import pybullet as p
+    start_time = time.time()
+    robot = traj.meta['robot'] if robot is None else robot
+    gripper_joints = {arm: _get_index_from_name(robot, names) for arm, names in gripper_joint_names.items()}
+    joints, conf = get_joint_trajectory(traj, gripper_joints)
+    attached = get_attachment_trajectory(traj)
+    tool_links = {ARMS.index(arm): _get_index_from_name(robot, [name], link=True)
+                  for arm, name in tool_links.items() if arm in ARMS}
+    current = np.array([p.getJointState(robot, j)[0] for j in joints])
+    conf = np.where(np.isnan(conf), current, conf)
+
+    def get_tool_pose(a):
+        state = p.getLinkState(robot, tool_links[a][0], computeForwardKinematics=True)
+        return state[4], state[5]
+
+    grasps = {}
+    stop = len(conf) if stop is None else min(stop, len(conf))
+    previous = current
+    for t in range(start, stop):
+        changed = np.nonzero(conf[t] != previous)[0]
+        if len(changed) > 0:
+            _reset_joints(robot, [joints[i] for i in changed], conf[t][changed])
+        previous = conf[t]
+        for a, body in enumerate(attached[t]):
+            if body < 0 or not tool_links.get(a):
+                grasps.pop(a, None)
+                continue
+            tool_pose = get_tool_pose(a)
+            if grasps.get(a, (None,))[0] != body:
+                inverse = p.invertTransform(*tool_pose)
+                grasps[a] = (body, p.multiplyTransforms(*inverse, *p.getBasePositionAndOrientation(int(body))))
+            point, quat = p.multiplyTransforms(*tool_pose, *grasps[a][1])
+            p.resetBasePositionAndOrientation(int(body), point, quat)
+        if frame_fn is not None and (t - start) % frame_every == 0:
+            frame_fn(t)
+    duration = time.time() - start_time
+    print(f'replay_trajectory | {stop - start} steps of {len(joints)} joints in {round(duration, 3)} sec')
+    return duration
+
+
+def _reset_joints(body, joints, values):
+    import pybullet as p
+    if hasattr(p, 'resetJointStatesMulti'):
+        p.resetJointStatesMulti(body, joints, [[v] for v in values])
+    else:
+        for joint, value in zip(joints, values):
+            p.resetJointState(body, joint, value)
+
+
+##################################################################################
+
+
+def _get_links(body):
+    import pybullet as p
+    return list(range(-1, p.getNumJoints(body)))
+
+
+def _get_ranges(steps):
+    """ [3, 4, 5, 9] -> [[3, 5], [9, 9]] """
+    ranges = []
+    for t in steps:
+        if len(ranges) > 0 and ranges[-1][1] == t - 1:
+            ranges[-1][1] = t
+        else:
+            ranges.append([t, t])
+    return ranges
+
+
+class CollisionAuditor(object):
+    """ clearances between the robot (and what it holds) and everything else along a replay,
+        the aabbs of the static links are computed once and each step only checks the moving links
+        against those whose aabbs are within `cfree_range`, instead of all pairs """
+
+    def __init__(self, robot, cfree_range=0.1, body_map=None, ignored_names=('floor',)):
+        import pybullet as p
+        self.robot = robot
+        self.cfree_range = cfree_range
+        self.body_map = {} if body_map is None else body_map
+        self.robot_links = _get_links(robot)
+        bodies = [p.getBodyUniqueId(i) for i in range(p.getNumBodies())]
+        bodies = [b for b in bodies if b != robot and not any(
+            n in self.get_name(b) for n in ignored_names)]
+        self.static = [(b, l) for b in bodies for l in _get_links(b)]
+        self.static_bodies = np.array([b for b, _ in self.static])
+        self.lower, self.upper = _get_link_aabbs_list(self.static)
+        self.attached = set()
+        self.clearances = []
+        self.min_clearances = {}
+        self.collision_steps = []
+        self.num_checked = 0
+
+    def get_name(self, body, link=None):
+        if link is not None and link >= 0 and str((body, None, link)) in self.body_map:
+            return self.body_map[str((body, None, link))]
+        return self.body_map.get(str(body), str(body))
+
+    def _update_attached(self, attached):
+        attached = set(int(b) for b in attached if b >= 0)
+        for body in self.attached - attached:
+            ## the object was put down somewhere else
+            rows = np.nonzero(self.static_bodies == body)[0]
+            self.lower[rows], self.upper[rows] = _get_link_aabbs_list([self.static[i] for i in rows])
+        self.attached = attached
+
+    def check(self, t, attached=()):
+        import pybullet as p
+        self._update_attached(attached)
+        moving = [(self.robot, l) for l in self.robot_links] + \
+                 [(b, l) for b in self.attached for l in _get_links(b)]
+        lower, upper = _get_link_aabbs_list(moving)
+        lower -= self.cfree_range
+        upper += self.cfree_range
+        overlap = np.all((lower[:, None] <= self.upper[None]) & (upper[:, None] >= self.lower[None]), axis=-1)
+        overlap[:, np.isin(self.static_bodies, list(self.attached))] = False
+        clearance = self.cfree_range
+        for i, j in zip(*np.nonzero(overlap)):
+            (body_a, link_a), (body_b, link_b) = moving[i], self.static[j]
+            self.num_checked += 1
+            points = p.getClosestPoints(body_a, body_b, self.cfree_range, linkIndexA=link_a, linkIndexB=link_b)
+            if len(points) == 0:
+                continue
+            distance = min(pt[8] for pt in points)
+            clearance = min(clearance, distance)
+            name = self.get_name(body_b, link_b)
+            self.min_clearances[name] = min(self.min_clearances.get(name, self.cfree_range), distance)
+        self.clearances.append((t, clearance))
+        if clearance < 0:
+            self.collision_steps.append(t)
+        return clearance
+
+    def get_report(self):
+        steps, clearances = zip(*self.clearances) if len(self.clearances) > 0 else ((), ())
+        num_moving = len(self.robot_links) + 1
+        return dict(
+            cfree_range=self.cfree_range, num_steps=len(steps),
+            min_clearance=round(float(min(clearances)), 5) if len(clearances) > 0 else None,
+            min_clearance_step=int(steps[int(np.argmin(clearances))]) if len(clearances) > 0 else None,
+            collision_steps=_get_ranges(self.collision_steps),
+            num_pairs_checked=self.num_checked, num_pairs_all=num_moving * len(self.static) * len(steps),
+            min_clearances={k: round(float(v), 5) for k, v in sorted(self.min_clearances.items(), key=lambda x: x[1])},
+        )
+
+    def dump(self, file_path):
+        report = self.get_report()
+        with open(file_path, 'w') as f:
+            json.dump(report, f, indent=3)
+        return report
+
+
+def _get_link_aabbs_list(body_links):
+    import pybullet as p
+    if len(body_links) == 0:
+        return np.zeros((0, 3)), np.zeros((0, 3))
+    aabbs = [p.getAABB(body, link) for body, link in body_links]
+    return np.array([a[0] for a in aabbs], dtype=float), np.array([a[1] for a in aabbs], dtype=float)
+
+
+def audit_trajectory(traj, robot=None, cfree_range=0.1, out_file=None, ignored_names=('floor',), **kwargs):
+    """ replay the trajectory kinematically and record the clearances, kwargs go to `replay_trajectory` """
+    robot = traj.meta['robot'] if robot is None else robot
+    attached = get_attachment_trajectory(traj)
+    auditor = CollisionAuditor(robot, cfree_range=cfree_range, body_map=traj.body_map, ignored_names=ignored_names)
+    replay_trajectory(traj, robot=robot, frame_fn=lambda t: auditor.check(t, attached[t]), **kwargs)
+    report = auditor.dump(out_file) if out_file is not None else auditor.get_report()
+    print(f"audit_trajectory | min clearance {report['min_clearance']} at step {report['min_clearance_step']} "
+          f"| {len(report['collision_steps'])} collision intervals "
+          f"| {report['num_pairs_checked']} of {report['num_pairs_all']} pairs checked")
+    return report
+
+
+COLLISION_REPORT = 'collision_report.json'
+
+
+def audit_run_dir(run_dir, cfree_range=0.1, redo=False, **kwargs):
+    """ load the world of a run and write the clearances along its trajectory to collision_report.json """
+    out_file = join(run_dir, COLLISION_REPORT)
+    if isfile(out_file) and not redo:
+        return json.load(open(out_file, 'r'))
+    traj = load_trajectory(run_dir)
+    if traj is None:
+        print(f'audit_run_dir | no trajectory in {run_dir}')
+        return None
+    from lisdf_tools.lisdf_loader import load_lisdf_pybullet
+    from pybullet_tools.utils import reset_simulation
+    from dataset_utils import stage_run_dir, unstage_run_dir
+    from loading_utils import use_lisdf_cache
+    use_lisdf_cache()
+    staged_dir = stage_run_dir(run_dir, tag='auditing')
+    world = load_lisdf_pybullet(staged_dir, use_gui=False, verbose=False)
+    report = audit_trajectory(traj, robot=world.robot.body, cfree_range=cfree_range, out_file=out_file, **kwargs)
+    reset_simulation()
+    unstage_run_dir(staged_dir)
+    return report
+
+
+##################################################################################
+
+
+REPLAY_VIDEO = 'replay.mp4'
+
+
+def record_trajectory(traj, out_file, camera_spec, robot=None, width=1440, height=1120, fov=60,
+                      fps=20, name_to_body=None, **kwargs):
+    """ replay the trajectory kinematically and pipe one camera image per frame into an mp4,
+        no frame is written to disk, `camera_spec` is in any format of `image_utils.get_view_matrix`,
+        kwargs go to `replay_trajectory`, e.g. `frame_every` """
+    import pybullet as p
+    from image_utils import get_view_matrix
+    from video_utils import VideoWriter
+    view = get_view_matrix(camera_spec, name_to_body)
+    projection = p.computeProjectionMatrixFOV(fov, width / height, 0.01, 20)
+    renderer = p.ER_BULLET_HARDWARE_OPENGL if p.getConnectionInfo()['connectionMethod'] == p.GUI \
+        else p.ER_TINY_RENDERER
+
+    def write_frame(t):
+        rgb = p.getCameraImage(width, height, viewMatrix=view, projectionMatrix=projection, renderer=renderer,
+                               flags=p.ER_NO_SEGMENTATION_MASK)[2]
+        video.write(np.reshape(rgb, (height, width, 4)))
+
+    with VideoWriter(out_file, fps=fps) as video:
+        replay_trajectory(traj, robot=robot, frame_fn=write_frame, **kwargs)
+    print(f'record_trajectory | {video.num_frames} frames to {out_file}')
+    return out_file
+
+
+def record_run_dir(run_dir, out_file=None, camera_spec=None, redo=False, **kwargs):
+    """ load the world of a run and stream a replay of its trajectory into replay.mp4,
+        the camera is the first of `image_utils.get_camera_specs` unless given """
+    out_file = join(run_dir, REPLAY_VIDEO) if out_file is None else out_file
+    if isfile(out_file) and not redo:
+        return out_file
+    traj = load_trajectory(run_dir)
+    if traj is None:
+        print(f'record_run_dir | no trajectory in {run_dir}')
+        return None
+    from image_utils import get_camera_specs
+    if camera_spec is None:
+        specs = get_camera_specs(run_dir)
+        if len(specs) == 0:
+            print(f'record_run_dir | no camera given or saved in {run_dir}')
+            return None
+        camera_spec = specs[0]
+    from lisdf_tools.lisdf_loader import load_lisdf_pybullet
+    from pybullet_tools.utils import reset_simulation
+    from dataset_utils import stage_run_dir, unstage_run_dir
+    from loading_utils import use_lisdf_cache
+    use_lisdf_cache()
+    staged_dir = stage_run_dir(run_dir, tag='recording')
+    world = load_lisdf_pybullet(staged_dir, use_gui=False, verbose=False)
+    record_trajectory(traj, out_file, camera_spec, robot=world.robot.body, name_to_body=world.name_to_body, **kwargs)
+    reset_simulation()
+    unstage_run_dir(staged_dir)
+    return out_file
@@ -0,0 +1,242 @@
+import os
+import shutil
+import subprocess
+import numpy as np
+from os.path import isdir, dirname, abspath
+
+
+def get_ffmpeg_exe():
+    """ the system ffmpeg, or the binary shipped with `imageio-ffmpeg` """
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        try:
+            import imageio_ffmpeg
+            ffmpeg = imageio_ffmpeg.get_ffmpeg_exe()
+        except ImportError:
+            raise FileNotFoundError('ffmpeg not found, install it or `pip install imageio-ffmpeg`')
+    return ffmpeg
+
+
+def get_codec_args(codec='libx264', quality=23, preset='medium'):
+    """ `quality` is the crf for x264 / x265 / vp9 (lower is better), the qscale for other codecs """
+    if codec in ['libx264', 'libx265']:
+        return ['-c:v', codec, '-crf', str(quality), '-preset', preset]
+    if codec == 'libvpx-vp9':
+        return ['-c:v', codec, '-crf', str(quality), '-b:v', '0']
+    return ['-c:v', codec, '-q:v', str(quality)]
+
+
+class VideoWriter(object):
+    """ pipes raw rgb frames into an ffmpeg process, so memory and disk usage don't grow with the
+        number of frames and no intermediate images are written
+
+            with VideoWriter('replay.mp4', fps=20) as video:
+                for ...:
+                    video.write(rgb)  ## (height, width, 3 or 4) uint8
+    """
+
+    def __init__(self, out_file, fps=20, codec='libx264', quality=23, preset='medium',
+                 pix_fmt='yuv420p', extra_args=(), verbose=False):
+        self.out_file = abspath(out_file)
+        self.fps = fps
+        self.codec_args = get_codec_args(codec, quality, preset) + ['-pix_fmt', pix_fmt] + list(extra_args)
+        self.verbose = verbose
+        self.process = None
+        self.size = None
+        self.num_frames = 0
+
+    def _start(self, height, width):
+        if not isdir(dirname(self.out_file)):
+            os.makedirs(dirname(self.out_file), exist_ok=True)
+        self.size = (height, width)
+        ## yuv420p needs even dimensions
+        command = [get_ffmpeg_exe(), '-y', '-loglevel', 'error',
+                   '-f', 'rawvideo', '-vcodec', 'rawvideo', '-pix_fmt', 'rgb24',
+                   '-s', f'{width}x{height}', '-r', str(self.fps), '-i', '-', '-an',
+                   '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2'] + self.codec_args + [self.out_file]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                        stderr=None if self.verbose else subprocess.DEVNULL)
+
+    def write(self, frame):
+        frame = np.asarray(frame)
+        if frame.dtype != np.uint8:
+            frame = np.clip(frame, 0, 255).astype(np.uint8)
+        frame = frame[:, :, :3]  ## drop the alpha channel of pybullet images
+        if self.process is None:
+            self._start(*frame.shape[:2])
+        elif frame.shape[:2] != self.size:
+            raise ValueError(f'VideoWriter | frame size {frame.shape[:2]} differs from {self.size}')
+        try:
+            self.process.stdin.write(np.ascontiguousarray(frame).tobytes())
+        except BrokenPipeError:
+            raise RuntimeError(f'VideoWriter | ffmpeg exited with code {self.process.wait()}')
+        self.num_frames += 1
+
+    def close(self):
+        if self.process is None:
+            return None
+        self.process.stdin.close()
+        code = self.process.wait()
+        self.process = None
+        if code != 0:
+            raise RuntimeError(f'VideoWriter | ffmpeg exited with code {code}')
+        if self.verbose:
+            print(f'VideoWriter | saved {self.num_frames} frames to {self.out_file}')
+        return self.out_file
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def frames_to_mp4(frames, out_file, fps=20, **kwargs):
+    """ `frames` can be a generator, e.g. yielding camera images while the replay runs """
+    with VideoWriter(out_file, fps=fps, **kwargs) as video:
+        for frame in frames:
+            video.write(frame)
+    return out_file
+
+
+##################################################################################
+
+
+def iter_video_frames(video_file, fps=None):
+    """ decode one rgb frame at a time, keeping about `fps` frames per second if given """
+    import cv2
+    capture = cv2.VideoCapture(video_file)
+    source_fps = capture.get(cv2.CAP_PROP_FPS) or 30
+    step = 1 if fps is None or fps >= source_fps else source_fps / fps
+    index = 0
+    next_kept = 0
+    while True:
+        still_reading, image = capture.read()
+        if not still_reading:
+            break
+        if index >= next_kept:
+            next_kept += step
+            yield cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        index += 1
+    capture.release()
+
+
+def get_video_info(video_file):
+    """ frames per second and number of frames from the container header """
+    import cv2
+    capture = cv2.VideoCapture(video_file)
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30
+    num_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    capture.release()
+    return fps, num_frames
+
+
+def get_shared_palette(frames, num_samples=16, thumbnail_width=160, num_colors=256):
+    """ one palette for the whole gif, quantized from thumbnails of evenly spaced frames """
+    from PIL import Image
+    frames = list(frames)
+    if len(frames) > num_samples:
+        frames = [frames[int(i * len(frames) / num_samples)] for i in range(num_samples)]
+    thumbnails = []
+    for frame in frames:
+        image = Image.fromarray(frame)
+        height = max(1, int(image.height * thumbnail_width / image.width))
+        thumbnails.append(np.asarray(image.resize((thumbnail_width, height))))
+    mosaic = Image.fromarray(np.concatenate(thumbnails, axis=0))
+    return mosaic.quantize(colors=num_colors, method=Image.Quantize.MEDIANCUT)
+
+
+class GifWriter(object):
+    """ writes gif frames to disk as they come, all quantized to the same palette,
+        the loop is set in the gif header instead of post-processing the file """
+
+    def __init__(self, out_file, palette_image, duration=50, loop=0):
+        self.out_file = out_file
+        self.palette_image = palette_image
+        self.duration = duration
+        self.loop = loop
+        self.file = None
+        self.num_frames = 0
+
+    def write(self, frame):
+        from PIL import Image, GifImagePlugin
+        image = Image.fromarray(np.asarray(frame)[:, :, :3]).quantize(palette=self.palette_image)
+        if self.file is None:
+            self.file = open(self.out_file, 'wb')
+            header, _ = GifImagePlugin.getheader(image, info=dict(loop=self.loop, optimize=False))
+            for chunk in header:
+                self.file.write(chunk)
+        for chunk in GifImagePlugin.getdata(image, duration=self.duration):
+            self.file.write(chunk)
+        self.num_frames += 1
+
+    def close(self):
+        if self.file is not None:
+            self.file.write(b';')
+            self.file.close()
+            self.file = None
+        return self.out_file
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def mp4_to_gif(mp4_file, frame_folder=None, gif_file=None, fps=None, max_width=None, num_palette_samples=16,
+               loop=0):
+    """ stream the video into a looping gif without writing frames to disk or holding them in memory,
+        the video is decoded twice, once for the palette samples and once for the frames,
+        all frames are kept at 50 ms each unless `fps` is given, then frames are dropped to about `fps`,
+        `frame_folder` is no longer used since no frames are written """
+    from PIL import Image
+    gif_file = mp4_file.replace('.mp4', '.gif') if gif_file is None else gif_file
+    source_fps, num_frames = get_video_info(mp4_file)
+    if fps is not None:
+        fps = min(fps, source_fps)
+
+    def resize(frame):
+        if max_width is None or frame.shape[1] <= max_width:
+            return frame
+        height = int(frame.shape[0] * max_width / frame.shape[1])
+        return np.asarray(Image.fromarray(frame).resize((max_width, height), Image.LANCZOS))
+
+    every = max(1, int(num_frames * (fps or source_fps) / source_fps) // num_palette_samples)
+    samples = [resize(f) for i, f in enumerate(iter_video_frames(mp4_file, fps=fps)) if i % every == 0]
+    if len(samples) == 0:
+        raise ValueError(f'mp4_to_gif | no frames in {mp4_file}')
+    palette_image = get_shared_palette(samples, num_samples=num_palette_samples)
+
+    ## gif frame delays are in hundredths of a second
+    duration = 50 if fps is None else max(20, int(round(100 / fps)) * 10)
+    with GifWriter(gif_file, palette_image, duration=duration, loop=loop) as gif:
+        for frame in iter_video_frames(mp4_file, fps=fps):
+            gif.write(resize(frame))
+    print(f'converted mp4 to {gif_file} | {gif.num_frames} frames at {round(1000 / duration, 1)} fps')
+    return gif_file
+
+
+def set_gif_loop(gif_file, loop=0):
+    """ make an existing gif loop `loop` times (0 is forever) by editing its netscape extension in place """
+    data = bytearray(open(gif_file, 'rb').read())
+    offset = 13
+    if data[10] & 0x80:
+        offset += 3 * 2 ** ((data[10] & 7) + 1)
+    netscape = b'!\xff\x0bNETSCAPE2.0\x03\x01'
+    cursor = offset
+    while data[cursor:cursor + 1] == b'!':
+        if data[cursor:cursor + len(netscape)] == netscape:
+            data[cursor + len(netscape):cursor + len(netscape) + 2] = loop.to_bytes(2, 'little')
+            break
+        cursor += 2
+        while data[cursor] != 0:
+            cursor += data[cursor] + 1
+        cursor += 1
+    else:
+        data[offset:offset] = netscape + loop.to_bytes(2, 'little') + b'\x00'
+        data[:6] = b'GIF89a'  ## application extensions are not part of gif87a
+    tmp_file = gif_file + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_file, gif_file)
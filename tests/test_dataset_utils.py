@@ -0,0 +1,178 @@
+import os
+import sys
+import json
+from os.path import join, abspath, dirname
+
+sys.path.append(abspath(join(dirname(__file__), '..', 'examples')))
+
+from dataset_utils import _round_numbers, canonicalize_lisdf, update_fingerprint_index, find_duplicates, \
+    get_asset_aabb, get_worlds_aabb_streaming, query_catalog, sample_catalog_stratified, \
+    append_result, load_latest_results
+
+
+SCENE = """<?xml version="1.0" ?>
+<!-- generated {comment} -->
+<sdf version="1.9">
+  <world name="{world}">
+    <include name="pot">
+      <uri>../../assets/models/CookingPot/1/mobility.urdf</uri>
+      <static>false</static>
+      <pose>0.7 {y} 0.95 0.0 -0.0 1.571</pose>
+    </include>
+    <include name="counter">
+      <uri>../../assets/models/Counter/1/mobility.urdf</uri>
+      <static>true</static>
+      <pose>1.0 0.0 0.0 0.0 0.0 0.0</pose>
+    </include>
+  </world>
+</sdf>
+"""
+
+PROBLEM = """(define (problem {name})
+  (:domain pr2-tamp)
+  (:objects pot counter)
+  (:init (on pot counter))  ; initial state
+  (:goal (holding left pot))
+)
+"""
+
+
+def write_run(task_dir, name, y, world='kitchen', comment=''):
+    run_dir = join(task_dir, name)
+    os.makedirs(run_dir)
+    with open(join(run_dir, 'scene.lisdf'), 'w') as f:
+        f.write(SCENE.format(world=world, y=y, comment=comment))
+    with open(join(run_dir, 'problem.pddl'), 'w') as f:
+        f.write(PROBLEM.format(name=name))
+    return run_dir
+
+
+def test_round_numbers_keeps_sign():
+    assert _round_numbers('0.0 -0.05 0.05') == '0.0 -0.05 0.05'
+    assert _round_numbers('-0.0 -0.0001 1.23456') == '0.0 0.0 1.235'
+    assert _round_numbers('-1.5 -0.5') == '-1.5 -0.5'
+
+
+def test_canonicalize_lisdf_ignores_formatting(tmp_path):
+    a = write_run(str(tmp_path), 'a', '-0.05', world='kitchen_0101', comment='monday')
+    b = write_run(str(tmp_path), 'b', '-0.0500', world='kitchen_0202', comment='tuesday')
+    c = write_run(str(tmp_path), 'c', '0.05')
+    assert canonicalize_lisdf(join(a, 'scene.lisdf')) == canonicalize_lisdf(join(b, 'scene.lisdf'))
+    assert canonicalize_lisdf(join(a, 'scene.lisdf')) != canonicalize_lisdf(join(c, 'scene.lisdf'))
+
+
+def test_find_duplicates(tmp_path):
+    task_dir = join(str(tmp_path), 'task')
+    write_run(task_dir, '0', '-0.05', world='kitchen_0101')
+    write_run(task_dir, '1', '-0.050', world='kitchen_0202')
+    write_run(task_dir, '2', '0.05')
+    write_run(task_dir, '3', '0.0')
+    write_run(task_dir, '4', '-0.0')
+    hashes = update_fingerprint_index(str(tmp_path), ['task'], verbose=False)
+    assert len(hashes) == 5
+    duplicates = sorted(find_duplicates(hashes, ['task']))
+    assert duplicates == [[join('task', '0'), join('task', '1')], [join('task', '3'), join('task', '4')]]
+
+    ## the index is reused and stays the same when nothing changed
+    assert update_fingerprint_index(str(tmp_path), ['task'], verbose=False) == hashes
+
+
+def write_asset(asset_dir, name, meshes):
+    os.makedirs(asset_dir)
+    links = ''.join('<link name="{}"><collision><geometry><mesh filename="{}"/></geometry></collision></link>'.format(
+        i, mesh) for i, mesh in enumerate(meshes))
+    with open(join(asset_dir, name + '.urdf'), 'w') as f:
+        f.write('<robot name="{}">{}</robot>'.format(name, links))
+    return join(asset_dir, name + '.urdf')
+
+
+def write_scene(run_dir, urdf_files):
+    os.makedirs(run_dir)
+    includes = ''.join('<include name="{}"><uri>{}</uri><pose>{} 0 0 0 0 0</pose></include>'.format(
+        i, urdf_file, i) for i, urdf_file in enumerate(urdf_files))
+    with open(join(run_dir, 'scene.lisdf'), 'w') as f:
+        f.write('<sdf version="1.9"><world name="w">{}</world></sdf>'.format(includes))
+    return run_dir
+
+
+def test_skipped_meshes_are_reported(tmp_path):
+    box = write_asset(join(str(tmp_path), 'assets', 'box'), 'box', ['box.obj'])
+    with open(join(dirname(box), 'box.obj'), 'w') as f:
+        f.write('v 0 0 0\nv 1 1 1\n')
+    pot = write_asset(join(str(tmp_path), 'assets', 'pot'), 'pot', ['pot.dae', 'lid.obj'])
+    open(join(dirname(pot), 'pot.dae'), 'w').close()
+
+    assert get_asset_aabb(box) == (([0., 0., 0.], [1., 1., 1.]), [])
+    aabb, skipped = get_asset_aabb(pot)
+    assert aabb is None and sorted(reason for _, reason in skipped) == ['missing', 'unsupported']
+
+    ## the run with the dae mesh is left out of the bounds and returned for a fallback
+    data_dir = join(str(tmp_path), 'data')
+    run_dirs = [write_scene(join(data_dir, 'task', '0'), [box]), write_scene(join(data_dir, 'task', '1'), [box, pot])]
+    for _ in range(2):
+        aabb, run_aabbs, incomplete = get_worlds_aabb_streaming(run_dirs, data_dir, parallel=False)
+        assert aabb == ([0., 0., 0.], [1., 1., 1.]) and list(run_aabbs) == run_dirs[:1]
+        assert list(incomplete) == run_dirs[1:] and len(incomplete[run_dirs[1]]) == 2
+
+
+def write_planned_run(task_dir, name, cfree=None, plan_len=None):
+    run_dir = write_run(task_dir, name, '0.0')
+    with open(join(run_dir, 'planning_config.json'), 'w') as f:
+        json.dump(dict(cfree=cfree), f)
+    if plan_len is not None:
+        with open(join(run_dir, 'plan.json'), 'w') as f:
+            json.dump([dict(plan_len=plan_len, planning=1.5)], f)
+    return run_dir
+
+
+def test_query_catalog(tmp_path):
+    root = str(tmp_path)
+    short = write_planned_run(join(root, 'sink'), '0', cfree=0.5, plan_len=4)
+    long = write_planned_run(join(root, 'sink'), '1', cfree=0.5, plan_len=12)
+    unsolved = write_planned_run(join(root, 'sink'), '2')
+    other = write_planned_run(join(root, 'braiser'), '0', cfree=0.5, plan_len=4)
+    assert query_catalog(root, ['sink']) == [short, long, unsolved]
+    assert query_catalog(root, ['sink', 'braiser'], where='plan_len <= ?', params=(10,)) == [other, short]
+    assert query_catalog(root, ['sink'], where='cfree IS NULL') == [unsolved]
+
+    ## changed and removed runs are picked up on the next query
+    with open(join(unsolved, 'plan.json'), 'w') as f:
+        json.dump(dict(plan_len=6), f)
+    os.utime(join(unsolved, 'plan.json'), (os.path.getmtime(unsolved) + 10,) * 2)
+    os.rename(long, join(root, 'removed'))
+    assert query_catalog(root, ['sink'], where='plan_len <= ?', params=(10,)) == [short, unsolved]
+    assert query_catalog(root, ['sink'], update=False) == [short, unsolved]
+
+
+def test_sample_catalog_stratified(tmp_path):
+    root = str(tmp_path)
+    many = [write_planned_run(join(root, 'sink'), str(i), plan_len=4) for i in range(6)]
+    few = [write_planned_run(join(root, 'braiser'), '0', plan_len=4)]
+    write_planned_run(join(root, 'braiser'), '1')
+
+    ## each task gets half, the task with one matching run is drawn with replacement
+    dirs = sample_catalog_stratified(root, ['sink', 'braiser'], 6, where='plan_len IS NOT NULL')
+    assert len(dirs) == 6
+    assert len(set(dirs) & set(many)) == 3 and dirs.count(few[0]) == 3
+
+    ## a task without runs doesn't get its share moved to the others
+    dirs = sample_catalog_stratified(root, ['sink', 'empty'], 4)
+    assert len(dirs) == 2 and len(set(dirs) & set(many)) == 2
+
+
+def test_load_latest_results(tmp_path):
+    ledger = join(str(tmp_path), 'results.jsonl')
+    run_dir = join(str(tmp_path), 'task', '0')
+    append_result(ledger, run_dir, 'oracle', 'diverse', 'failed', 30, timestamp=1, max_time=30)
+    append_result(ledger, run_dir, 'oracle', 'diverse', 'solved', 12, timestamp=3, max_time=60)
+    append_result(ledger, run_dir, 'oracle', 'diverse', 'timeout', 60, timestamp=2, max_time=60)
+    append_result(ledger, run_dir, 'pvt', 'diverse', 'solved', 8, timestamp=1)
+    ## a line cut off by a crash is skipped
+    with open(ledger, 'a') as f:
+        f.write('{"run": "')
+
+    results = load_latest_results(ledger)
+    assert sorted(results) == [(run_dir, 'oracle', 'diverse'), (run_dir, 'pvt', 'diverse')]
+    latest = results[(run_dir, 'oracle', 'diverse')]
+    assert latest['status'] == 'solved' and latest['planning_time'] == 12 and latest['max_time'] == 60
+    assert load_latest_results(join(str(tmp_path), 'missing.jsonl')) == {}
@@ -0,0 +1,50 @@
+import sys
+from os.path import join, abspath, dirname
+
+import numpy as np
+import pytest
+
+sys.path.append(abspath(join(dirname(__file__), '..', 'examples')))
+
+from feature_utils import get_group_aabbs, compute_aabb_features, save_features, load_features, \
+    features_to_lines
+
+
+AABBS = {
+    (1, None): ((0., 0., 0.), (1., 1., 1.)),
+    (2, 0): ((2., -1., 0.), (3., 0., 1.)),
+    (2, 1): ((2.5, 0., 0.5), (3.5, 2., 1.5)),
+    (3, 4): ((-1., -1., -1.), (0., 0., 0.)),
+}
+
+
+def get_aabb(body, link):
+    return AABBS[(body, link)]
+
+
+def test_get_group_aabbs():
+    ## the links of a door are merged into one aabb, the groups around it are kept apart
+    lower, upper = get_group_aabbs([[(1, None)], [(2, 0), (2, 1)], [(3, 4)]], get_aabb)
+    assert lower.tolist() == [[0., 0., 0.], [2., -1., 0.], [-1., -1., -1.]]
+    assert upper.tolist() == [[1., 1., 1.], [3.5, 2., 1.5], [0., 0., 0.]]
+
+    lower, upper = get_group_aabbs([], get_aabb)
+    assert lower.shape == upper.shape == (0, 3)
+
+    with pytest.raises(ValueError):
+        get_group_aabbs([[(1, None)], [], [(3, 4)]], get_aabb)
+
+
+def test_aabb_features_round_trip(tmp_path):
+    movable_aabbs = get_group_aabbs([[(1, None)]], get_aabb)
+    region_aabbs = get_group_aabbs([[(2, 0), (2, 1)], [(3, 4)]], get_aabb)
+    features = compute_aabb_features(['pot'], movable_aabbs, ['door', 'sink'], region_aabbs)
+    assert features['aabb_width'].tolist() == [1., 3., 1.]
+    assert features['distance'].tolist() == [[0., 1.]]
+
+    file_path = join(str(tmp_path), 'features.npz')
+    save_features(file_path, features)
+    loaded = load_features(file_path)
+    assert int(loaded['version']) == 1 and list(loaded['aabb_names']) == ['pot', 'door', 'sink']
+    assert features_to_lines(dict(loaded, reachability_names=[], reachable=[])) == [
+        'aabby pot 1.0', 'aabby door 3.0', 'aabby sink 1.0', 'distancey pot door 0.0', 'distancey pot sink 1.0']
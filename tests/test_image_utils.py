@@ -0,0 +1,81 @@
+import os
+import sys
+from os.path import join, abspath, dirname, isfile, isdir
+
+import numpy as np
+from PIL import Image
+
+sys.path.append(abspath(join(dirname(__file__), '..', 'examples')))
+
+from image_utils import ImageWriter, background_image_saving, pack_labels, masks_from_segmentation, \
+    save_packed_seg, pack_seg_image_dir, PackedSegImages, SEG_BACKGROUND
+
+
+def test_image_writer(tmp_path):
+    rgb = np.zeros((8, 8, 3), dtype=np.uint8)
+    with ImageWriter(num_workers=2, max_pending=2) as writer:
+        for i in range(5):
+            writer.write(join(str(tmp_path), f'rgb_{i}.png'), rgb)
+    assert writer.written == 5 and all(isfile(join(str(tmp_path), f'rgb_{i}.png')) for i in range(5))
+
+
+def test_background_image_saving(tmp_path):
+    original_save, original_open = Image.Image.save, Image.open
+    path = join(str(tmp_path), 'rgb.png')
+    rgb = np.full((8, 8, 3), 100, dtype=np.uint8)
+    with background_image_saving() as writer:
+        Image.fromarray(rgb).save(path)
+        ## the caller reusing its buffer doesn't change the pending image
+        rgb[:] = 0
+        ## reading waits for the pending writes
+        assert np.asarray(Image.open(path))[0, 0, 0] == 100
+    assert writer.written == 1
+    assert Image.Image.save is original_save and Image.open is original_open
+
+
+def get_masks():
+    ## a body and one of its links, which overlap, and a second body
+    seg = np.array([[0, 19, 19 + (2 << 24)],
+                    [28 + (1 << 24), 28 + (2 << 24), 19 + (1 << 24)]])
+    return masks_from_segmentation(seg, [19, (19, None, 1), 28])
+
+
+def test_pack_labels():
+    masks = get_masks()
+    assert [m.tolist() for _, m in masks] == [[[False, True, True], [False, False, True]],
+                                               [[False, False, True], [False, False, False]],
+                                               [[False, False, False], [True, True, False]]]
+    labels, table = pack_labels(masks)
+    assert labels.dtype == np.uint16 and labels[0, 0] == 0 and table[0] == []
+    assert [sorted(table[i]) for i in labels.reshape(-1)] == [[], ['19'], ['(19, None, 1)', '19'],
+                                                                ['28'], ['28'], ['19']]
+    ## every mask is recovered from the labels
+    for key, mask in masks:
+        assert np.array_equal(np.isin(labels, [i for i, keys in enumerate(table) if key in keys]), mask)
+
+    ## without background pixels, label 0 is still kept for it
+    labels, table = pack_labels([('19', np.ones((2, 2), dtype=bool))])
+    assert table == [[], ['19']] and (labels == 1).all()
+
+
+def test_packed_seg_images(tmp_path):
+    masks = get_masks()
+    names = {'19': 'braiserbody', '(19, None, 1)': 'braiserbody::braiser_bottom', '28': 'pot'}
+    rgb = np.arange(2 * 3 * 3, dtype=np.uint8).reshape((2, 3, 3))
+    out_file = save_packed_seg(join(str(tmp_path), 'seg_images_0.npz'), masks, names, rgb=rgb)
+    packed = PackedSegImages(out_file)
+    assert np.array_equal(packed.get_mask('pot'), masks[2][1])
+    assert np.array_equal(packed.get_mask(19), masks[0][1])
+    image = packed.get_seg_image('braiserbody::braiser_bottom')
+    assert (image[0, 2] == rgb[0, 2]).all() and (image[0, 1] == SEG_BACKGROUND).all()
+
+    ## the per-object pngs pack into the same masks
+    seg_dir = join(str(tmp_path), 'seg_images_1')
+    os.makedirs(seg_dir)
+    Image.fromarray(rgb).save(join(seg_dir, 'seg_images_1_scene.png'))
+    for key, name in names.items():
+        Image.fromarray(packed.get_seg_image(key)).save(join(seg_dir, f'seg_images_1_[{key}]_{name}.png'))
+    repacked = PackedSegImages(pack_seg_image_dir(seg_dir, remove=True))
+    assert not isdir(seg_dir) and repacked.names == names
+    for key, _, mask in packed.iter_masks():
+        assert np.array_equal(repacked.get_mask(key), mask)
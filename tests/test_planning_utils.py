@@ -0,0 +1,177 @@
+import sys
+from os.path import join, abspath, dirname
+
+sys.path.append(abspath(join(dirname(__file__), '..', 'examples')))
+
+from dataset_utils import append_result
+from planning_utils import evaluate_time_limit, choose_time_limit, load_planning_history, BudgetAllocator, \
+    canonicalize_stream_input, StreamMemoizer, ReplicaChecker, solve_in_replicas
+
+
+DEFAULT = dict(downward_time=10, evaluation_time=60, max_plans=100, max_time=100)
+
+
+def test_timeouts_are_censored():
+    attempts = [(True, 5, None), (True, 8, None), (False, 20, 20), (False, 20, 20)]
+    ## at the limit the timeouts ran with, they are failures
+    assert evaluate_time_limit(attempts, 20) == (0.5, (5 + 8 + 20 + 20) / 4)
+    ## above it, they don't count against the longer limit
+    assert evaluate_time_limit(attempts, 60) == (1.0, (5 + 8) / 2)
+    ## failures without a timeout still do
+    assert evaluate_time_limit(attempts + [(False, 30, None)], 60)[0] == 2 / 3
+
+
+def test_choose_time_limit():
+    attempts = [(True, t, None) for t in [1, 2, 3, 4]] + [(True, 90, None)] + [(False, 100, None)] * 5
+    time_limit, success, cost = choose_time_limit(attempts, 100, overhead=10, min_success_ratio=0.5)
+    assert time_limit == 4 and success == 0.4
+
+    ## a longer limit is kept when shorter ones solve too few of what it solves
+    time_limit, success, cost = choose_time_limit(attempts, 100, overhead=10, min_success_ratio=0.9)
+    assert time_limit == 90 and success == 0.5
+
+    ## the longest limit that still reaches the target rate, 0.5 / 65 at 90 sec and 0.5 / 66 at 100 sec
+    time_limit, _, _ = choose_time_limit(attempts, 100, target_rate=0.0076, overhead=10, min_success_ratio=0)
+    assert time_limit == 90
+
+
+def test_choose_time_limit_after_timeouts(tmp_path):
+    ## a budget shrunk to 10 sec doesn't keep shrinking because of the timeouts it causes
+    ledger = join(str(tmp_path), 'results.jsonl')
+    for i, t in enumerate([2, 3, 40, 50]):
+        append_result(ledger, join(str(tmp_path), 'tt_braiser', str(i)), None, 'diverse', 'solved', t, max_time=100)
+    for i in range(4, 20):
+        append_result(ledger, join(str(tmp_path), 'tt_braiser', str(i)), None, 'diverse', 'timeout', 10.2, max_time=10)
+    attempts = load_planning_history(ledger)['tt_braiser']
+    assert attempts[-1] == (False, 10.2, 10)
+    time_limit, success, _ = choose_time_limit(attempts, 100, overhead=10)
+    assert time_limit == 50 and success == 1.0
+
+
+def test_plan_campaign(tmp_path):
+    ledger = join(str(tmp_path), 'results.jsonl')
+    for i in range(10):
+        append_result(ledger, join(str(tmp_path), 'tt_sink', str(i)), None, 'diverse', 'solved', 5, max_time=100)
+        append_result(ledger, join(str(tmp_path), 'tt_braiser', str(i)), None, 'diverse',
+                      'solved' if i < 5 else 'failed', 20, max_time=100)
+    allocator = BudgetAllocator(ledger, min_samples=5, overhead=10)
+
+    ## expected costs are 15 and 30 sec, the sink task solves more per second and goes first
+    allocation = allocator.plan_campaign({'tt_sink': 4, 'hh_braiser': 10, 'tt_unknown': 3}, 150, DEFAULT)
+    assert allocation == {'tt_sink': 4, 'hh_braiser': 3, 'tt_unknown': 0}
+    assert allocator.budgets['hh_braiser']['learned'] and not allocator.budgets['tt_unknown']['learned']
+
+    ## tasks without history get the default time limit once the others are done
+    allocation = allocator.plan_campaign({'tt_sink': 4, 'tt_unknown': 3}, 300, DEFAULT)
+    assert allocation == {'tt_sink': 4, 'tt_unknown': 2}
+
+
+class Position(object):
+    def __init__(self, body, joint, value):
+        self.body, self.joint, self.value = body, joint, value
+
+
+class BoundedGenerator(object):
+    """ the parts of pddlstream's `BoundedGenerator` that the planner relies on """
+
+    def __init__(self, generator, max_calls=float('inf')):
+        self.generator = generator
+        self.max_calls = max_calls
+        self.stopped = False
+        self.history = []
+
+    @property
+    def enumerated(self):
+        return self.stopped or len(self.history) >= self.max_calls
+
+    def __next__(self):
+        try:
+            self.history.append(next(self.generator))
+        except StopIteration:
+            self.stopped = True
+            raise
+        return self.history[-1]
+
+
+def test_canonicalize_stream_input():
+    assert canonicalize_stream_input(Position(1, 2, 0.50001)) == canonicalize_stream_input(Position(1, 2, 0.5))
+    assert canonicalize_stream_input(Position(1, 2, 0.5)) != canonicalize_stream_input(Position(1, 3, 0.5))
+
+
+def test_memoizer_keeps_bounded_generators():
+    calls = []
+
+    def sample_pose(body):
+        calls.append(body)
+        return BoundedGenerator(iter([('pose',)]), max_calls=1)
+
+    memoizer = StreamMemoizer()
+    sample_pose = memoizer.wrap('sample-pose', sample_pose)
+    first = sample_pose(Position(1, 2, 0.5))
+    assert isinstance(first, BoundedGenerator)
+    assert next(first) == ('pose',) and first.enumerated
+
+    ## equal inputs replay the first call's samples through a new bounded generator
+    second = sample_pose(Position(1, 2, 0.5))
+    assert isinstance(second, BoundedGenerator) and second.max_calls == 1 and not second.enumerated
+    assert next(second) == ('pose',) and second.enumerated
+    assert len(calls) == 1 and memoizer.get_summary()['hits'] == 1
+
+
+def test_memoizer_keys_fluents():
+    calls = []
+
+    def inverse_kinematics(arm, pose, fluents=[]):
+        calls.append(fluents)
+        return iter([(arm, len(fluents))])
+
+    memoizer = StreamMemoizer()
+    inverse_kinematics = memoizer.wrap('inverse-kinematics', inverse_kinematics)
+    obstacle = [('AtPose', 3, Position(3, None, (1.0, 0.0)))]
+    assert next(inverse_kinematics('left', Position(2, None, 0.5), fluents=obstacle)) == ('left', 1)
+    assert next(inverse_kinematics('left', Position(2, None, 0.5), fluents=list(obstacle))) == ('left', 1)
+    assert len(calls) == 1
+
+    ## a different obstacle pose, or none, is a different sample
+    moved = [('AtPose', 3, Position(3, None, (1.5, 0.0)))]
+    assert next(inverse_kinematics('left', Position(2, None, 0.5), fluents=moved)) == ('left', 1)
+    assert next(inverse_kinematics('left', Position(2, None, 0.5))) == ('left', 0)
+    assert len(calls) == 3
+
+
+class FeasibilityChecker(object):
+    def __init__(self):
+        self.checked = []
+
+    def __call__(self, plans):
+        self.checked += plans
+        return [p % 2 == 0 for p in plans]
+
+    def dump_log(self, log_file):
+        pass
+
+
+def test_replica_checker():
+    fcs = [FeasibilityChecker() for _ in range(3)]
+    replicas = [ReplicaChecker(fc, i, 3) for i, fc in enumerate(fcs)]
+    results = [r(list(range(7))) for r in replicas]
+    assert [fc.checked for fc in fcs] == [[0, 3, 6], [1, 4], [2, 5]]
+    assert results[0] == [True, False, False, False, False, False, True]
+    assert results[1] == [False, False, False, False, True, False, False]
+
+
+def test_solve_in_replicas_reports_unpicklable_solutions(tmp_path):
+    def solve_fn(fc):
+        ## only replica 1 finds a plan, with evaluations that can't be pickled
+        if fc.index == 1:
+            return ['move', 'pick'], 2, [lambda: None]
+        return None, 0, []
+
+    solution, _ = solve_in_replicas(solve_fn, FeasibilityChecker(), 2, str(tmp_path))
+    assert solution == (['move', 'pick'], 2, [])
+
+    def solve_fn(fc):
+        return [lambda: None], 2, []
+
+    solution, _ = solve_in_replicas(solve_fn, FeasibilityChecker(), 2, str(tmp_path))
+    assert solution == 'failed'
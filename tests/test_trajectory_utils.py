@@ -0,0 +1,87 @@
+import sys
+from os.path import join, abspath, dirname
+
+import numpy as np
+
+sys.path.append(abspath(join(dirname(__file__), '..', 'examples')))
+
+from trajectory_utils import commands_to_arrays, save_trajectory, Trajectory, get_joint_trajectory, \
+    get_attachment_trajectory, STEP_KINDS
+
+
+class Conf(object):
+    def __init__(self, body, joints, values):
+        self.body, self.joints, self.values = body, joints, values
+
+
+class Grasp(object):
+    def __init__(self, value, approach=None, grasp_type='top'):
+        self.value, self.approach, self.grasp_type = value, approach, grasp_type
+
+
+## named like the actions in world_builder.actions, which is all commands_to_arrays looks at
+class MoveBaseAction(object):
+    def __init__(self, conf):
+        self.conf = conf
+
+
+class MoveArmAction(MoveBaseAction):
+    pass
+
+
+class GripperAction(object):
+    def __init__(self, arm, position=None, extent=None):
+        self.arm, self.position, self.extent = arm, position, extent
+
+
+class AttachObjectAction(object):
+    def __init__(self, arm, grasp, object):
+        self.arm, self.grasp, self.object = arm, grasp, object
+
+
+class DetachObjectAction(object):
+    def __init__(self, arm, object):
+        self.arm, self.object = arm, object
+
+
+POSE = ((0.1, 0.2, 0.3), (0., 0., 0., 1.))
+
+
+def get_commands():
+    return [MoveBaseAction(Conf(1, [0, 1, 2], [0., 0., 0.])),
+            MoveArmAction(Conf(1, [10, 11], [0.5, 0.6])),
+            GripperAction('left', position=0.5),
+            AttachObjectAction('left', Grasp(POSE), 5),
+            MoveBaseAction(Conf(1, [0, 1, 2], [1., 0., 0.])),
+            GripperAction('left', extent=1),
+            DetachObjectAction('left', 5)]
+
+
+def test_commands_to_arrays():
+    arrays, meta = commands_to_arrays(get_commands())
+    steps = arrays['steps']
+    assert [STEP_KINDS[k] for k in steps['kind']] == ['base', 'arm', 'gripper', 'attach', 'base', 'gripper', 'detach']
+    assert meta['groups'] == [[0, 1, 2], [10, 11]] and meta['robot'] == 1
+    assert arrays['positions_0'].tolist() == [[0., 0., 0.], [1., 0., 0.]]
+    assert list(steps['row'][[0, 4]]) == [0, 1]
+
+    ## a gripper command with only an extent has no position
+    assert arrays['gripper'][0, 0] == 0.5 and np.isnan(arrays['gripper'][0, 1])
+    assert np.isnan(arrays['gripper'][1, 0]) and arrays['gripper'][1, 1] == 1.
+    assert arrays['attachments'][0, :7].tolist() == [0.1, 0.2, 0.3, 0., 0., 0., 1.]
+    assert np.isnan(arrays['attachments'][0, 7:]).all()
+
+
+def test_trajectory_round_trip(tmp_path):
+    out_dir = save_trajectory(get_commands(), join(str(tmp_path), 'trajectory'), body_map={5: 'pot'})
+    traj = Trajectory(out_dir)
+    assert len(traj) == 7 and traj.body_map == {'5': 'pot'}
+
+    joints, conf = get_joint_trajectory(traj, gripper_joints={'left': [20]})
+    assert joints == [0, 1, 2, 10, 11, 20]
+    assert np.isnan(conf[0, 3]) and conf[4].tolist() == [1., 0., 0., 0.5, 0.6, 0.5]
+    ## the extent-only gripper command keeps the previous position
+    assert conf[5, 5] == 0.5
+
+    attached = get_attachment_trajectory(traj)
+    assert attached[:, 0].tolist() == [-1, -1, -1, 5, 5, 5, -1]
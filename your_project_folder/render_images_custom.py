@@ -3,11 +3,20 @@ from config_custom import OUTPUT_PATH
 from data_generator.run_utils import process_all_tasks, parse_image_rendering_args
 from data_generator.image_generation import generate_segmented_images
 
+from examples.image_utils import pack_run_seg_images
+
 
 args = parse_image_rendering_args(task_name='custom_piginet_data')
+pack_seg = False  ## one label file per camera instead of one png per object per camera
+
+
+def generate_packed_segmented_images(run_dir, *args, **kwargs):
+    result = generate_segmented_images(run_dir, *args, **kwargs)
+    pack_run_seg_images(run_dir, remove=True)
+    return result
 
 
 if __name__ == "__main__":
     kwargs = dict(task_name=args.task, dataset_root=OUTPUT_PATH, path=args.path,
                   parallel=args.parallel, input_args=args)
-    process_all_tasks(generate_segmented_images, **kwargs)
+    process_all_tasks(generate_packed_segmented_images if pack_seg else generate_segmented_images, **kwargs)